@@ -1,24 +1,73 @@
+from bisect import bisect_left
 from collections import defaultdict
-import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import atexit
+import os
+import threading
 
-def recommend_swaps_per_timeslot(db_path):
+from db import get_connection
+from rooms import get_room_capacities
+from utils import slot_conflicts, parse_meeting_pattern
+
+# Engines available for the same-slot pass:
+#   greedy   -> most crowded class takes the roomiest class that fits
+#   matching -> optimal assignment per timeslot (most swaps, fewest wasted seats)
+SWAP_ENGINES = ("greedy", "matching")
+
+# Below this many crowded timeslots the process pool costs more than it saves
+PARALLEL_MIN_SLOTS = 32
+
+# Process pool kept alive between requests (None until first needed), and its size
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def recommend_swaps_per_timeslot(db_path, engine="greedy", workers=1, term=None):
     """
     This function will read the SQLite database, fetch all classes, and recommend swaps for each timeslot.
     For example if a specific timeslot within PKI has 1-2 classes that are full capacity it will try to 
     find a class that is not full capacity and suggest a swap. It will need to continue to do this until
     all classes enrollments are below the maximum capacity (unless its impossible to do so).
+
+    ``engine`` picks how crowded classes are paired with rooms in a timeslot
+    (see ``SWAP_ENGINES``). Timeslots are independent of each other, so with
+    ``workers`` > 1 they are solved across a process pool; inputs with fewer
+    than ``PARALLEL_MIN_SLOTS`` crowded timeslots are still solved serially.
+    Either way the results are merged in timeslot order, so they are the same.
+
+    With ``term`` only that term's classes are read; otherwise every class is.
+
+    Rooms of the inventory (see ``rooms``) that are empty in a timeslot are
+    candidates too: a crowded class can move into one without a swap.
     """
+    if engine not in SWAP_ENGINES:
+        raise ValueError(f"Unknown swap engine: {engine}")
+
+    recommendations = {}
+    couldnt_find_swap = []
+
+    slots = _load_slots(db_path, term)
+    free_rooms = _free_rooms(slots, get_room_capacities(db_path))
+    for slot, slot_recs, slot_unswappable in _solve_slots(slots, engine, workers, free_rooms):
+        if slot_recs:
+            recommendations[slot] = slot_recs
+        couldnt_find_swap.extend(slot_unswappable)
+
+    return recommendations, couldnt_find_swap
 
-    conn = sqlite3.connect(db_path)
-    cur  = conn.cursor()
+def _load_slots(db_path, term=None):
+    """
+    Read every class (of ``term``, if given) and group them by meeting
+    pattern (timeslot).
+    """
+    cur = get_connection(db_path).cursor()
     cur.execute("""
         SELECT id, course_number, room,
             meeting_pattern,
             enrollment, max_enrollment
         FROM classes
-    """)
+    """ + _term_filter("classes", term), _term_params(term))
     rows = cur.fetchall()
-    conn.close()
 
     # group classes by meeting pattern (timeslot)
     slots = defaultdict(list)
@@ -30,103 +79,396 @@ def recommend_swaps_per_timeslot(db_path):
             "enrollment": r[4],
             "capacity":   r[5]
         })
+    return slots
 
-    recommendations = {}
-    couldnt_find_swap = []
+def _free_rooms(slots, capacities):
+    """
+    Work out which rooms of the inventory are empty in each timeslot.
+
+    A room is only free in a timeslot if no class meets in it at an
+    overlapping time (``utils.slot_conflicts``). Timeslots that can't be
+    parsed ("Does Not Meet", ...) get no rooms.
+
+    :param slots: Classes grouped by timeslot (see ``_load_slots``).
+    :type slots: dict
+    :param capacities: ``{room: seats}`` (see ``rooms.get_room_capacities``).
+    :type capacities: dict
+    :return: ``{slot: [(seats, room), ...]}`` sorted by seats, only for
+        timeslots with a free room.
+    :rtype: dict
+    """
+    if not capacities:
+        return {}
+    names = list(slots)
+    conflicts = slot_conflicts(names)
+    # bit i set = room is used in timeslot i
+    used = defaultdict(int)
+    for i, slot in enumerate(names):
+        for c in slots[slot]:
+            used[c["room"]] |= 1 << i
+
+    inventory = sorted((seats, room) for room, seats in capacities.items())
+    free_rooms = {}
+    for i, slot in enumerate(names):
+        if not parse_meeting_pattern(slot or ""):
+            continue
+        free = [(seats, room) for seats, room in inventory if not used.get(room, 0) & conflicts[i]]
+        if free:
+            free_rooms[slot] = free
+    return free_rooms
+
+def _empty_targets(free):
+    """
+    Turn a timeslot's free rooms into targets for the same-slot pass: a
+    room without a class has no id and nobody enrolled.
+    """
+    return [{"id": None, "course_num": None, "room": room, "enrollment": 0, "capacity": seats}
+            for seats, room in free]
+
+def _target_key(target):
+    # classes are told apart by id, empty rooms by name
+    return target["id"] if target["id"] is not None else target["room"]
+
+def _solve_slots(slots, engine, workers=1, free_rooms=None):
+    """
+    Run the same-slot pass over every timeslot that has an overfull class.
+
+    :param free_rooms: Empty rooms per timeslot (see ``_free_rooms``).
+    :type free_rooms: dict, optional
+    :return: ``(slot, recommendations, unswappable)`` for each of those
+        timeslots, in timeslot order.
+    :rtype: list
+    """
+    solve_slot = _match_slot if engine == "matching" else _greedy_slot
+    free_rooms = free_rooms or {}
+
+    # timeslots without an overfull class have nothing to solve
+    crowded_slots = [slot for slot, classes in slots.items()
+                    if any(c["enrollment"] > c["capacity"] for c in classes)]
+    crowded_classes = [slots[slot] for slot in crowded_slots]
+    empty_rooms = [_empty_targets(free_rooms.get(slot, ())) for slot in crowded_slots]
+
+    if workers > 1 and len(crowded_slots) >= PARALLEL_MIN_SLOTS:
+        # hand each worker a few slots at a time, map keeps the input order
+        chunksize = max(1, len(crowded_slots) // (workers * 4))
+        # map submits every chunk straight away, so the pool can't be swapped out mid-way
+        with _pool_lock:
+            results = _get_pool(workers).map(solve_slot, crowded_slots, crowded_classes, empty_rooms, chunksize=chunksize)
+    else:
+        results = map(solve_slot, crowded_slots, crowded_classes, empty_rooms)
+
+    return [(slot, slot_recs, slot_unswappable)
+            for slot, (slot_recs, slot_unswappable) in zip(crowded_slots, results)]
+
+def _get_pool(workers):
+    """
+    Return the shared process pool, resized to ``workers`` processes.
+
+    Only one pool is kept: asking for another size shuts the old one down
+    (work already submitted to it still finishes). Call with ``_pool_lock``
+    held.
+    """
+    global _pool, _pool_workers
+    workers = min(workers, os.cpu_count() or 1)
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool, _pool_workers = ProcessPoolExecutor(max_workers=workers), workers
+    return _pool
+
+@atexit.register
+def _shutdown_pool():
+    """
+    Stop the pool's worker processes when the interpreter exits.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
 
-    for slot, classes in slots.items():
-        overfull = [c for c in classes if c["enrollment"] > c["capacity"]]
+def _can_swap(crowded, target):
+    """
+    Whether ``crowded`` and ``target`` can trade rooms within a timeslot.
+    """
+    return (target["room"] != crowded["room"]
+            and target["capacity"] >= crowded["enrollment"]
+            and crowded["capacity"] >= target["enrollment"])
 
-        # if no classes in this specific timeslot are full capacity
-        # then we don't need to do anything 
-        # and can skip to the next timeslot
-        if not overfull:
-            continue                               
+def _same_slot_rec(crowded, target):
+    """
+    Build the recommendation for swapping ``crowded`` into ``target``'s room
+    (or moving it there, when the room is empty and ``target_id`` is None).
+    """
+    if target["id"] is None:
+        return {
+            "crowded_id":     crowded["id"],
+            "crowded_room":   crowded["room"],
+            "crowded_class_name": crowded["course_num"],
+            "target_id":      None,
+            "target_room":    target["room"],
+            "target_class_name": None,
+            "reason": (f"{crowded['enrollment']} students need "
+                    f"{target['capacity']}-seat room; {target['room']} is empty")
+        }
+    return {
+        "crowded_id":     crowded["id"],
+        "crowded_room":   crowded["room"],
+        "crowded_class_name": crowded["course_num"],
+        "target_id":      target["id"],
+        "target_room":    target["room"],
+        "target_class_name": target["course_num"],
+        "reason": (f"{crowded['enrollment']} students need "
+                f"{target['capacity']}-seat room")
+    }
+
+def _unswappable(crowded, slot):
+    """
+    Entry for a crowded class that couldn't be swapped within ``slot``,
+    handed to the cross-slot pass.
+    """
+    return {
+        "id": crowded["id"],
+        "course_num": crowded["course_num"],
+        "room": crowded["room"],
+        "enrollment": crowded["enrollment"],
+        "capacity": crowded["capacity"],
+        "slot": slot
+    }
+
+def _greedy_slot(slot, classes, empty_rooms=()):
+    """
+    Greedy same-slot pass: the most crowded class takes the class (or empty
+    room) with the most spare seats that it can trade rooms with.
 
-        # rooms sorted by spare seats DESC
-        spare_sorted = sorted(
-            classes,
-            key=lambda c: c["capacity"] - c["enrollment"],
-            reverse=True
+    :return: ``(recommendations, crowded classes left without a swap)``
+    """
+    overfull = [c for c in classes if c["enrollment"] > c["capacity"]]
+
+    # if no classes in this specific timeslot are full capacity
+    # then we don't need to do anything 
+    # and can skip to the next timeslot
+    if not overfull:
+        return [], []
+
+    # rooms sorted by spare seats DESC
+    spare_sorted = sorted(
+        [*classes, *empty_rooms],
+        key=lambda c: c["capacity"] - c["enrollment"],
+        reverse=True
+    )
+
+    slot_recs   = []
+    couldnt_find_swap = []
+    used_target = set()                       
+
+    for crowded in sorted(overfull,
+                        key=lambda c: c["enrollment"],
+                        reverse=True):
+
+        target = next(
+            (
+                r for r in spare_sorted
+                if _can_swap(crowded, r)
+                and _target_key(r) not in used_target
+            ),
+            None
         )
 
-        slot_recs   = []
-        used_target = set()                       
+        if target:
+            slot_recs.append(_same_slot_rec(crowded, target))
+            used_target.add(_target_key(target))
+            spare_sorted.remove(target)
+        else:
+            # add the crowded class that failed to find a swap
+            # to the find swap list so we can try to find a swap
+            # in another timeslot
+            couldnt_find_swap.append(_unswappable(crowded, slot))
 
-        for crowded in sorted(overfull,
-                            key=lambda c: c["enrollment"],
-                            reverse=True):
+    return slot_recs, couldnt_find_swap
 
-            target = next(
-                (
-                    r for r in spare_sorted
-                    if r["room"] != crowded["room"]      
-                    and r["capacity"] >= crowded["enrollment"]
-                    and crowded["capacity"] >= r["enrollment"]
-                    and r["id"] not in used_target
-                ),
-                None
-            )
+def _match_slot(slot, classes, empty_rooms=()):
+    """
+    Matching same-slot pass: pairs crowded classes with rooms (occupied or
+    empty) through a minimum-cost assignment, so the most crowded classes
+    possible get a swap and, among those assignments, the fewest seats are
+    left empty.
 
-            if target:
-                slot_recs.append({
-                    "crowded_id":     crowded["id"],
-                    "crowded_room":   crowded["room"],
-                    "crowded_class_name": crowded["course_num"],
-                    "target_id":      target["id"],
-                    "target_room":    target["room"],
-                    "target_class_name": target["course_num"],
-                    "reason": (f"{crowded['enrollment']} students need "
-                            f"{target['capacity']}-seat room")
-                })
-                used_target.add(target["id"])
-                spare_sorted.remove(target)
-            else:
-                # add the crowded class that failed to find a swap
-                # to the find swap list so we can try to find a swap
-                # in another timeslot
-                couldnt_find_swap.append({
-                    "id": crowded["id"],
-                    "course_num": crowded["course_num"],
-                    "room": crowded["room"],
-                    "enrollment": crowded["enrollment"],
-                    "capacity": crowded["capacity"],
-                    "slot": slot
-                })
+    Runs in O(n^2 m) for n crowded classes and m rooms in the timeslot.
 
-        if slot_recs:
-            recommendations[slot] = slot_recs
+    :return: ``(recommendations, crowded classes left without a swap)``
+    """
+    overfull = sorted((c for c in classes if c["enrollment"] > c["capacity"]),
+                    key=lambda c: c["enrollment"],
+                    reverse=True)
+    if not overfull:
+        return [], []
+
+    # an overfull class can never take another overfull class's room
+    targets = [c for c in classes if c["enrollment"] <= c["capacity"]] + list(empty_rooms)
+
+    # wasted seats for every legal pairing
+    wasted = [[t["capacity"] - c["enrollment"] if _can_swap(c, t) else None
+            for t in targets]
+            for c in overfull]
+
+    # A missing pairing costs more than every legal pairing combined, so the
+    # cheapest assignment always makes as many swaps as possible first.
+    # Dummy columns let every crowded class be assigned when rooms run out.
+    worst = max((w for row in wasted for w in row if w is not None), default=0)
+    no_swap = (worst + 1) * len(overfull) + 1
+    columns = max(len(targets), len(overfull))
+    cost = [[w if w is not None else no_swap for w in row] + [no_swap] * (columns - len(targets))
+            for row in wasted]
+
+    slot_recs = []
+    couldnt_find_swap = []
+    for crowded, row, column in zip(overfull, wasted, _min_cost_assignment(cost)):
+        if column < len(targets) and row[column] is not None:
+            slot_recs.append(_same_slot_rec(crowded, targets[column]))
+        else:
+            couldnt_find_swap.append(_unswappable(crowded, slot))
 
-    return recommendations, couldnt_find_swap
+    return slot_recs, couldnt_find_swap
+
+def _min_cost_assignment(cost):
+    """
+    Hungarian algorithm for an n x m cost matrix with n <= m.
 
-def recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable):
+    :return: The column assigned to each row, minimizing the total cost.
+    :rtype: list
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float("inf")
+    # 1-indexed potentials, p[j] is the row matched to column j (0 = free)
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        # grow an alternating tree from row i until it reaches a free column
+        while p[j0] != 0:
+            used[j0] = True
+            i0 = p[j0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    reduced = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if reduced < minv[j]:
+                        minv[j] = reduced
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+        # flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assignment = [0] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            assignment[p[j] - 1] = j - 1
+    return assignment
+
+def recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable, term=None, same_slot=None):
     """
     Try to place still-crowded classes into another slot/room.
     A move is legal only if the crowded class's professor is free
     in the target slot AND the target professor stays conflict-free.
+
+    Candidates are looked up through an index instead of scanning every
+    class: each slot keeps its classes sorted by capacity (so a crowded
+    class only looks at rooms big enough for it, tightest fit first) and
+    each professor's schedule is a bitmap over the slots.
+
+    Slots are compared by their actual meeting times, so a professor
+    teaching "MW 10:30am-11:45am" is also busy for "M 10:30am-12pm". The
+    overlapping slots of every slot are worked out once up front
+    (``utils.slot_conflicts``), which turns each availability check into
+    an AND of two bitmaps.
+
+    With ``term`` only that term's classes are considered.
+
+    Empty rooms of the inventory count as well: a crowded class can move
+    into a room that's free in another timeslot (and big enough) without
+    swapping with anyone. Pass the same-slot recommendations as
+    ``same_slot``, so rooms they already fill aren't handed out twice.
     """
+    capacities = get_room_capacities(db_path)
+    free_rooms = _free_rooms(_load_slots(db_path, term), capacities) if capacities else {}
+    return _cross_slot_pass(_load_cross_slot_rows(db_path, term), not_swappable,
+                            free_rooms, _rooms_taken(same_slot or {}))
 
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT c.id, c.room, c.meeting_pattern,
-            c.enrollment, c.max_enrollment, c.course_number,
-            p.id                 AS professor_id
-            FROM   classes            c
-            JOIN   class_professors   cp ON cp.class_id = c.id
-            JOIN   professors         p  ON p.id = cp.professor_id
-        """)
-        rows = cur.fetchall()
+def _rooms_taken(same_slot):
+    """
+    ``(slot, room)`` of every empty room the same-slot recommendations fill.
+    """
+    return [(slot, rec["target_room"]) for slot, recs in same_slot.items()
+            for rec in recs if rec["target_id"] is None]
+
+def _term_filter(table, term):
+    """
+    ``WHERE`` clause limiting ``table`` to one term (empty for all terms).
+    """
+    return f" WHERE {table}.term = ?" if term is not None else ""
 
+def _term_params(term):
+    """
+    Parameters for ``_term_filter``.
+    """
+    return (term,) if term is not None else ()
+
+def _load_cross_slot_rows(db_path, term=None):
+    """
+    Read one row per (class, professor) pair for the cross-slot pass.
+    """
+    cur = get_connection(db_path).cursor()
+    cur.execute("""
+        SELECT c.id, c.room, c.meeting_pattern,
+        c.enrollment, c.max_enrollment, c.course_number,
+        p.id                 AS professor_id
+        FROM   classes            c
+        JOIN   class_professors   cp ON cp.class_id = c.id
+        JOIN   professors         p  ON p.id = cp.professor_id
+    """ + _term_filter("c", term), _term_params(term))
+    return cur.fetchall()
+
+def _cross_slot_pass(rows, not_swappable, free_rooms=None, taken=()):
+    """
+    Cross-slot pass over already loaded rows
+    (see ``recommended_swaps_if_no_swaps_in_same_timeslot``).
+
+    :param free_rooms: Empty rooms per timeslot (see ``_free_rooms``).
+    :type free_rooms: dict, optional
+    :param taken: ``(slot, room)`` of empty rooms that are already spoken for.
+    :type taken: list
+    """
+    free_rooms = free_rooms or {}
     # create dicts to hold class data
-    # and professor schedules
+    # and professor schedules (bit i set = busy in slot i,
+    # prof_load counts the professor's classes per slot)
     # and a list of classes in each slot
     classes = {}                         
-    class_prof = {}                        
-    prof_busy = defaultdict(set)           
+    slot_bit = {}
+    prof_busy = defaultdict(int)           
+    prof_load = defaultdict(lambda: defaultdict(int))
     slots = defaultdict(list)    
     swapped = set() # classes already swapped   
-    taken_target = set() # classes already in a target slot  
     
     for r in rows:
         c = {
@@ -139,10 +481,58 @@ def recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable):
             "course_num": r[5]
         }
         classes[c["id"]] = c
-        class_prof[c["id"]] = c["prof_id"]
-        prof_busy[c["prof_id"]].add(c["slot"])
+        bit = slot_bit.setdefault(c["slot"], 1 << len(slot_bit))
+        prof_busy[c["prof_id"]] |= bit
+        prof_load[c["prof_id"]][c["slot"]] += 1
         slots[c["slot"]].append(c)
 
+    # timeslots that only have empty rooms (no class with a professor) still
+    # need a bit, so their overlaps are known
+    for slot in free_rooms:
+        slot_bit.setdefault(slot, 1 << len(slot_bit))
+    for slot, _ in taken:
+        slot_bit.setdefault(slot, 1 << len(slot_bit))
+
+    # bitmap of the slots overlapping each slot (including itself)
+    slot_names = list(slot_bit)
+    overlaps = dict(zip(slot_names, slot_conflicts(slot_names)))
+
+    def busy_elsewhere(prof, slot):
+        """Slots the professor is busy in, once their class in ``slot`` moves out."""
+        if prof_load[prof][slot] == 1:
+            return prof_busy[prof] & ~slot_bit[slot]
+        return prof_busy[prof]
+
+    def move(prof, old_slot, new_slot):
+        """Move one of the professor's classes between slots."""
+        prof_load[prof][old_slot] -= 1
+        if not prof_load[prof][old_slot]:
+            prof_busy[prof] &= ~slot_bit[old_slot]
+        prof_load[prof][new_slot] += 1
+        prof_busy[prof] |= slot_bit[new_slot]
+
+    # per-slot candidate index: classes sorted by capacity, with a parallel
+    # list of capacities to bisect on
+    candidates_by_cap = {}
+    for slot, candidates in slots.items():
+        ordered = sorted(candidates, key=lambda t: t["cap"])
+        candidates_by_cap[slot] = ([t["cap"] for t in ordered], ordered)
+
+    # bit i set = the empty room was filled in (a slot overlapping) slot i
+    room_taken = defaultdict(int)
+    for slot, room in taken:
+        room_taken[room] |= slot_bit[slot]
+
+    def empty_room(slot, c):
+        """Smallest empty room in ``slot`` that fits ``c``, None if there is none."""
+        free = free_rooms.get(slot, ())
+        return next(((seats, room) for seats, room in free[bisect_left(free, (c["enroll"],)):]
+                     if room != c["room"] and not room_taken[room] & overlaps[slot]), None)
+
+    # timeslots with classes first (in the order they were read), then the
+    # ones that only have empty rooms
+    target_slots = list(dict.fromkeys([*candidates_by_cap, *free_rooms]))
+
     # remove classes that are already in a swap
     # and classes that are not over capacity
     recommendations = defaultdict(list)
@@ -151,24 +541,51 @@ def recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable):
         if crowded["id"] in swapped:          # already handled in a swap
             continue
 
-        c = classes[crowded["id"]]
+        c = classes.get(crowded["id"])
+        if c is None:
+            continue                         # no professor on record, can't check conflicts
         c_prof = c["prof_id"]
+        c_busy = busy_elsewhere(c_prof, c["slot"])
+        c_overlaps = overlaps[c["slot"]]
 
-        for slot, candidates in slots.items():
+        for slot in target_slots:
             if slot == c["slot"]:
                 continue                     # must be different slot
-            if slot in prof_busy[c_prof]:
+            if c_busy & overlaps[slot]:
                 continue                     # professor already busy
 
-            # candidate class / room large enough?
-            target = next((t for t in candidates
-                        if t["cap"] >= c["enroll"]
-                        and t["id"] not in swapped
-                        and t["id"] not in taken_target
+            # an empty room is the least disruptive, nobody else has to move
+            free = empty_room(slot, c)
+            if free:
+                seats, room = free
+                orig_slot, orig_room = c["slot"], c["room"]
+                c.update(slot=slot, room=room, cap=seats)
+                recommendations[orig_slot].append({
+                    "old_slot":       orig_slot,
+                    "new_slot":       slot,
+                    "crowded_id":     c["id"],
+                    "crowded_room":   orig_room,
+                    "crowded_class_name": c["course_num"],
+                    "target_class_name":  None,
+                    "target_id":      None,
+                    "target_room":    room,
+                    "reason": (f"{c['enroll']} students need {seats}-seat room; "
+                            f"{room} is empty and professor {c_prof} free at {slot}")
+                })
+                move(c_prof, orig_slot, slot)
+                room_taken[room] |= slot_bit[slot]
+                swapped.add(c["id"])
+                break
+
+            caps, ordered = candidates_by_cap.get(slot, ((), ()))
+
+            # candidate class / room large enough? only rooms with
+            # cap >= enroll are looked at, smallest first
+            target = next((t for t in ordered[bisect_left(caps, c["enroll"]):]
+                        if t["id"] not in swapped
                         and c["cap"] >= t["enroll"]
                         and t["room"] != c["room"]
-                        and (t["slot"] not in prof_busy[c_prof])
-                        and (c["slot"] not in prof_busy[t["prof_id"]])
+                        and not busy_elsewhere(t["prof_id"], slot) & c_overlaps
                         ), None)
 
             if target:
@@ -194,26 +611,135 @@ def recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable):
                     "reason": (f"{c['enroll']} students need {tgt_cap}-seat room; "
                             f"professor {c_prof} free at {tgt_slot}")
                 })
-                # 4. update slots mapping
-                slots[orig_slot].remove(c)         # remove c from its old slot list
-                slots[tgt_slot].append(c)          # add c to new slot list
-
-                slots[tgt_slot].remove(target)     # remove target from its old slot list
-                slots[orig_slot].append(target)    # add target to c's old slot
+                # 4. both classes are now part of a swap, so the candidate
+                # index skips them from here on and doesn't need re-sorting
 
                 # update professor schedules so later moves respect this swap
-                prof_busy[c_prof].add(tgt_slot)
-                prof_busy[target["prof_id"]].add(orig_slot)
+                move(c_prof, orig_slot, tgt_slot)
+                move(target["prof_id"], tgt_slot, orig_slot)
                 swapped.update({c["id"], target["id"]})
                 break                      
 
     return dict(recommendations)
 
 
+class RecommendationState:
+    """
+    Swap recommendations for one database, kept in memory so a single-class
+    enrollment change doesn't mean re-reading and re-solving everything.
+
+    The state is built once from the database (same results as running
+    ``recommend_swaps_per_timeslot`` followed by
+    ``recommended_swaps_if_no_swaps_in_same_timeslot``). After that,
+    ``update_enrollment`` only re-solves the timeslot of the changed class,
+    and only re-runs the cross-slot pass when the change can affect it.
+
+    ``generation`` is free for the caller to record which database write the
+    state matches (see ``db.get_generation``). With ``term`` the state only
+    covers that term's classes.
+    """
+
+    def __init__(self, db_path, engine="greedy", workers=1, generation=None, term=None):
+        if engine not in SWAP_ENGINES:
+            raise ValueError(f"Unknown swap engine: {engine}")
+        self.engine = engine
+        self.generation = generation
+        self.term = term
+
+        self.slots = _load_slots(db_path, term)
+        self.classes = {c["id"]: (slot, c) for slot, classes in self.slots.items() for c in classes}
+        # enrollment changes don't move classes, so the empty rooms stay put
+        self.free_rooms = _free_rooms(self.slots, get_room_capacities(db_path))
+        # per-slot same-slot results, only for timeslots that have some
+        self.slot_recs = {}
+        self.slot_unswappable = {}
+        for slot, slot_recs, slot_unswappable in _solve_slots(self.slots, engine, workers, self.free_rooms):
+            self._store_slot(slot, slot_recs, slot_unswappable)
+
+        self.cross_rows = _load_cross_slot_rows(db_path, term)
+        # positions of each class's rows, so enrollment changes can patch them
+        self.cross_row_positions = defaultdict(list)
+        for position, r in enumerate(self.cross_rows):
+            self.cross_row_positions[r[0]].append(position)
+
+        self.not_swappable = self._collect_not_swappable()
+        self.rooms_taken = _rooms_taken(self.slot_recs)
+        self.cross_slot = _cross_slot_pass(self.cross_rows, self.not_swappable, self.free_rooms, self.rooms_taken)
+
+    def _store_slot(self, slot, slot_recs, slot_unswappable):
+        # keep timeslot order stable, so the results match a full run
+        for results, value in ((self.slot_recs, slot_recs), (self.slot_unswappable, slot_unswappable)):
+            if value:
+                results[slot] = value
+            else:
+                results.pop(slot, None)
+
+    def _collect_not_swappable(self):
+        order = {slot: position for position, slot in enumerate(self.slots)}
+        return [c for slot in sorted(self.slot_unswappable, key=order.get)
+                for c in self.slot_unswappable[slot]]
+
+    def results(self):
+        """
+        Return ``(same_slot_swaps, not_swappable, cross_slot_recommendations)``.
+        """
+        order = {slot: position for position, slot in enumerate(self.slots)}
+        same_slot = {slot: self.slot_recs[slot] for slot in sorted(self.slot_recs, key=order.get)}
+        return same_slot, self.not_swappable, self.cross_slot
+
+    def update_enrollment(self, class_id, enrollment):
+        """
+        Apply a new enrollment count for one class.
+
+        :return: False if the class isn't known to this state (it should be
+            rebuilt from the database), True otherwise.
+        :rtype: bool
+        """
+        if class_id not in self.classes:
+            return False
+        slot, c = self.classes[class_id]
+        old_enrollment = c["enrollment"]
+        c["enrollment"] = enrollment
+        for position in self.cross_row_positions[class_id]:
+            r = self.cross_rows[position]
+            self.cross_rows[position] = (*r[:3], enrollment, *r[4:])
+
+        # only this class's timeslot can change its same-slot results
+        if any(other["enrollment"] > other["capacity"] for other in self.slots[slot]):
+            _, slot_recs, slot_unswappable = _solve_slots({slot: self.slots[slot]}, self.engine,
+                                                          free_rooms=self.free_rooms)[0]
+        else:
+            slot_recs, slot_unswappable = [], []
+        self._store_slot(slot, slot_recs, slot_unswappable)
+
+        not_swappable = self._collect_not_swappable()
+        rooms_taken = _rooms_taken(self.slot_recs)
+        if (not_swappable != self.not_swappable or rooms_taken != self.rooms_taken
+                or self._touches_cross_slot(c, old_enrollment)):
+            self.not_swappable = not_swappable
+            self.rooms_taken = rooms_taken
+            self.cross_slot = _cross_slot_pass(self.cross_rows, not_swappable, self.free_rooms, rooms_taken)
+        return True
+
+    def _touches_cross_slot(self, changed, old_enrollment):
+        """
+        Whether an enrollment change of a class outside the not-swappable
+        list can change the cross-slot results.
+        """
+        for recs in self.cross_slot.values():
+            for rec in recs:
+                if changed["id"] in (rec["crowded_id"], rec["target_id"]):
+                    return True
+        # the enrollment only matters for whether the class fits in a
+        # crowded class's room
+        for crowded in self.not_swappable:
+            if (crowded["capacity"] >= old_enrollment) != (crowded["capacity"] >= changed["enrollment"]):
+                return True
+        return False
+
+
 if __name__ == "__main__":
-    import sqlite3
     from app import app
-    import os
 
     DB_FILE = app.config["DB_FILE"] 
 
@@ -240,7 +766,7 @@ if __name__ == "__main__":
     else:
         print("\nNo classes left over capacity.")
 
-    cross = recommended_swaps_if_no_swaps_in_same_timeslot(DB_FILE, not_swappable)
+    cross = recommended_swaps_if_no_swaps_in_same_timeslot(DB_FILE, not_swappable, same_slot=same)
 
     if cross:
         print("\n=== CROSS-SLOT RECOMMENDATIONS ===")
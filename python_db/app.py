@@ -1,49 +1,143 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, stream_with_context
 from flask_cors import CORS
-import sqlite3
-import pandas as pd
 import os
 import csv
+import re
+import json
+import base64
+import sqlite3
+import io
+import zlib
 import datetime
+import threading
+import hashlib
 from pathlib import Path
-from werkzeug.utils import secure_filename
 
 # Importing utility functions from utils.py
-from utils import parse_instructor, get_or_create_professor, fix_csv
-from algorithm import recommend_swaps_per_timeslot, recommended_swaps_if_no_swaps_in_same_timeslot
+from utils import parse_instructor, group_crosslists, strip_trailing_empty, get_column_map
+from schema import migrate
+from db import get_connection, release_connections, get_generation, bump_generation, refresh_reassignment_candidates
+from algorithm import RecommendationState, SWAP_ENGINES
+from audit import AuditLog, query_audit
+from upload_store import store_upload, load_records
+from jobs import JobQueue, JOB_WORKERS
+from rooms import EmptyRoom, ROOMS_WORKBOOK, get_room_capacities, import_rooms
 # Importing the algorithm to get swap recommendations
 
 # Little overview of the imports above (uses):
 # flask → Web framework
 # flask-cors → Allows Vue to communicate with Flask
 # flask-sqlalchemy → ORM for SQLite
-# pandas → CSV parsing
 
 app = Flask(__name__)
 # Allow frontend requests using CORS from any origin
-CORS(app, supports_credentials=True)
+# (and let it read the pagination cursor of /classes)
+CORS(app, supports_credentials=True, expose_headers=["X-Next-Cursor"])
 
 # Our SQLite database file
 app.config["DB_FILE"] = "database.db"
+# Worker processes used to compute swap recommendations (1 = no process pool)
+app.config["SWAP_WORKERS"] = int(os.environ.get("SWAP_WORKERS", 1))
 # Document Uploads file
 BASE_DIR       = Path(__file__).resolve().parent          # folder that holds app.py
 AUDIT_DIR      = BASE_DIR / "audit_logs"
-AUDIT_DIR      = BASE_DIR / "audit_logs"
 UPLOAD_DIR     = BASE_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 AUDIT_DIR.mkdir(exist_ok=True)
 
-# Audit log file for swapped classes
-swap_file  = os.path.join(AUDIT_DIR, "section_swaps.txt")
-AUDIT_DIR.mkdir(exist_ok=True)
-
-# Audit log file for swapped classes
-swap_file  = os.path.join(AUDIT_DIR, "section_swaps.txt")
+# Audit log for swapped classes (the audit table, old entries are archived in AUDIT_DIR)
+audit_log = AuditLog(AUDIT_DIR)
+
+# Background imports of uploaded files (see POST /upload and GET /jobs/<id>)
+upload_jobs = JobQueue(int(os.environ.get("UPLOAD_WORKERS", JOB_WORKERS)))
+import_lock = threading.Lock()
+
+# Columns /classes can be sorted on
+CLASS_SORT_COLUMNS = ("id", "course_number", "section", "room", "meeting_pattern", "enrollment", "max_enrollment")
+
+# Related data /class/<id> and /classes/batch can include
+CLASS_INCLUDES = ("professors", "reassignments")
+
+# Columns of a possible reassignment (the registrar's ``source`` row stays internal)
+REASSIGNMENT_COLUMNS = ("id", "term", "course_number", "section", "course_title", "room", "meeting_pattern",
+                        "enrollment", "max_enrollment")
+
+# Largest page /classes hands out at once (and most classes per batch)
+MAX_CLASSES_PAGE = 1000
+
+# CSV columns written back on export, and the classes columns they come from
+EXPORT_COLUMNS = {
+    "Room": "room",
+    "Meeting Pattern": "meeting_pattern",
+    "Enrollment": "enrollment",
+    "Maximum Enrollment": "max_enrollment",
+}
+
+# How an upload is applied to the stored classes (see insert_csv_into_table)
+IMPORT_MODES = ("merge", "replace")
+# classes columns an upload writes, in the order they're kept in ``source``
+IMPORT_COLUMNS = ("course_title", "room", "meeting_pattern", "enrollment", "max_enrollment")
+# How often (in class rows) an import reports its progress
+IMPORT_PROGRESS_INTERVAL = 500
+
+# How many students over a room's capacity coordinators can still enroll
+ENROLLMENT_OVERFLOW = 9
+
+# Add (or remove) students in one statement: the bounds are checked by the
+# UPDATE itself, so there is no window between reading and writing the count
+ENROLLMENT_CHANGE = """
+    UPDATE classes SET enrollment = enrollment + :delta
+    WHERE id = :id
+    AND enrollment + :delta >= 0 -- can't remove students from an empty class
+    AND (:delta <= 0 OR enrollment + :delta <= max_enrollment + :overflow) -- only adding is capped
+    RETURNING enrollment, term
+"""
+
+# Write buffer for exported files, so a whole schedule goes out in a few large writes
+EXPORT_BUFFER_SIZE = 1 << 16
+
+# Serialized /swap-recommendations responses, keyed by (database, engine, term).
+# Each entry remembers the term's write generation it was computed at, so it's
+# only reused until the next upload, enrollment change or swap in that term.
+recommendation_cache = {}
+recommendation_cache_stats = {"hits": 0, "misses": 0}
+# In-memory recommendation state behind the cache, also keyed by
+# (database, engine, term). Enrollment changes patch it instead of dropping it.
+recommendation_states = {}
+recommendation_lock = threading.Lock()
+
+# Databases this process already brought up to the latest schema
+migrated_databases = set()
+migration_lock = threading.Lock()
+
+@app.before_request
+def migrate_database():
+    """
+    Run the pending migrations once per database, before its first request,
+    so no query has to check whether its tables exist.
+    """
+    db_path = app.config["DB_FILE"]
+    if db_path in migrated_databases:
+        return
+    with migration_lock:
+        if db_path not in migrated_databases:
+            migrate(get_connection(db_path))
+            migrated_databases.add(db_path)
+
+@app.teardown_appcontext
+def release_db_connections(exception=None):
+    """
+    Hand the request's database connections back to the pool, so the next
+    request (on whichever thread) reuses them.
+    """
+    release_connections()
 
 @app.route("/class/<int:class_id>/possible-reassignments", methods=["GET"])
 def get_possible_reassignments(class_id):
     """
-    Retrieve possible reassignments for a specific class.
+    Retrieve possible reassignments for a specific class, fewest available
+    seats first. An optional ``limit`` query parameter caps how many are
+    returned.
 
     :param class_id: ID of the class to fetch possible reassignments for.
     :type class_id: int
@@ -51,63 +145,253 @@ def get_possible_reassignments(class_id):
     :return: JSON response containing the list of possible reassignments.
     :rtype: flask.Response
     """
-    conn = sqlite3.connect(app.config["DB_FILE"])
-    conn.row_factory = sqlite3.Row # Enable row factory to access columns by name
-    cursor = conn.cursor()
+    try:
+        limit = parse_limit(request.args.get("limit"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    conn = get_connection(app.config["DB_FILE"])
+    return jsonify(load_reassignments(conn, [class_id], limit)[class_id]), 200
+
+def load_professors(conn, class_ids):
+    """
+    Fetch the professors of several classes with one query.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param class_ids: IDs of the classes.
+    :type class_ids: list
+    :return: ``{class id: [professor, ...]}``, with an entry for every ID.
+    :rtype: dict
+    """
+    professors = {class_id: [] for class_id in class_ids}
+    # the ids go in as one JSON array, so the statement is the same for any batch size
+    cursor = conn.execute("""
+        SELECT class_professors.class_id, professors.id, professors.first_name, professors.last_name, professors.p_id
+        FROM professors
+        JOIN class_professors ON professors.id = class_professors.professor_id
+        WHERE class_professors.class_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(class_ids),))
+    for row in cursor:
+        professors[row[0]].append({
+            "id": row[1],
+            "first_name": row[2],
+            "last_name": row[3],
+            "p_id": row[4]
+        })
+    return professors
 
-    cursor.execute("""
-        WITH target_class AS (
-                    SELECT id, meeting_pattern, enrollment,
-                    max_enrollment, room, course_number, course_title
-                    FROM classes
-                    WHERE id = ?
-                )
-                    SELECT b.*
-                    FROM classes b, target_class t
-                    WHERE b.id != t.id
-                    AND b.meeting_pattern = t.meeting_pattern -- same meeting times
-                    AND t.max_enrollment >= b.enrollment -- target class can accommodate the other class
-                    AND b.max_enrollment >= t.enrollment -- other class can accommodate the target class
-                    AND  NOT (b.enrollment = 0 AND b.max_enrollment = 0) -- ignore classes with no enrollment (they're remote classes)
-                ORDER BY (b.max_enrollment - b.enrollment) ASC -- sort by available seats
-    """, (class_id,))
-    partners = [dict(r) for r in cursor.fetchall()]
-    conn.close()
-    return jsonify(partners), 200
+def load_reassignments(conn, class_ids, limit=None):
+    """
+    Fetch the possible reassignments of several classes with one query.
+
+    A partner meets at the same time and both classes fit in each other's
+    room; partners are sorted by available seats, fewest first. They are
+    read from the ``reassignment_candidates`` table, which the writes keep
+    up to date, so this is an index lookup per class.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param class_ids: IDs of the classes.
+    :type class_ids: list
+    :param limit: Most partners to return per class.
+    :type limit: int, optional
+    :return: ``{class id: [partner, ...]}``, with an entry for every ID.
+    :rtype: dict
+    """
+    reassignments = {class_id: [] for class_id in class_ids}
+    cursor = conn.execute(f"""
+        SELECT ranked.reassignment_for, {', '.join('b.' + column for column in REASSIGNMENT_COLUMNS)}
+        FROM (
+            SELECT class_id AS reassignment_for, candidate_id,
+                   ROW_NUMBER() OVER (PARTITION BY class_id ORDER BY seats_available, candidate_id) AS position
+            FROM reassignment_candidates
+            WHERE class_id IN (SELECT value FROM json_each(?))
+        ) ranked
+        JOIN classes b ON b.id = ranked.candidate_id
+        WHERE ? IS NULL OR ranked.position <= ?
+        ORDER BY ranked.reassignment_for, ranked.position -- sort by available seats
+    """, (json.dumps(class_ids), limit, limit))
+
+    for row in cursor:
+        partner = dict(row)
+        reassignments[partner.pop("reassignment_for")].append(partner)
+    return reassignments
 
 @app.route("/classes", methods=["GET"])
 def get_classes():
     """
     Retrieve a list of classes from the database.
 
-    A connection to the SQLite database is established, and all records are fetched 
-    from the ``classes`` table. The attributes fetched are ``id``, ``section``, 
-    ``course_number``, and ``course_title``. These are returned as a JSON array.
+    The attributes fetched are ``id``, ``section``, ``course_number``,
+    ``course_title``, ``enrollment`` and ``max_enrollment``. These are
+    returned as a JSON array. Without any query parameters every class is
+    returned, in id order.
+
+    Optional query parameters:
+
+    * ``term`` - only classes of this term (default: the last uploaded term)
+    * ``course`` - only courses starting with this prefix (e.g. ``CSCI 1``)
+    * ``room`` / ``meeting_pattern`` - only classes in this room / timeslot
+    * ``over_capacity`` - ``true`` for classes with more students than seats only
+    * ``sort`` - one of ``CLASS_SORT_COLUMNS``, prefixed with ``-`` for descending
+    * ``limit`` - page size; the ``X-Next-Cursor`` header then holds the
+      ``after`` value for the next page (keyset pagination, so every page
+      is an index range scan no matter how deep it is)
+
+    The response carries an ``ETag`` built from the term's write
+    generation; a request with a matching ``If-None-Match`` gets a 304
+    without touching the classes table. Writes to other terms don't
+    change it.
 
     :return: JSON response containing the list of class objects along with an HTTP 200 status.
     :rtype: flask.Response
+
+    :status 200: Classes returned.
+    :status 304: Nothing changed since the ``If-None-Match`` ETag.
+    :status 400: Invalid filter, sort, limit or cursor.
     """
-    conn = sqlite3.connect(app.config["DB_FILE"])  # Connect to database
-    cursor = conn.cursor()
+    conn = get_connection(app.config["DB_FILE"])  # Connect to database
 
-    cursor.execute("SELECT id, section, course_number, course_title, enrollment, max_enrollment FROM classes")
-    rows = cursor.fetchall()
-    conn.close()
+    # Anything that changes the list also bumps the (term's) generation
+    term = resolve_term(conn, request.args.get("term"))
+    etag = f"classes-{term}-{get_generation(conn, term)}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        query, params, sort_column, limit = build_classes_query(request.args, term)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    rows = conn.execute(query, params).fetchall()
 
     # Serialize the data
-    classes = []
-    for row in rows:
-        class_data = {
-            "id": row[0],
-            "section": row[1],
-            "courseName": row[2],
-            "courseTitle": row[3], 
-            "currentEnrollment": row[4],
-            "maxEnrollment": row[5],
+    classes = [
+        {
+            "id": row["id"],
+            "section": row["section"],
+            "courseName": row["course_number"],
+            "courseTitle": row["course_title"],
+            "currentEnrollment": row["enrollment"],
+            "maxEnrollment": row["max_enrollment"],
         }
-        classes.append(class_data)
+        for row in rows[:limit]
+    ]
+
+    response = jsonify(classes)
+    if limit is not None and len(rows) > limit:
+        # one extra row was fetched, so there is another page after this one
+        last = rows[limit - 1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last[sort_column], last["id"])
+    response.set_etag(etag)
+    # let browsers keep the list, but check the ETag before reusing it
+    response.headers["Cache-Control"] = "no-cache"
+    return response, 200
+
+def build_classes_query(args, term=None):
+    """
+    Build the ``SELECT`` for ``/classes`` from its query parameters.
+
+    :param args: The request's query parameters.
+    :type args: werkzeug.datastructures.MultiDict
+    :param term: Only classes of this term (None for every class).
+    :type term: str, optional
+    :return: The query, its parameters, the column sorted on and the page
+        size (None when not paginated).
+    :rtype: tuple
+    :raises ValueError: If a parameter is invalid.
+    """
+    where = []
+    params = []
+
+    if term is not None:
+        where.append("term = ?")
+        params.append(term)
+    course = args.get("course")
+    if course:
+        # GLOB (unlike LIKE) is case sensitive, so the prefix can use the index
+        where.append("course_number GLOB ?")
+        params.append(re.sub(r"([*?\[])", r"[\1]", course) + "*")
+    for column in ("room", "meeting_pattern"):
+        if args.get(column):
+            where.append(f"{column} = ?")
+            params.append(args[column])
+    if args.get("over_capacity", "").lower() in ("1", "true", "yes"):
+        where.append("enrollment > max_enrollment")
+
+    sort = args.get("sort", "id")
+    descending = sort.startswith("-")
+    sort_column = sort.lstrip("-")
+    if sort_column not in CLASS_SORT_COLUMNS:
+        raise ValueError(f"Unknown sort, expected one of: {', '.join(CLASS_SORT_COLUMNS)}")
+    direction = "DESC" if descending else "ASC"
+
+    limit = parse_limit(args.get("limit"))
+
+    if args.get("after"):
+        value, last_id = decode_cursor(args["after"])
+        # ties on the sort column are broken by id, so the cursor is unique
+        where.append(f"({sort_column}, id) {'<' if descending else '>'} (?, ?)")
+        params.extend((value, last_id))
+
+    query = "SELECT id, section, course_number, course_title, enrollment, max_enrollment, room, meeting_pattern FROM classes"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += f" ORDER BY {sort_column} {direction}"
+    if sort_column != "id":
+        query += f", id {direction}"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit + 1)
+    return query, params, sort_column, limit
+
+def parse_limit(limit):
+    """
+    Parse a ``limit`` option, None when it isn't given.
+
+    :raises ValueError: If it isn't a number between 1 and ``MAX_CLASSES_PAGE``.
+    """
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be a number") from None
+    if not 1 <= limit <= MAX_CLASSES_PAGE:
+        raise ValueError(f"limit must be between 1 and {MAX_CLASSES_PAGE}")
+    return limit
+
+def encode_cursor(value, class_id):
+    """
+    Pack the last row of a page into an opaque ``after`` cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([value, class_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """
+    Unpack an ``after`` cursor into (sort value, class id).
+
+    :raises ValueError: If the cursor wasn't made by ``encode_cursor``.
+    """
+    try:
+        value, class_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor") from None
+    return value, int(class_id)
 
-    return jsonify(classes), 200
+def resolve_term(conn, term=None):
+    """
+    Return the term a read should be limited to: ``term`` if given,
+    otherwise the term of the last upload. None (no filter) for databases
+    without uploads.
+    """
+    if term:
+        return term
+    row = conn.execute("SELECT term FROM uploads WHERE term IS NOT NULL ORDER BY id DESC LIMIT 1").fetchone()
+    return row[0] if row else None
 
 @app.route("/class/<int:class_id>/professors", methods=["GET"])
 def get_professors(class_id):
@@ -120,29 +404,8 @@ def get_professors(class_id):
     :return: JSON response containing the list of professors for the specified class.
     :rtype: flask.Response
     """
-    conn = sqlite3.connect(app.config["DB_FILE"])
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT professors.id, professors.first_name, professors.last_name, professors.p_id
-        FROM professors
-        JOIN class_professors ON professors.id = class_professors.professor_id
-        WHERE class_professors.class_id = ?
-    """, (class_id,))
-
-    rows = cursor.fetchall()
-    conn.close()
-
-    professors = []
-    for row in rows:
-        professors.append({
-            "id": row[0],
-            "first_name": row[1],
-            "last_name": row[2],
-            "p_id": row[3]
-        })
-
-    return jsonify(professors), 200
+    conn = get_connection(app.config["DB_FILE"])
+    return jsonify(load_professors(conn, [class_id])[class_id]), 200
 
 # API Route to fetch class details by ID 
 @app.route("/class/<int:class_id>", methods=["GET"])
@@ -160,10 +423,20 @@ def get_class(class_id):
             
             * **200 OK** – If the class is found, returns a JSON object of class data.
             * **404 Not Found** – If the class is not found, returns a JSON error message.
+
+    Accepts an optional ``include`` query parameter, e.g.
+    ``include=professors,reassignments``, to get the class's professors and
+    possible reassignments in the same response.
     """
+    try:
+        include = parse_includes(request.args.get("include", ""))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     class_data = get_class_details(class_id)
     if class_data:
         # serialize and return class data if class is found
+        add_includes(get_connection(app.config["DB_FILE"]), {class_id: class_data}, include)
         return jsonify(class_data), 200
     else:
         # otherwise provide a 404 error and message along with it 
@@ -181,16 +454,25 @@ def get_class_details(class_id):
         dict:
             A dictionary of class details.
     """
-    conn = sqlite3.connect(app.config["DB_FILE"])  # Connect to database
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM classes WHERE id = ?", (class_id,))
-    # fetch just one row as theres only one class per id
-    row = cursor.fetchone()
-    conn.close()
+    conn = get_connection(app.config["DB_FILE"])  # Connect to database
+    return load_class_details(conn, [class_id]).get(class_id)
 
-    if row:
-        class_data = {
+def load_class_details(conn, class_ids):
+    """
+    Fetch the details of several classes with one query.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param class_ids: IDs of the classes.
+    :type class_ids: list
+    :return: ``{class id: class details}`` for the classes that exist.
+    :rtype: dict
+    """
+    cursor = conn.execute("SELECT * FROM classes WHERE id IN (SELECT value FROM json_each(?))",
+                          (json.dumps(class_ids),))
+    details = {}
+    for row in cursor:
+        details[row[0]] = {
             "id": row[0],
             "term": row[1],
             "courseName": row[2],
@@ -201,210 +483,378 @@ def get_class_details(class_id):
             "currentEnrollment": row[7],
             "maxEnrollment": row[8]
         }
-        return class_data
-    else:
-        return None
+    return details
+
+def parse_includes(include):
+    """
+    Parse an ``include`` option (comma separated string or list).
+
+    :raises ValueError: If something other than ``CLASS_INCLUDES`` is asked for.
+    """
+    if isinstance(include, str):
+        include = include.split(",")
+    include = {name.strip() for name in include if name.strip()}
+    unknown = include - set(CLASS_INCLUDES)
+    if unknown:
+        raise ValueError(f"Unknown include, expected any of: {', '.join(CLASS_INCLUDES)}")
+    return include
+
+def add_includes(conn, details, include, limit=None):
+    """
+    Attach the related data named in ``include`` to already loaded class
+    details, one query per kind of data for all classes together. ``limit``
+    caps the reassignments listed per class.
+    """
+    class_ids = list(details)
+    if "professors" in include:
+        for class_id, professors in load_professors(conn, class_ids).items():
+            details[class_id]["professors"] = professors
+    if "reassignments" in include:
+        for class_id, reassignments in load_reassignments(conn, class_ids, limit).items():
+            details[class_id]["reassignments"] = reassignments
+
+@app.route("/classes/batch", methods=["POST"])
+def get_classes_batch():
+    """
+    Retrieve the details of many classes in one request.
+
+    Expects a JSON body like ``{"ids": [1, 2, 3], "include": ["professors",
+    "reassignments"]}``, with an optional ``limit`` on the reassignments
+    listed per class. The details are loaded with one query, plus one
+    query per included kind of data, however many IDs are asked for.
+
+    :return: JSON object with the ``classes`` found (in the order asked for)
+        and the IDs that were ``missing``.
+    :rtype: flask.Response
+
+    :status 200: Classes returned.
+    :status 400: Invalid IDs or include.
+    """
+    data = request.get_json(silent=True) or {}
+    class_ids = data.get("ids")
+    if not isinstance(class_ids, list) or not all(type(class_id) is int for class_id in class_ids):
+        return jsonify({"message": "ids must be a list of class IDs"}), 400
+    if len(class_ids) > MAX_CLASSES_PAGE:
+        return jsonify({"message": f"At most {MAX_CLASSES_PAGE} classes can be fetched at once"}), 400
+    try:
+        include = parse_includes(data.get("include", []))
+        limit = parse_limit(data.get("limit"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    conn = get_connection(app.config["DB_FILE"])
+    details = load_class_details(conn, class_ids)
+    add_includes(conn, details, include, limit)
+
+    return jsonify({
+        "classes": [details[class_id] for class_id in dict.fromkeys(class_ids) if class_id in details],
+        "missing": [class_id for class_id in dict.fromkeys(class_ids) if class_id not in details],
+    }), 200
 
 # API Route to receive and handle CSV importing
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """
-    Upload and process a CSV file.
+    Upload a CSV file and queue it for import.
 
     .. note::
-        Expects a form field named ``file``.
+        Expects a form field named ``file``, and optionally ``mode``
+        (``merge``, the default, or ``replace``; see ``insert_csv_into_table``).
 
-    :return: JSON response indicating success or failure.
+    The file is stored as ``uploads/<sha256>.csv`` (see ``upload_store``),
+    then parsed and imported by a background job (see ``run_upload_job``),
+    so the request returns straight away. Poll ``GET /jobs/<id>`` for the
+    job's progress; once it's ``done`` its result says how many sections
+    were inserted, updated, deleted or unchanged.
+
+    :return: JSON response with the job's id and state.
     :rtype: flask.Response
+
+    :status 200: The file is what its terms were last imported from, so
+        nothing was queued (``merge`` only); the job is already ``done``.
+    :status 202: File stored and queued.
+    :status 400: No file, or unknown mode.
     """
     # check if file was uploaded
     if 'file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
+    mode = request.form.get("mode", "merge")
+    if mode not in IMPORT_MODES:
+        return jsonify({"error": f"Unknown import mode, expected one of: {', '.join(IMPORT_MODES)}"}), 400
     
     file = request.files['file']
-    global file_path # make sure the file path is global so we can access it later
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    file.save(file_path)  # Save file in uploads folder
-
-    # Parse CSV file
+    # Saved by content, so an identical file is stored (and parsed) only once
+    _, file_path = store_upload(UPLOAD_DIR, file.read())
+
+    # the same file as the last import of its terms has nothing new to merge
+    terms = get_current_upload_terms(get_connection(app.config["DB_FILE"]), file_path) if mode == "merge" else None
+    if terms:
+        conn = get_connection(app.config["DB_FILE"])
+        unchanged = conn.execute("SELECT COUNT(*) FROM classes WHERE term IN (SELECT value FROM json_each(?))",
+                                 (json.dumps(terms),)).fetchone()[0]
+        job = upload_jobs.record(file_path, {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": unchanged})
+        response = jsonify({"message": "File was already imported.", "file_path": file_path, "job": job.to_dict()})
+        response.headers["Location"] = f"/jobs/{job.id}"
+        return response, 200
+
+    # the job keeps its own file path and database, nothing is shared between uploads
+    job = upload_jobs.submit(file_path, run_upload_job, app.config["DB_FILE"], mode)
+    response = jsonify({"message": "File uploaded successfully!", "file_path": file_path, "job": job.to_dict()})
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return response, 202
+
+def run_upload_job(job, db_path, mode):
+    """
+    Import an upload; runs on an ``upload_jobs`` worker thread.
+
+    :param job: The job, for its file path and progress.
+    :type job: jobs.Job
+    :param db_path: Database to import into.
+    :type db_path: str
+    :param mode: ``merge`` or ``replace``.
+    :type mode: str
+    :return: The change counts from ``insert_csv_into_table``.
+    :rtype: dict
+    """
     try:
-        file_path = fix_csv(file_path) # Function call to fix the sheet for trailing commas
-        create_tables() # Create the tables in the database
-        course_data = parse_csv(file_path)  # Parse the CSV file
-        insert_csv_into_table(course_data) # Insert the parsed data into the database
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
-    
-    return jsonify({"message": "File uploaded successfully!", "file_path": file_path}), 200
+        job.update(phase="parsing")
+        create_tables(db_path) # Create the tables in the database
+        course_data = load_records(job.file_path, parse_csv)  # Parsed rows, cached per file
+        job.update(rows_total=len(course_data))
+
+        # Files are parsed side by side, but imports take turns: SQLite has one
+        # writer at a time, and a big term could outlast the busy timeout
+        with import_lock:
+            job.update(phase="importing")
+            return insert_csv_into_table(course_data, job.file_path, mode, db_path,
+                                         progress=lambda rows: job.update(rows_processed=rows))
+    finally:
+        # no request teardown on a worker thread, so hand the connection back here
+        release_connections()
 
-def create_tables():
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
     """
-    Create the ``classes`` table in the database.
+    Report the state of an upload job.
+
+    The response has the job's ``phase`` (``queued``, ``parsing``,
+    ``importing``, then ``done`` or ``failed``), ``rows_processed`` out of
+    ``rows_total``, any ``errors``, and once done the import's ``result``.
+
+    :param job_id: ID returned by ``POST /upload``.
+    :type job_id: str
+    :return: JSON response with the job's state.
+    :rtype: flask.Response
 
-    If it exists, it is dropped before re-creation.
+    :status 200: Job found.
+    :status 404: No such job (or it finished long ago).
     """
-    conn = sqlite3.connect(app.config["DB_FILE"])  # Connect to database
-    cursor = conn.cursor()
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
 
-    # Drop the 'classes' table if it exists
-    cursor.execute("DROP TABLE IF EXISTS classes")
-    cursor.execute("DROP TABLE IF EXISTS professors")
-    cursor.execute("DROP TABLE IF EXISTS class_professors")
-
-    # Now, create the 'classes' table
-    cursor.execute("""
-        CREATE TABLE classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            term TEXT,
-            course_number TEXT,
-            section TEXT,
-            course_title TEXT,
-            room TEXT,
-            meeting_pattern TEXT,
-            enrollment INTEGER,
-            max_enrollment INTEGER,
-            professor_id INTEGER,
-            UNIQUE (term, course_number, section)
-        )
-    """)
-
-    # Create the 'professors' table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS professors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                first_name TEXT,
-                last_name TEXT,
-                p_id TEXT
-            )
-        """)
-    
-    # Create the 'class_professors' table for many-to-many relationship
-    # between classes and professors
-    cursor.execute("""CREATE TABLE IF NOT EXISTS class_professors (
-            class_id INTEGER,
-            professor_id INTEGER,
-            FOREIGN KEY (class_id) REFERENCES classes(id),
-            FOREIGN KEY (professor_id) REFERENCES professors(id)
-            UNIQUE (class_id, professor_id)
-        )"""
-    )
+def create_tables(db_path=None):
+    """
+    Prepare the ``classes``, ``professors`` and ``class_professors`` tables
+    for a new upload.
 
-    conn.commit()  # Save changes
-    conn.close()
+    The schema is brought up to date through the versioned migrations in
+    ``schema.py``. Existing data is kept: several terms live side by side,
+    and ``insert_csv_into_table`` only writes what changed.
 
+    :param db_path: Database to prepare (default: ``DB_FILE``).
+    :type db_path: str, optional
+    """
+    conn = get_connection(db_path or app.config["DB_FILE"])  # Connect to database
+    migrate(conn)
 
-def insert_csv_into_table(course_data):
+
+def insert_csv_into_table(course_data, source_path=None, mode="merge", db_path=None, progress=None):
     """
-    Insert parsed CSV data into the ``classes`` table.
+    Import parsed CSV data into the ``classes`` table.
+
+    Rows are matched to the stored classes by ``(term, course_number,
+    section)`` and only the differences are written, all in one
+    transaction: new sections are inserted, changed ones updated and the
+    ones missing from the file deleted. Other terms are left alone, and so
+    are unchanged sections (ids, caches and reassignment candidates
+    included).
+
+    Every class keeps what the registrar's export last said about it (the
+    ``source`` column). In ``merge`` mode a column is only overwritten when
+    the registrar changed it since then, so rooms, timeslots and enrollments
+    changed by coordinators (swaps) survive re-uploads. In ``replace`` mode
+    the file wins for every column.
+
+    Professors are deduplicated through a dictionary keyed by
+    ``(first_name, last_name, p_id)`` instead of a ``SELECT`` per instructor.
 
     :param course_data: List of dictionaries with course info.
     :type course_data: list
+    :param source_path: Uploaded CSV the data came from. It is recorded in the
+        ``uploads`` table, in the same transaction, as the layout for exports.
+    :type source_path: str, optional
+    :param mode: ``merge`` or ``replace`` (see ``IMPORT_MODES``).
+    :type mode: str
+    :param db_path: Database to import into (default: ``DB_FILE``).
+    :type db_path: str, optional
+    :param progress: Called with the number of class rows processed so far,
+        every ``IMPORT_PROGRESS_INTERVAL`` rows and once at the end.
+    :type progress: callable, optional
+    :return: How many classes were ``inserted``, ``updated``, ``deleted``
+        and left ``unchanged``.
+    :rtype: dict
     """
-    conn = sqlite3.connect(app.config["DB_FILE"])
-    cursor = conn.cursor()
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode, expected one of: {', '.join(IMPORT_MODES)}")
 
-    # Start the crosslist checking and generating the dictionary dynamically based on if a class is crosslisted
-    cross_lists = {}
-    # Loop & check if a class is cross listed
-    for entry in course_data:
-        cross_list = entry.get("Cross-listings", "").strip()
-        if cross_list:
-            # reconstructing the key, take out spaces and split them with the "/", reconstruct to make sure everything works fine
-            courses = [course_num.strip() for course_num in cross_list.split('/')]
-            cross_list_key = " / ".join(sorted(courses))
-            # If there is a crosslist in the column and the key is not in the dictionary
-            if cross_list_key not in cross_lists:
-                #add it
-                cross_lists[cross_list_key] = []
-            cross_lists[cross_list_key].append(entry["Course"])
-
-    # for entry in course_data:
-    # added some crosslist stuff here to check if it is in the dictionary generated from above
-    for entry in course_data:
-        # Info to get to see if crosslisted
-        course = entry["Course"]
-        cross_list = entry.get("Cross-listings", "").strip()
-        if cross_list:
-            # same key stuff as above, just re constructing so the keys are universal
-            courses = [course_num.strip() for course_num in cross_list.split('/')]
-            cross_list_key = " / ".join(sorted(courses))
-        # This is where the check is to see if the class is 1- Cross listed in the column is a key in the dictionary, 2- if the course is a value in the key
-        if cross_list_key in cross_list and course in cross_lists[cross_list_key]:
-            # List to get which courses are crosslisted under one particular key, loop through course data once again and get all the courses and check each one to see if it is a course in one particular key
-            group_crosslists = []
-            for cross_list_entry in course_data:
-                if cross_list_entry["Course"] in cross_lists[cross_list_key]:
-                    group_crosslists.append(cross_list_entry)
-            # Take account all of enrollment and sum them up together, but this time looping through that list of all the course under one particular key
-            total_enrollment = sum(int(course["Enrollment"]) for course in group_crosslists)
-            total_max = sum(int(course["Maximum Enrollment"]) for course in group_crosslists)
-            # To properly get the sqlite statement
-            grouped_class = group_crosslists[0]
-            # There is an ignore statement as since the primary key was changed, it will error if it finds a duplicate, IGNORE will ignore the duplicates
-            cursor.execute("""INSERT OR IGNORE INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (grouped_class['Term'], cross_list_key, grouped_class['Section #'], grouped_class['Course Title'], grouped_class['Room'], grouped_class['Meeting Pattern'], total_enrollment, grouped_class["Cross-list Maximum"]))
-
-            # Get the newest class ID
-            class_id = cursor.lastrowid
+    conn = get_connection(db_path or app.config["DB_FILE"])
+    cursor = conn.cursor()
 
-            # Parse intstructor from csv and get needed info for adding to database
-            results = parse_instructor(grouped_class['Instructor'])
-
-            for professor_dict in results:
-                first_name = professor_dict['first_name']
-                last_name = professor_dict['last_name']
-                professor_id = professor_dict['p_id']
-
-                # Insert the class-professor relationship into the class_professors table and 
-                # add the professor to the database if they don't exist
-                get_or_create_professor(cursor, first_name, last_name, professor_id, class_id)
-        else:
-            # Insert non crosslisted class into the database
-            cursor.execute("""
-                INSERT OR IGNORE INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """, (entry['Term'], entry['Course'], entry['Section #'], entry['Course Title'], entry['Room'], entry['Meeting Pattern'], 
-                    int(entry['Enrollment']), int(entry['Maximum Enrollment'])))
-            # Get the newest class ID
-            class_id = cursor.lastrowid
+    # Crosslisted sections are collapsed into one row per group up front,
+    # so every class row is only visited once here
+    uploaded = {}
+    for entry in group_crosslists(course_data):
+        class_key = (entry['Term'], entry['Course'], entry['Section #'])
+        if class_key in uploaded:
+            # duplicate class, the database keeps the first one
+            continue
+        # same order as IMPORT_COLUMNS, plus the instructors
+        uploaded[class_key] = [entry['Course Title'], entry['Room'], entry['Meeting Pattern'],
+                               int(entry['Enrollment']), int(entry['Maximum Enrollment']), entry['Instructor']]
+
+    # The stored classes are read in the same (write) transaction the changes
+    # are made in, so two uploads of one term can't both diff a stale copy
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        terms = sorted({term for term, _, _ in uploaded})
+        cursor.execute(f"""
+            SELECT id, term, course_number, section, {', '.join(IMPORT_COLUMNS)}, source
+            FROM classes WHERE term IN (SELECT value FROM json_each(?))
+        """, (json.dumps(terms),))
+        stored = {tuple(row[1:4]): row for row in cursor.fetchall()}
+
+        # Ids are handed out here so links can be built before anything is written.
+        # They continue after the highest id ever used, so deleted classes'
+        # ids aren't handed out again
+        cursor.execute("""
+            SELECT MAX(COALESCE((SELECT MAX(id) FROM classes), 0),
+                       COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'classes'), 0))
+        """)
+        next_class_id = cursor.fetchone()[0] + 1
+
+        cursor.execute("SELECT id, first_name, last_name, p_id FROM professors")
+        professor_ids = {(first, last, p_id): prof_id for prof_id, first, last, p_id in cursor.fetchall()}
+        next_professor_id = max(professor_ids.values(), default=0) + 1
+
+        insert_rows = []
+        update_rows = []
+        relinked = []
+        professor_rows = []
+        link_rows = []
+        changed_terms = set()
+        unchanged = 0
+
+        for position, (class_key, source) in enumerate(uploaded.items()):
+            if progress is not None and position and position % IMPORT_PROGRESS_INTERVAL == 0:
+                progress(position)
+            values, instructor = source[:-1], source[-1]
+            row = stored.get(class_key)
+            link_professors = True
+            if row is None:
+                class_id = next_class_id
+                next_class_id += 1
+                insert_rows.append((class_id, *class_key, *values, json.dumps(source)))
+            else:
+                class_id = row["id"]
+                previous = json.loads(row["source"]) if row["source"] else None
+                current = [row[column] for column in IMPORT_COLUMNS]
+                if mode == "merge" and previous is not None:
+                    # keep whatever the registrar didn't change since the last upload
+                    values = [current[i] if value == previous[i] else value for i, value in enumerate(values)]
+                if values == current and previous == source:
+                    unchanged += 1
+                    continue
+                update_rows.append((*values, json.dumps(source), class_id))
+                # the links are only rebuilt when the instructors changed
+                link_professors = previous is None or previous[-1] != instructor
+                if link_professors:
+                    relinked.append(class_id)
+            changed_terms.add(class_key[0])
+            if not link_professors:
+                continue
 
             # Parse intstructor from csv and get needed info for adding to database
-            results = parse_instructor(entry['Instructor'])
-            
-            for professor_dict in results:
-                first_name = professor_dict['first_name']
-                last_name = professor_dict['last_name']
-                professor_id = professor_dict['p_id']
-
-                # Insert the class-professor relationship into the class_professors table and 
-                # add the professor to the database if they don't exist
-                get_or_create_professor(cursor, first_name, last_name, professor_id, class_id)
-                
-    conn.commit()
-    conn.close()
-
+            for professor_dict in parse_instructor(instructor):
+                professor_key = (professor_dict['first_name'], professor_dict['last_name'], professor_dict['p_id'])
+                professor_id = professor_ids.get(professor_key)
+                if professor_id is None:
+                    # first time this professor shows up, queue them for insertion
+                    professor_id = next_professor_id
+                    next_professor_id += 1
+                    professor_ids[professor_key] = professor_id
+                    professor_rows.append((professor_id, *professor_key))
+                link_rows.append((class_id, professor_id))
+
+        # sections that are gone from the registrar's export
+        deleted = [row["id"] for class_key, row in stored.items() if class_key not in uploaded]
+        changed_terms.update(stored[class_key][1] for class_key in stored if class_key not in uploaded)
+
+        if deleted or relinked:
+            gone = json.dumps(deleted + relinked)
+            cursor.execute("DELETE FROM class_professors WHERE class_id IN (SELECT value FROM json_each(?))", (gone,))
+            cursor.execute("DELETE FROM classes WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(deleted),))
+        cursor.executemany(f"""
+            INSERT INTO classes (id, term, course_number, section, {', '.join(IMPORT_COLUMNS)}, source)
+            VALUES ({', '.join('?' * (len(IMPORT_COLUMNS) + 5))})
+            """, insert_rows)
+        cursor.executemany(f"""
+            UPDATE classes SET {', '.join(f'{column} = ?' for column in IMPORT_COLUMNS)}, source = ?
+            WHERE id = ?
+            """, update_rows)
+        cursor.executemany("INSERT OR IGNORE INTO professors (id, first_name, last_name, p_id) VALUES (?, ?, ?, ?)",
+                           professor_rows)
+        cursor.executemany("INSERT OR IGNORE INTO class_professors (class_id, professor_id) VALUES (?, ?)",
+                           link_rows)
+        if deleted or relinked:
+            # professors that no longer teach anything
+            cursor.execute("DELETE FROM professors WHERE id NOT IN (SELECT professor_id FROM class_professors)")
+        if source_path is not None:
+            cursor.executemany("INSERT INTO uploads (file_path, term) VALUES (?, ?)",
+                               [(str(source_path), term) for term in terms])
+        if changed_terms:
+            changed = [row[0] for row in insert_rows] + [row[-1] for row in update_rows] + deleted
+            refresh_reassignment_candidates(conn, changed)
+            bump_generation(conn, changed_terms)
+
+    if progress is not None:
+        progress(len(uploaded))
     print("Data should now properly be inserted into the database from the csv file")
+    return {"inserted": len(insert_rows), "updated": len(update_rows), "deleted": len(deleted), "unchanged": unchanged}
 
 def parse_csv(csv_document):
     """
-    Parse the CSV file and return structured course data.
+    Parse the CSV file and yield structured course data.
 
-    Skips the first two lines before reading headers.
+    Skips the first two lines before reading headers. The file is read once:
+    trailing empty cells are trimmed while rows are read and each course
+    entry is yielded as soon as it is parsed, without an intermediate copy
+    of the file. ``utils.group_crosslists`` collects the entries before
+    grouping them, since crosslist groups can span the whole file.
 
     :param csv_document: Path to the CSV file.
     :type csv_document: str
-    :return: List of dictionaries representing each course entry.
-    :rtype: list
+    :return: Generator of dictionaries representing each course entry.
+    :rtype: generator
     """
-    course_data = []
     relevant_columns = ["Term", "Course", "Section #", "Course Title", "Room", 
                         "Meeting Pattern", "Enrollment", "Maximum Enrollment", 
                         "Cross-listings", "Instructor", "Cross-list Maximum"]
 
     # Read and process csv file
-    with open(csv_document, mode='r', encoding='utf-8') as infile:
-        reader = csv.reader(infile)
+    with open(csv_document, mode='r', newline='', encoding='utf-8') as infile:
+        reader = strip_trailing_empty(csv.reader(infile))
 
         # Skip first two lines (extra headers)
         next(reader)
@@ -413,32 +863,30 @@ def parse_csv(csv_document):
         # Read the actual headers
         headers = next(reader)
 
-        # Get the indexes of the relevant columns
-        col_indexes = {col: headers.index(col) for col in relevant_columns}
+        # Column positions are compiled once per layout
+        columns = get_column_map(headers)
+        min_length = columns.width(relevant_columns)
 
-        # Read and store rows as dictionaries
+        # Read and yield rows as dictionaries
         for row in reader:
             # Ensure row has enough columns before storing
-            if len(row) >= max(col_indexes.values()) + 1:
-                # appends information into a list of 
-                # dictionaries per class entry
-                course_data.append({
-                    "Term": row[col_indexes["Term"]],
-                    "Course": row[col_indexes["Course"]],
-                    "Section #": row[col_indexes["Section #"]],
-                    "Course Title": row[col_indexes["Course Title"]],
-                    "Room": row[col_indexes["Room"]],
-                    "Meeting Pattern": row[col_indexes["Meeting Pattern"]],
-                    "Enrollment": int(row[col_indexes["Enrollment"]]),  # Convert to int
-                    "Maximum Enrollment": int(row[col_indexes["Maximum Enrollment"]]),
-                    "Cross-listings": row[col_indexes["Cross-listings"]].strip(),
-                    "Instructor": row[col_indexes["Instructor"]].strip(),
-                    "Cross-list Maximum": int(row[col_indexes["Cross-list Maximum"]]) if row[col_indexes["Cross-list Maximum"]].strip() else 0
-
-                })
-    
-    # Returns a list of dicts (one dict per class entry)
-    return course_data
+            if len(row) >= min_length:
+                cross_list_max = columns.get(row, "Cross-list Maximum").strip()
+                # yields one dictionary per class entry
+                yield {
+                    "Term": columns.get(row, "Term"),
+                    "Course": columns.get(row, "Course"),
+                    "Section #": columns.get(row, "Section #"),
+                    "Course Title": columns.get(row, "Course Title"),
+                    "Room": columns.get(row, "Room"),
+                    "Meeting Pattern": columns.get(row, "Meeting Pattern"),
+                    "Enrollment": int(columns.get(row, "Enrollment")),  # Convert to int
+                    "Maximum Enrollment": int(columns.get(row, "Maximum Enrollment")),
+                    "Cross-listings": columns.get(row, "Cross-listings").strip(),
+                    "Instructor": columns.get(row, "Instructor").strip(),
+                    "Cross-list Maximum": int(cross_list_max) if cross_list_max else 0
+
+                }
 
 
 # API Route to update enrollment for a class
@@ -448,8 +896,12 @@ def update_enrollment(class_id):
     Update enrollment for a specific class by ID.
 
     Increments or decrements the enrollment number according to the request 
-    (``add`` or ``remove``). If the maximum capacity is reached, adding is not allowed. 
-    If enrollment is zero, removing is not allowed.
+    (``add`` or ``remove``), or sets it to the number given as the action. If the
+    maximum capacity is reached, adding is not allowed. If enrollment is zero,
+    removing is not allowed, and a negative number is rejected.
+
+    The check and the change are one conditional ``UPDATE``, so concurrent
+    clicks (from any number of server workers) can't overwrite each other.
 
     :param class_id: ID of the class to update.
     :type class_id: int
@@ -458,67 +910,187 @@ def update_enrollment(class_id):
     :rtype: flask.Response
 
     :status 200: Class found and enrollment updated successfully.
-    :status 400: Invalid update (e.g., class is full or empty).
+    :status 400: Invalid update (e.g., class is full or empty, or a negative number).
     :status 404: Class not found.
     """
     data = request.get_json()
     action = data.get("action")
 
-    conn = sqlite3.connect(app.config["DB_FILE"])  # Connect to database
-    cursor = conn.cursor()
-    cursor.execute("SELECT enrollment, max_enrollment FROM classes WHERE id = ?", (class_id,))
-    row = cursor.fetchone()
+    conn = get_connection(app.config["DB_FILE"])  # Connect to database
 
-    if not row:
-        conn.close()
-        return jsonify({"message": "Class not found"}), 404
-    
-    enrollment, max_enrollment = row
-
-    if action == "add":
-        if (enrollment + 1) <= (max_enrollment + 9):
-            enrollment += 1
-        else:
-            conn.close()
-            return jsonify({"message": "Class is full"}),
-    elif action == "remove":
-        if enrollment > 0:
-            enrollment -= 1
-        else:
-            conn.close()
-            return jsonify({"message": "Class is empty"}), 400
+    if action in ("add", "remove"):
+        statement, params = ENROLLMENT_CHANGE, {"id": class_id, "delta": 1 if action == "add" else -1,
+                                                "overflow": ENROLLMENT_OVERFLOW}
     else:
         try:
             enrollment = int(action)  # Set enrollment to a specific number
-        except ValueError:
-            conn.close()
+        except (TypeError, ValueError):
             return jsonify({"message": "Invalid action"}), 400
-        
-    cursor.execute("UPDATE classes SET enrollment = ? WHERE id = ?", (enrollment, class_id))
-    conn.commit()
-    conn.close()
+        if enrollment < 0:
+            return jsonify({"message": "Enrollment can't be negative"}), 400
+        statement, params = "UPDATE classes SET enrollment = :enrollment WHERE id = :id RETURNING enrollment, term", \
+            {"id": class_id, "enrollment": enrollment}
+
+    with conn:
+        row = conn.execute(statement, params).fetchone()
+        if row is None:
+            # nothing was updated, find out why
+            exists = conn.execute("SELECT 1 FROM classes WHERE id = ?", (class_id,)).fetchone()
+            if not exists:
+                return jsonify({"message": "Class not found"}), 404
+            return jsonify({"message": "Class is full" if action == "add" else "Class is empty"}), 400
+        enrollment, term = row
+        refresh_reassignment_candidates(conn, [class_id])
+        bump_generation(conn, [term])
+        generations = get_generations(conn, [term])
+
+    update_recommendation_states(app.config["DB_FILE"], generations, [(term, class_id, enrollment)])
 
     return jsonify({"enrollment": enrollment}), 200
 
+@app.route("/classes/update-enrollment", methods=["POST"])
+def update_enrollments():
+    """
+    Change the enrollment of many classes at once.
+
+    Expects a JSON body ``{"updates": [{"id": 1, "delta": 2}, {"id": 5, "delta": -1}, ...]}``.
+    Every change is a conditional ``UPDATE`` with the same rules as
+    ``update-enrollment`` (no more than ``ENROLLMENT_OVERFLOW`` students over
+    the room's capacity, never below zero), all in one transaction: if any
+    change is rejected, none are applied.
+
+    :return: JSON response with the new enrollment of every class, or the
+        rejected updates.
+    :rtype: flask.Response
+
+    :status 200: All changes applied.
+    :status 400: Invalid request body, or some changes were rejected.
+    """
+    data = request.get_json(silent=True) or {}
+    updates = data.get("updates")
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"message": "updates must be a non-empty list"}), 400
+    params = []
+    for position, update in enumerate(updates):
+        if not isinstance(update, dict) or type(update.get("id")) is not int or type(update.get("delta")) is not int:
+            return jsonify({"message": f"Update {position} needs an integer id and delta"}), 400
+        params.append({"id": update["id"], "delta": update["delta"], "overflow": ENROLLMENT_OVERFLOW})
+
+    conn = get_connection(app.config["DB_FILE"])
+    enrollments = {}
+    terms = {}
+    rejected = []
+    with conn:
+        for update in params:
+            row = conn.execute(ENROLLMENT_CHANGE, update).fetchone()
+            if row is None:
+                rejected.append({"id": update["id"], "delta": update["delta"]})
+            else:
+                enrollments[update["id"]], terms[update["id"]] = row
+        if rejected:
+            conn.rollback()
+            return jsonify({"message": "Some enrollment changes were rejected, nothing was applied.",
+                            "rejected": rejected}), 400
+        refresh_reassignment_candidates(conn, list(enrollments))
+        bump_generation(conn, terms.values())
+        generations = get_generations(conn, terms.values())
+
+    update_recommendation_states(app.config["DB_FILE"], generations,
+                                 [(terms[class_id], class_id, enrollment) for class_id, enrollment in enrollments.items()])
+
+    return jsonify({"enrollments": [{"id": class_id, "enrollment": enrollment}
+                                    for class_id, enrollment in enrollments.items()]}), 200
+
+def get_generations(conn, terms):
+    """
+    Return the generation of every term in ``terms``, plus the database's
+    own generation under the key None.
+    """
+    generations = {term: get_generation(conn, term) for term in set(terms)}
+    generations[None] = get_generation(conn)
+    return generations
+
+def update_recommendation_states(db_path, generations, changes):
+    """
+    Carry the in-memory swap recommendations over to new enrollment counts.
+
+    A state is only patched if it matches the write right before this one,
+    otherwise it is left stale and gets rebuilt on the next request. States
+    of terms the write didn't touch are left alone.
+
+    :param generations: New generations, see ``get_generations``.
+    :type generations: dict
+    :param changes: ``(term, class id, new enrollment)`` tuples.
+    :type changes: list
+    """
+    with recommendation_lock:
+        for (path, _, term), state in recommendation_states.items():
+            if path != db_path or term not in generations or state.generation != generations[term] - 1:
+                continue
+            term_changes = [(class_id, enrollment) for change_term, class_id, enrollment in changes
+                            if term is None or change_term == term]
+            if all(state.update_enrollment(class_id, enrollment) for class_id, enrollment in term_changes):
+                state.generation = generations[term]
+
 @app.route("/swap-recommendations", methods=["GET"])
 def get_swap_recommendations():
     """
     Run the algorithm to get swap recommendations for classes
     and show them to the user (class coordinators).
+
+    Accepts an optional ``engine`` query parameter for the same-slot pass:
+    ``greedy`` (default) or ``matching``, which finds the assignment that
+    resolves the most overfull classes with the fewest wasted seats, and an
+    optional ``term`` (default: the last uploaded term).
+
+    Responses are cached per term until the next write to that term's
+    schedule (upload, enrollment update or swap); the ``X-Cache`` header
+    says whether the response was a ``HIT`` or a ``MISS``.
+
+    :status 200: Recommendations computed.
+    :status 400: Unknown engine.
     """
 
     db_path = app.config["DB_FILE"]
+    engine = request.args.get("engine", "greedy")
+    if engine not in SWAP_ENGINES:
+        return jsonify({"message": f"Unknown engine, expected one of: {', '.join(SWAP_ENGINES)}"}), 400
+
+    # Reuse the last response if nothing was written since it was computed
+    conn = get_connection(db_path)
+    term = resolve_term(conn, request.args.get("term"))
+    generation = get_generation(conn, term)
+    key = (db_path, engine, term)
+    with recommendation_lock:
+        cached = recommendation_cache.get(key)
+        hit = cached is not None and cached[0] == generation
+        # request threads share the counters, so they're only touched under the lock
+        recommendation_cache_stats["hits" if hit else "misses"] += 1
+        stats = dict(recommendation_cache_stats)
+    if hit:
+        body, status = cached[1], "HIT"
+    else:
+        with recommendation_lock:
+            state = recommendation_states.get(key)
+            if state is None or state.generation != generation:
+                state = RecommendationState(db_path, engine, app.config["SWAP_WORKERS"], generation, term)
+                recommendation_states[key] = state
+            same_slot_swaps, _, cross_slot_recommendations = state.results()
+
+        # Combine the recommendations into a single response
+        body = app.json.dumps(
+            {
+                "same_slot_swaps": same_slot_swaps,
+                "cross_slot_recommendations": cross_slot_recommendations,
+            }
+        )
+        recommendation_cache[key] = (generation, body)
+        status = "MISS"
 
-    same_slot_swaps, not_swappable = recommend_swaps_per_timeslot(db_path)
-    cross_slot_recommendations = recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable)
-
-    # Combine the recommendations into a single response
-    return jsonify(
-        {
-            "same_slot_swaps": same_slot_swaps,
-            "cross_slot_recommendations": cross_slot_recommendations,
-        }
-    ), 200
+    app.logger.debug("swap-recommendations cache %s (term %s, generation %s, %s)", status, term, generation, stats)
+    response = app.response_class(body, mimetype="application/json")
+    response.headers["X-Cache"] = status
+    return response, 200
 
 # API Route to swap (relevant) class data
 @app.route("/swap-classrooms", methods=["POST"])
@@ -526,7 +1098,9 @@ def swap_classes():
     """
     Swaps two classes' data.
     
-    Both classes have to reside in the database.
+    Both classes have to reside in the database. Without a ``target_id``
+    but with a ``target_room`` (and ``new_slot``), the class is moved into
+    that empty room instead.
 
     :return: JSON response indicating success or an error message.
     :rtype: flask.Response
@@ -539,146 +1113,500 @@ def swap_classes():
     class_id = data.get("crowded_id")
     swap_id = data.get("target_id")
     different_timeslot = bool(data.get("different_timeslot"))
+    if swap_id is None and data.get("target_room") is not None:
+        room = data["target_room"]
+        capacities = get_room_capacities(app.config["DB_FILE"])
+        if room not in capacities:
+            return jsonify({'error': 'Room is not in the room inventory.'}), 400
+        swap_id = EmptyRoom(room, capacities[room], data.get("new_slot"))
+        different_timeslot = swap_id.slot is not None
+
+    try:
+        audit_entries = apply_swaps(get_connection(app.config["DB_FILE"]), [(class_id, swap_id, different_timeslot)])
+    except LookupError:
+        # realistically this shouldn't hit
+        return jsonify('Could not find one of the classes.', 404)
+    except Exception:
+        return jsonify('Failed to insert changes into the database.', 400)
+
+    audit_log.record(app.config["DB_FILE"], audit_entries)
+    return jsonify('Successfully swapped classes.', 200)
+
+@app.route("/swap-classrooms/batch", methods=["POST"])
+def swap_classes_batch():
+    """
+    Apply a list of swaps at once, all or nothing.
+
+    Expects a JSON body ``{"swaps": [{"crowded_id": 1, "target_id": 2,
+    "different_timeslot": false}, ...]}``. The body of ``/swap-recommendations``
+    is accepted as is too; recommendations that move a class to a
+    ``new_slot`` are different-timeslot swaps, and ones with a ``target_room``
+    but no ``target_id`` move the class into that empty room.
+
+    Swaps are applied in order (a class may be part of several), written in
+    a single transaction and handed to the audit log together.
+    If any swap is invalid, nothing is changed.
 
-    # Get current class details
-    c1 = get_class_details(class_id)
-    c2 = get_class_details(swap_id)
+    :return: JSON response with the number of swaps applied, or an error message.
+    :rtype: flask.Response
+
+    :status 200: All swaps applied.
+    :status 400: Invalid request body, or the database write failed.
+    :status 404: One of the classes was not found.
+    """
+    data = request.get_json(silent=True) or {}
+    swaps = data.get("swaps")
+    if swaps is None:
+        # full /swap-recommendations response
+        swaps = [
+            recommendation
+            for key in ("same_slot_swaps", "cross_slot_recommendations")
+            for recommendations in (data.get(key) or {}).values()
+            for recommendation in recommendations
+        ]
+
+    if not isinstance(swaps, list) or not swaps:
+        return jsonify({"message": "swaps must be a non-empty list"}), 400
+    capacities = get_room_capacities(app.config["DB_FILE"])
+    pairs = []
+    for position, swap in enumerate(swaps):
+        if not isinstance(swap, dict):
+            return jsonify({"message": f"Swap {position} is not an object"}), 400
+        try:
+            pairs.append(parse_swap(swap, capacities))
+        except ValueError as e:
+            return jsonify({"message": f"Swap {position} {e}"}), 400
+
+    try:
+        audit_entries = apply_swaps(get_connection(app.config["DB_FILE"]), pairs)
+    except LookupError as e:
+        return jsonify({"message": f"Could not find classes: {e.args[0]}"}), 404
+    except sqlite3.Error:
+        return jsonify({"message": "Failed to insert changes into the database."}), 400
+
+    audit_log.record(app.config["DB_FILE"], audit_entries)
+    return jsonify({"message": "Successfully swapped classes.", "swapped": len(pairs)}), 200
+
+def apply_swaps(conn, swaps):
+    """
+    Swap rooms (and timeslots) for a list of class pairs in one transaction.
+
+    Every class is loaded with one query, the swaps are applied to the
+    loaded details in order, and the classes that changed are written back
+    together with the reassignment candidates and the write generation.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param swaps: ``(crowded id, target id, different timeslot)`` tuples.
+        The target can also be an ``rooms.EmptyRoom`` the crowded class
+        moves into (at the room's ``slot`` when the timeslot changes).
+    :type swaps: list
+    :return: One audit entry per swap, for ``audit_log.record``.
+    :rtype: list
+    :raises LookupError: If a class doesn't exist (with the missing IDs).
+    """
+    class_ids = list(dict.fromkeys(class_id for swap in swaps for class_id in swap[:2]
+                                   if not isinstance(class_id, EmptyRoom)))
+    details = load_class_details(conn, class_ids)
+    missing = [class_id for class_id in class_ids if class_id not in details]
+    if missing:
+        raise LookupError(missing)
+
+    audit_entries = []
+    for class_id, swap_id, different_timeslot in swaps:
+        if isinstance(swap_id, EmptyRoom):
+            audit_entries.append(move_to_room(details[class_id], swap_id, different_timeslot))
+            continue
+        c1, c2 = details[class_id], details[swap_id]
+
+        audit_entries.append({
+            "action": "different-slot swap" if different_timeslot else "same-slot swap",
+            "class_id": c1["id"],
+            "target_id": c2["id"],
+            "course": c1["courseName"],
+            "target_course": c2["courseName"],
+            # the crowded class moves from its room into the target's room
+            "from_room": c1["room"],
+            "to_room": c2["room"],
+            "from_time": c1["time"],
+            "to_time": c2["time"] if different_timeslot else c1["time"],
+        })
 
-    if c1 and c2:
         # Only the max enrollment and room location need to be swapped
-        temp = [c2["maxEnrollment"], c2["room"]]
-        c2["maxEnrollment"] = c1["maxEnrollment"]
-        c2["room"] = c1["room"]
-        c1["maxEnrollment"] = temp[0]
-        c1["room"] = temp[1]
+        c1["maxEnrollment"], c2["maxEnrollment"] = c2["maxEnrollment"], c1["maxEnrollment"]
+        c1["room"], c2["room"] = c2["room"], c1["room"]
 
         # Update the timeslot if the timeslot is different using a ternary operation
         c1["time"], c2["time"] = (c2["time"], c1["time"]) if different_timeslot else (c1["time"], c2["time"])
 
-        try:
-            conn = sqlite3.connect(app.config["DB_FILE"])
-            cursor = conn.cursor()
-            cursor.execute('UPDATE classes SET max_enrollment = ?, room = ?, meeting_pattern = ? WHERE id = ?', 
-                (c1["maxEnrollment"], c1["room"], c1["time"], c1["id"]))
-            cursor.execute('UPDATE classes SET max_enrollment = ?, room = ?, meeting_pattern = ? WHERE id = ?', 
-                (c2["maxEnrollment"], c2["room"], c2["time"], c2["id"]))
-            conn.commit()
-
-            if different_timeslot:
-                log_swap = (
-                    f"\n{datetime.datetime.now():%Y-%m-%d %H:%M:%S} - "\
-                    f"SAME-TIME SLOT SWAP: {c1['time']}\n"
-                    f"{c1['courseName']} ({c2['room']}) -> "
-                    f"{c2['courseName']} ({c1['room']})\n"
-                )
-            else:  
-                log_swap = (
-                    f"\n{datetime.datetime.now():%Y-%m-%d %H:%M:%S} - "\
-                    f"DIFFERENT-TIME SLOT SWAP: {c1['time']} -> {c2['time']}\n"
-                    f"{c1['courseName']} ({c2['room']}) -> "
-                    f"{c2['courseName']} ({c1['room']})\n"
-                )
-
-            with open(swap_file, "a") as logfile:
-                logfile.write(log_swap)
-
-            return jsonify('Successfully swapped classes.', 200)
-        except Exception:
-            return jsonify('Failed to insert changes into the database.', 400)
-        finally:
-            conn.close()
-    else:
-        # realistically this shouldn't hit
-        return jsonify('Could not find one of the classes.', 404)
+    # commits every update together, or rolls them all back on error
+    with conn:
+        conn.executemany('UPDATE classes SET max_enrollment = ?, room = ?, meeting_pattern = ? WHERE id = ?',
+            [(c["maxEnrollment"], c["room"], c["time"], c["id"]) for c in details.values()])
+        refresh_reassignment_candidates(conn, class_ids)
+        bump_generation(conn, {c["term"] for c in details.values()})
+
+    return audit_entries
+
+def move_to_room(details, room, different_timeslot):
+    """
+    Move a class (its loaded details) into an empty room, for ``apply_swaps``.
+
+    The class's maximum enrollment becomes the room's seats.
+
+    :return: The audit entry for the move.
+    :rtype: dict
+    """
+    entry = {
+        "action": "different-slot move" if different_timeslot else "same-slot move",
+        "class_id": details["id"],
+        "target_id": None,
+        "course": details["courseName"],
+        "from_room": details["room"],
+        "to_room": room.room,
+        "from_time": details["time"],
+        "to_time": room.slot if different_timeslot else details["time"],
+    }
+    details["maxEnrollment"], details["room"] = room.seats, room.room
+    if different_timeslot:
+        details["time"] = room.slot
+    return entry
+
+def parse_swap(swap, capacities):
+    """
+    Turn one swap from a request body into an ``apply_swaps`` tuple.
+
+    A swap without a ``target_id`` but with a ``target_room`` moves the class
+    into that (empty) room of the inventory, at ``new_slot`` if given
+    (``different_timeslot`` is ignored for those).
+
+    :param swap: The swap (or recommendation) object.
+    :type swap: dict
+    :param capacities: The room inventory (see ``rooms.get_room_capacities``).
+    :type capacities: dict
+    :return: ``(crowded id, target, different timeslot)``
+    :rtype: tuple
+    :raises ValueError: If the swap is invalid.
+    """
+    class_id, swap_id = swap.get("crowded_id"), swap.get("target_id")
+    if type(class_id) is not int:
+        raise ValueError("needs an integer crowded_id")
+    if swap_id is None and swap.get("target_room") is not None:
+        room = swap["target_room"]
+        if room not in capacities:
+            raise ValueError(f"room '{room}' is not in the room inventory")
+        slot = swap.get("new_slot")
+        # the class only changes time when the room is free at another one
+        return class_id, EmptyRoom(room, capacities[room], slot), slot is not None
+    if type(swap_id) is not int or class_id == swap_id:
+        raise ValueError("needs two different class IDs")
+    return class_id, swap_id, bool(swap.get("different_timeslot", "new_slot" in swap))
+
+
+@app.route("/rooms", methods=["GET"])
+def get_rooms():
+    """
+    Retrieve the room inventory, ordered by room.
+
+    :return: JSON array of ``{id, building, number, seats}`` objects.
+    :rtype: flask.Response
+    """
+    conn = get_connection(app.config["DB_FILE"])
+    rows = conn.execute("SELECT id, building, number, seats FROM rooms ORDER BY id").fetchall()
+    return jsonify([dict(row) for row in rows]), 200
+
+@app.route("/rooms", methods=["POST"])
+def upload_rooms():
+    """
+    Replace the room inventory.
 
+    .. note::
+        Expects an ``.xlsx`` or ``.csv`` file in a form field named ``file``
+        (columns ``Room``, ``Seats`` and optionally ``Building``). Without
+        one, the seats-per-room workbook shipped with the frontend is used.
+
+    The swap recommendations of every term are recomputed with the new
+    rooms on their next request.
+
+    :return: JSON response with the number of rooms imported.
+    :rtype: flask.Response
+
+    :status 200: Inventory imported.
+    :status 400: Unsupported file type or invalid file.
+    """
+    source = ROOMS_WORKBOOK
+    if 'file' in request.files:
+        file = request.files['file']
+        extension = os.path.splitext(file.filename or "")[1].lower()
+        if extension not in (".xlsx", ".csv"):
+            return jsonify({"error": "Room inventory must be an .xlsx or .csv file"}), 400
+        data = file.read()
+        source = UPLOAD_DIR / f"rooms-{hashlib.sha256(data).hexdigest()}{extension}"
+        source.write_bytes(data)
+
+    conn = get_connection(app.config["DB_FILE"])
+    try:
+        count = import_rooms(conn, source)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": "Room inventory imported.", "rooms": count}), 200
+
+@app.route("/audit", methods=["GET"])
+def get_audit():
+    """
+    Retrieve audit entries (swaps), newest first.
+
+    Optional query parameters: ``class_id`` (either side of a swap),
+    ``room`` (moved into or out of), ``since`` / ``until`` (``YYYY-MM-DD``
+    or ``YYYY-MM-DD HH:MM:SS``), ``limit`` (default 100) and ``before``
+    (an entry id, for the next page).
+
+    :return: JSON array of audit entries.
+    :rtype: flask.Response
+
+    :status 200: Entries returned.
+    :status 400: Invalid filter.
+    """
+    try:
+        limit = parse_limit(request.args.get("limit")) or 100
+        class_id = int(request.args["class_id"]) if request.args.get("class_id") else None
+        before = int(request.args["before"]) if request.args.get("before") else None
+        for name in ("since", "until"):
+            if request.args.get(name):
+                datetime.datetime.fromisoformat(request.args[name])
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # entries recorded by earlier requests may still be queued
+    audit_log.flush()
+    entries = query_audit(
+        get_connection(app.config["DB_FILE"]),
+        class_id=class_id,
+        room=request.args.get("room") or None,
+        since=request.args.get("since") or None,
+        until=request.args.get("until") or None,
+        before=before,
+        limit=limit,
+    )
+    return jsonify(entries), 200
 
 @app.route("/export", methods=["PUT"])
 def export_to_csv():
     """
     Export classes from the database into a CSV file named ``output.csv``.
 
-    Reads data from the existing CSV (referenced by ``file_path``) and updates
+    Reads data from the last uploaded CSV (see ``get_layout_path``) and updates
     enrollment values using the database. Ensures the first row is the term,
     the second row is the generation date/time, and subsequent rows contain
     updated class info.
 
+    The export is one streaming pass: rows come from ``export_rows`` and are
+    written through a single buffered file handle.
+
     :return: JSON response indicating success or an error message.
     :rtype: flask.Response
 
     :status 200: Successfully exported data to file.
     :status 404: No database or error accessing records.
     """
-    global file_path
+    term = resolve_term(get_connection(app.config["DB_FILE"]), request.args.get("term"))
+    file_path = get_layout_path(app.config["DB_FILE"], term)
 
-    conn = sqlite3.connect(app.config["DB_FILE"])
     desktop_path = os.path.join(os.path.join(os.environ['USERPROFILE']), 'Desktop')
     output_destination = os.path.join(desktop_path, "output.csv")
-    # check to make sure the connection worked
-    # likely will remove this later. I'm thinking we disable the button if theres no database/problems if possible
-    try:
-        cursor = conn.cursor()
-
-        # the idea here is to go line by line and copy each line into a list. 
-        # if there's something in the first list, process depending on where it is (date, class name, etc.)
-        # if not, process new student count (since data lines have their first csv data empty)
-        with open(file_path, "r", encoding="utf-8") as in_file:
-            reader = csv.reader(in_file)
-
-            # start overwriting the csv file. start with writing the date
-            data = next(reader)
-            season, year = data[0].split(' ')
-            with open(output_destination, "w", newline='', encoding="utf-8") as out_file:
-                writer = csv.writer(out_file, quoting=csv.QUOTE_NOTNULL)
-                writer.writerow([f'{season} {year}'])
-
-            # append date, then column headers
-            with open(output_destination, "a", newline='', encoding="utf-8") as out_file:
-                next(reader) # skip date in the input
-                writer = csv.writer(out_file, quoting=csv.QUOTE_NOTNULL)
-
-                date = datetime.datetime.now()
-                # stripping leading zeroes off the current month, day, and hour
-                month = date.strftime("%m").lstrip('0')
-                day = date.strftime("%d").lstrip('0')
-                hour = date.strftime("%I").lstrip('0')
-                data = [f'Generated {month}/{day}/{date.strftime("%Y")}, {hour}{date.strftime(":%M:%S %p")}']
-                writer.writerow(data) # write date
-
-                data = next(reader)
-                data[0] = None # first column doesn't get quoted
-                writer.writerow(data) # write headers 
-
-            # start writing in all the new data
-            cursor.execute("SELECT * FROM classes")
-            for row in reader:
-                if len(row) > 1: # process new data
-                    with open(output_destination, "a", newline='', encoding="utf-8") as out_file:
-                        writer = csv.writer(out_file, quoting=csv.QUOTE_NOTNULL)
-                        
-                        # instead of searching via an incrementing id, write each row of the database one by one
-                        db_row = cursor.fetchone()
-                        # stop when the end of the database is reached
-                        if db_row is None:
-                            break
-
-                        # data is whatever's in the input csv file
-                        data = row
-                        new_enrollment_count = db_row[7]
-                        data[0] = None # so it doesn't get quoted in the csv file
-                        data[28] = new_enrollment_count # 28 is the index of the current enrollment count. if there's a more dynamic way to do this in case the data format changes, let's do that instead
-
-                        writer.writerow(data)
-                else: # copy row
-                    with open(output_destination, "a", newline='', encoding="utf-8") as out_file:
-                        writer = csv.writer(out_file, quoting=csv.QUOTE_NOTNULL)
-                        writer.writerow(row)
-    except Exception:
+    # nothing uploaded for this term yet, or its file is gone
+    if file_path is None or not os.path.exists(file_path):
         return jsonify("No database exists."), 404
-    finally:
-        conn.close()
+    with open(output_destination, "w", newline='', encoding="utf-8", buffering=EXPORT_BUFFER_SIZE) as out_file:
+        for row in export_rows(file_path, app.config["DB_FILE"], term):
+            out_file.write(format_csv_row(row))
     print("Successfully exported data to file.")
     return jsonify('Successfully exported data to file.'), 200
 
+def export_rows(csv_document, db_path, term=None):
+    """
+    Yield the rows of the exported CSV, one at a time.
+
+    The uploaded CSV is copied row by row. Class rows are matched to the
+    database by (term, course, section), so the order of the ``classes``
+    table doesn't matter, and get every column in ``EXPORT_COLUMNS`` written
+    back from the database (swapped rooms and times included). Crosslisted
+    sections that were merged into one class on upload are copied as is,
+    since the merged class can't be split back up.
+
+    :param csv_document: Path to the uploaded CSV file.
+    :type csv_document: str
+    :param db_path: Path of the SQLite database file.
+    :type db_path: str
+    :param term: Only load this term's classes (the one the CSV is for).
+    :type term: str, optional
+    :return: Generator of CSV rows (lists).
+    :rtype: generator
+    """
+    # one query for every class instead of a fetchone() per row
+    query = f"SELECT term, course_number, section, {', '.join(EXPORT_COLUMNS.values())} FROM classes"
+    cursor = get_connection(db_path).execute(*((query + " WHERE term = ?", (term,)) if term is not None else (query,)))
+    classes = {tuple(row[:3]): row[3:] for row in cursor}
+
+    # the idea here is to go line by line and copy each line into a list. 
+    # if there's something in the first list, process depending on where it is (date, class name, etc.)
+    # if not, process new student count (since data lines have their first csv data empty)
+    with open(csv_document, "r", newline='', encoding="utf-8") as in_file:
+        reader = strip_trailing_empty(csv.reader(in_file))
+
+        # start with writing the term
+        data = next(reader)
+        season, year = data[0].split(' ')
+        yield [f'{season} {year}']
+
+        # then the date, then column headers
+        next(reader) # skip date in the input
+        date = datetime.datetime.now()
+        # stripping leading zeroes off the current month, day, and hour
+        month = date.strftime("%m").lstrip('0')
+        day = date.strftime("%d").lstrip('0')
+        hour = date.strftime("%I").lstrip('0')
+        yield [f'Generated {month}/{day}/{date.strftime("%Y")}, {hour}{date.strftime(":%M:%S %p")}']
+
+        headers = next(reader)
+        columns = get_column_map(headers)
+        data = list(headers)
+        data[0] = None # first column doesn't get quoted
+        yield data
+
+        # start writing in all the new data
+        for row in reader:
+            if len(row) > 1 and row[0] == '': # class row
+                values = classes.get((columns.get(row, "Term"), columns.get(row, "Course"), columns.get(row, "Section #")))
+                if values is not None:
+                    for name, value in zip(EXPORT_COLUMNS, values):
+                        columns.set(row, name, value)
+                row[0] = None # so it doesn't get quoted in the csv file
+            yield row # course headings and anything else are copied as is
+
+def format_csv_row(row):
+    """
+    Format one CSV line the way ``csv.QUOTE_NOTNULL`` does: every value
+    quoted, and ``None`` written as an empty, unquoted cell.
+
+    ``csv.QUOTE_NOTNULL`` is new in Python 3.12, so the line is built by hand.
+
+    :param row: Values of the row.
+    :type row: list
+    :return: The CSV line, ending in ``\\r\\n``.
+    :rtype: str
+    """
+    return ",".join("" if value is None else '"' + str(value).replace('"', '""') + '"' for value in row) + "\r\n"
+
+
+@app.route("/export.<file_format>", methods=["GET"])
+def download_export(file_format):
+    """
+    Download the current schedule as ``csv`` or ``xlsx``.
+
+    The file is rebuilt from the layout of the last upload (recorded in the
+    ``uploads`` table) and the enrollments in the database, and sent straight
+    to the client, so nothing is written on the server and any number of
+    exports can run at the same time. CSV is streamed in chunks and gzipped
+    when the client sends ``Accept-Encoding: gzip``. An xlsx file is a zip
+    archive that can't be written front to back, so it is built in memory.
+
+    An optional ``term`` query parameter picks the term (default: the last
+    uploaded term).
+
+    :param file_format: ``csv`` or ``xlsx``.
+    :type file_format: str
+    :return: The exported file as an attachment.
+    :rtype: flask.Response
+
+    :status 200: File is being sent.
+    :status 404: Unknown format or nothing has been uploaded yet.
+    """
+    if file_format not in ("csv", "xlsx"):
+        return jsonify({"error": f"Unknown export format '{file_format}'."}), 404
+
+    term = resolve_term(get_connection(app.config["DB_FILE"]), request.args.get("term"))
+    layout_path = get_layout_path(app.config["DB_FILE"], term)
+    if layout_path is None or not os.path.exists(layout_path):
+        return jsonify({"error": "No schedule has been uploaded."}), 404
+
+    rows = export_rows(layout_path, app.config["DB_FILE"], term)
+    headers = {"Content-Disposition": f"attachment; filename=schedule.{file_format}"}
+
+    if file_format == "xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        worksheet = workbook.active
+        for row in rows:
+            worksheet.append(row)
+        output = io.BytesIO()
+        workbook.save(output)
+        return app.response_class(
+            output.getvalue(),
+            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=headers,
+        )
+
+    chunks = csv_chunks(rows)
+    headers["Vary"] = "Accept-Encoding"
+    if "gzip" in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return app.response_class(stream_with_context(chunks), mimetype="text/csv", headers=headers)
+
+def get_layout_path(db_path, term=None):
+    """
+    Return the path of the last uploaded CSV (for ``term``, if given), or
+    None if there is none.
+    """
+    query, params = "SELECT file_path FROM uploads", ()
+    if term is not None:
+        query, params = query + " WHERE term = ?", (term,)
+    row = get_connection(db_path).execute(query + " ORDER BY id DESC LIMIT 1", params).fetchone()
+    return row[0] if row else None
+
+def get_current_upload_terms(conn, file_path):
+    """
+    Return the terms ``file_path`` was imported for, if it is still the
+    latest upload of every one of them, otherwise None.
+    """
+    rows = conn.execute("""
+        SELECT DISTINCT u.term,
+               (SELECT file_path FROM uploads WHERE term IS u.term ORDER BY id DESC LIMIT 1) = u.file_path
+        FROM uploads u
+        WHERE u.file_path = ?
+    """, (str(file_path),)).fetchall()
+    if not rows or not all(latest for _, latest in rows):
+        return None
+    return [term for term, _ in rows]
+
+def csv_chunks(rows):
+    """
+    Encode rows as CSV and yield them in chunks of about ``EXPORT_BUFFER_SIZE`` bytes.
+    """
+    buffer = io.StringIO()
+    # quoted like PUT /export, so both exports keep the uploaded file's layout
+    for row in rows:
+        buffer.write(format_csv_row(row))
+        if buffer.tell() >= EXPORT_BUFFER_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def gzip_chunks(chunks):
+    """
+    Gzip a stream of byte chunks on the fly.
+    """
+    # 16 + MAX_WBITS adds the gzip header and trailer
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
 
 # Start the Flask Server
 if __name__ == "__main__":
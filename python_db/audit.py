@@ -0,0 +1,187 @@
+# This file is the audit log for schedule changes (swaps).
+# Entries are handed to a background thread and written to the ``audit`` table
+# in batches, so a swap request never waits on audit I/O. When the table grows
+# past its limit, the oldest entries are rotated out to JSON Lines archives.
+
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Entries kept in the audit table before the oldest are archived
+# (a year of swaps is a few thousand rows)
+AUDIT_MAX_ENTRIES = 100_000
+
+# Most entries written with one INSERT
+AUDIT_BATCH_SIZE = 500
+
+# Columns an entry is stored in; everything else goes into ``details``
+AUDIT_COLUMNS = ("created_at", "action", "class_id", "target_id", "from_room", "to_room")
+
+
+class AuditLog:
+    """
+    Buffered writer for the ``audit`` table.
+
+    ``record`` only queues entries; a daemon thread writes whatever has
+    queued up in one transaction per database. Call ``flush`` to wait until
+    everything recorded so far is in the database.
+
+    :param archive_dir: Folder rotated out entries are written to.
+    :type archive_dir: str
+    :param max_entries: Entries kept in the table before rotating.
+    :type max_entries: int
+    """
+
+    def __init__(self, archive_dir, max_entries=AUDIT_MAX_ENTRIES):
+        self.archive_dir = archive_dir
+        self.max_entries = max_entries
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def record(self, db_path, entries):
+        """
+        Queue audit entries (dicts) for ``db_path``.
+
+        Each entry gets a ``created_at`` timestamp if it has none.
+        """
+        created_at = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+        for entry in entries:
+            entry.setdefault("created_at", created_at)
+            self._queue.put((str(db_path), entry))
+        self._start()
+
+    def flush(self):
+        """
+        Block until every recorded entry has been written.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+    def _start(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            # wait for one entry, then take whatever else queued up meanwhile
+            batch = [self._queue.get()]
+            while len(batch) < AUDIT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            by_database = {}
+            for db_path, entry in batch:
+                by_database.setdefault(db_path, []).append(entry)
+            for db_path, entries in by_database.items():
+                try:
+                    self._write(db_path, entries)
+                except Exception:
+                    # the audit trail must never take the writer thread down
+                    logger.exception("Failed to write %d audit entries to %s", len(entries), db_path)
+
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, db_path, entries):
+        conn = get_connection(db_path)
+        with conn:
+            conn.executemany(
+                f"INSERT INTO audit ({', '.join(AUDIT_COLUMNS)}, details) VALUES ({', '.join('?' * (len(AUDIT_COLUMNS) + 1))})",
+                [(*(entry.get(column) for column in AUDIT_COLUMNS),
+                  json.dumps({key: value for key, value in entry.items() if key not in AUDIT_COLUMNS}))
+                 for entry in entries],
+            )
+        self._rotate(conn)
+
+    def _rotate(self, conn):
+        """
+        Move the oldest entries out to a JSON Lines archive once the table
+        holds more than ``max_entries``. Half the limit is kept, so rotation
+        doesn't run again on the very next write.
+        """
+        count = conn.execute("SELECT COUNT(*) FROM audit").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        keep = self.max_entries // 2
+        cutoff = conn.execute("SELECT id FROM audit ORDER BY id DESC LIMIT 1 OFFSET ?", (keep,)).fetchone()[0]
+        rows = conn.execute("SELECT * FROM audit WHERE id <= ? ORDER BY id", (cutoff,)).fetchall()
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive = os.path.join(self.archive_dir, f"audit-{rows[0]['id']}-{rows[-1]['id']}.jsonl")
+        with open(archive, "a", encoding="utf-8") as archive_file:
+            for row in rows:
+                archive_file.write(json.dumps(entry_from_row(row)) + "\n")
+        # only dropped once the archive is safely written
+        with conn:
+            conn.execute("DELETE FROM audit WHERE id <= ?", (cutoff,))
+
+
+def entry_from_row(row):
+    """
+    Turn an ``audit`` row back into the entry that was recorded.
+    """
+    entry = {"id": row["id"], **{column: row[column] for column in AUDIT_COLUMNS}}
+    entry.update(json.loads(row["details"]))
+    return entry
+
+
+def query_audit(conn, class_id=None, room=None, since=None, until=None, before=None, limit=100):
+    """
+    Read audit entries, newest first.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param class_id: Only entries involving this class (on either side).
+    :type class_id: int, optional
+    :param room: Only entries moving a class into or out of this room.
+    :type room: str, optional
+    :param since: Only entries at or after this time (``YYYY-MM-DD[ HH:MM:SS]``).
+    :type since: str, optional
+    :param until: Only entries before this time.
+    :type until: str, optional
+    :param before: Only entries with a smaller id (the next page).
+    :type before: int, optional
+    :param limit: Most entries to return.
+    :type limit: int
+    :return: The matching entries.
+    :rtype: list
+    """
+    where = []
+    params = []
+    if class_id is not None:
+        where.append("(class_id = ? OR target_id = ?)")
+        params.extend((class_id, class_id))
+    if room is not None:
+        where.append("(from_room = ? OR to_room = ?)")
+        params.extend((room, room))
+    if since is not None:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("created_at < ?")
+        params.append(until)
+    if before is not None:
+        where.append("id < ?")
+        params.append(before)
+
+    query = "SELECT * FROM audit"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    return [entry_from_row(row) for row in conn.execute(query, params)]
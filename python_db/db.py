@@ -0,0 +1,177 @@
+# This file is the shared data-access layer for app.py and algorithm.py.
+# Instead of every route opening (and tearing down) its own SQLite connection,
+# connections are pooled per database file: a request checks one out and
+# hands it back when it ends, so the next request reuses it.
+
+import sqlite3
+import threading
+
+import json
+
+from schema import REASSIGNMENT_CANDIDATE_PAIRS
+
+# Connection tuning applied once, when a pooled connection is created
+PRAGMAS = [
+    # readers don't block the writer (and vice versa) in WAL mode
+    "PRAGMA journal_mode = WAL",
+    # safe with WAL, only the checkpoints have to wait on fsync
+    "PRAGMA synchronous = NORMAL",
+    # page cache size in KiB when negative (64 MiB)
+    "PRAGMA cache_size = -65536",
+    # memory map the database file (256 MiB)
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    # wait on a locked database instead of failing straight away
+    "PRAGMA busy_timeout = 5000",
+]
+
+# How many prepared statements each connection keeps around for reuse
+STATEMENT_CACHE_SIZE = 256
+
+# Idle connections kept per database file for the next request to reuse
+MAX_IDLE_CONNECTIONS = 8
+
+# A connection is only used by one thread at a time: the thread that checked it
+# out keeps it in its {database path: connection} dict until it releases it
+_local = threading.local()
+
+# {database path: [idle connections]}, shared by every thread
+_idle = {}
+_idle_lock = threading.Lock()
+
+
+def _connect(db_path):
+    """
+    Open and tune a new connection to ``db_path``.
+    """
+    # released connections are handed to other threads (one at a time)
+    conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    # columns can be read by name or by index
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(db_path):
+    """
+    Return the connection to ``db_path`` checked out by the current thread.
+
+    The first call in a thread takes an idle connection from the pool (or
+    opens and tunes a new one); later calls return the same connection until
+    the thread calls ``release_connections``. It must not be closed by the
+    caller. Wrap writes in ``with conn:`` so they are committed, or rolled
+    back on error.
+
+    :param db_path: Path of the SQLite database file.
+    :type db_path: str
+    :return: Open connection with ``sqlite3.Row`` rows.
+    :rtype: sqlite3.Connection
+    """
+    pool = getattr(_local, "connections", None)
+    if pool is None:
+        pool = _local.connections = {}
+
+    db_path = str(db_path)
+    conn = pool.get(db_path)
+    if conn is None:
+        with _idle_lock:
+            idle = _idle.get(db_path)
+            conn = idle.pop() if idle else None
+        pool[db_path] = conn = conn or _connect(db_path)
+    return conn
+
+
+def release_connections():
+    """
+    Hand every connection checked out by the current thread back to the
+    pool (called when a request or an upload job ends). Whatever wasn't
+    committed is rolled back, and connections beyond ``MAX_IDLE_CONNECTIONS``
+    are closed.
+    """
+    pool = getattr(_local, "connections", None) or {}
+    while pool:
+        db_path, conn = pool.popitem()
+        if conn.in_transaction:
+            conn.rollback()
+        with _idle_lock:
+            idle = _idle.setdefault(db_path, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+
+def get_generation(conn, term=None):
+    """
+    Return the database's write generation (0 if nothing was written yet).
+
+    Anything computed from the schedule can be cached under this number:
+    it changes whenever the data does. With ``term`` it's the generation of
+    that term's data only, which other terms' writes leave alone.
+    """
+    if term is None:
+        row = conn.execute("SELECT generation FROM db_generation WHERE id = 1").fetchone()
+    else:
+        row = conn.execute("SELECT generation FROM term_generations WHERE term = ?", (term,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_generation(conn, terms=()):
+    """
+    Advance the database's write generation, and that of every term in
+    ``terms`` (the terms whose data the write changed).
+
+    Call it inside the same ``with conn:`` block as the write, so the new
+    generation is committed (or rolled back) together with the data.
+
+    :return: The new (database) generation.
+    :rtype: int
+    """
+    conn.execute("""
+        INSERT INTO db_generation (id, generation) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET generation = generation + 1
+    """)
+    # classes without a term only count towards the database's generation
+    terms = {term for term in terms if term is not None}
+    if terms:
+        conn.executemany("""
+            INSERT INTO term_generations (term, generation) VALUES (?, 1)
+            ON CONFLICT (term) DO UPDATE SET generation = generation + 1
+        """, [(term,) for term in terms])
+    return get_generation(conn)
+
+
+def refresh_reassignment_candidates(conn, class_ids=None):
+    """
+    Bring the ``reassignment_candidates`` table up to date.
+
+    Only the pairs the given classes take part in (on either side) are
+    recomputed, since a change to one class can't affect any other pair.
+    Without ``class_ids`` the whole table is rebuilt. Call it inside the same ``with conn:`` block as the
+    write, like ``bump_generation``.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param class_ids: IDs of the classes that were changed.
+    :type class_ids: list, optional
+    """
+    if class_ids is None:
+        conn.execute("DELETE FROM reassignment_candidates")
+        conn.execute(f"INSERT INTO reassignment_candidates (class_id, candidate_id, seats_available) {REASSIGNMENT_CANDIDATE_PAIRS}")
+        return
+
+    changed = json.dumps(list(class_ids))
+    conn.execute("""
+        DELETE FROM reassignment_candidates
+        WHERE class_id IN (SELECT value FROM json_each(?))
+        OR candidate_id IN (SELECT value FROM json_each(?))
+    """, (changed, changed))
+    # one SELECT per side, so each can look the changed classes up by id
+    conn.execute(f"""
+        INSERT INTO reassignment_candidates (class_id, candidate_id, seats_available)
+        {REASSIGNMENT_CANDIDATE_PAIRS} AND t.id IN (SELECT value FROM json_each(?))
+        UNION
+        {REASSIGNMENT_CANDIDATE_PAIRS} AND b.id IN (SELECT value FROM json_each(?))
+    """, (changed, changed))
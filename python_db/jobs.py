@@ -0,0 +1,175 @@
+# This file runs uploads as background jobs.
+# POST /upload only stores the file and queues a job; a pool of worker threads
+# parses and imports it while the request returns straight away. Every job
+# keeps its own file path and progress, which GET /jobs/<id> reports.
+
+import datetime
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Uploads imported at the same time
+JOB_WORKERS = 2
+
+# Finished jobs kept for GET /jobs/<id> before the oldest are forgotten
+MAX_FINISHED_JOBS = 1000
+
+# Phases a job goes through; it ends in "done" or "failed"
+JOB_PHASES = ("queued", "parsing", "importing", "done", "failed")
+
+
+class Job:
+    """
+    One background upload and its progress.
+
+    :param file_path: The stored upload the job imports.
+    :type file_path: str
+    """
+
+    def __init__(self, file_path):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.phase = "queued"
+        self.rows_processed = 0
+        self.rows_total = None
+        self.errors = []
+        self.result = None
+        self.created_at = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    def update(self, phase=None, rows_processed=None, rows_total=None):
+        """
+        Record progress; arguments left as None keep their value.
+        """
+        with self._lock:
+            if phase is not None:
+                self.phase = phase
+            if rows_processed is not None:
+                self.rows_processed = rows_processed
+            if rows_total is not None:
+                self.rows_total = rows_total
+
+    def finish(self, result):
+        """
+        Mark the job as done with ``result``.
+        """
+        with self._lock:
+            self.phase = "done"
+            self.result = result
+            self.finished_at = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+        self._finished.set()
+
+    def fail(self, error):
+        """
+        Mark the job as failed with the message ``error``.
+        """
+        with self._lock:
+            self.phase = "failed"
+            self.errors.append(error)
+            self.finished_at = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+        self._finished.set()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the job is done or failed.
+
+        :return: False if ``timeout`` (seconds) ran out first.
+        :rtype: bool
+        """
+        return self._finished.wait(timeout)
+
+    def to_dict(self):
+        """
+        Return the job's state for the JSON API.
+        """
+        with self._lock:
+            return {
+                "id": self.id,
+                "phase": self.phase,
+                "rows_processed": self.rows_processed,
+                "rows_total": self.rows_total,
+                "errors": list(self.errors),
+                "result": self.result,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobQueue:
+    """
+    Runs jobs on a pool of worker threads and keeps them for lookup by id.
+
+    The pool is only started when the first job is submitted.
+
+    :param workers: Jobs run at the same time.
+    :type workers: int
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, file_path, func, *args):
+        """
+        Queue ``func(job, *args)`` for a new job on ``file_path``.
+
+        Whatever ``func`` returns becomes the job's result; an exception
+        fails the job with its message.
+
+        :return: The queued job.
+        :rtype: Job
+        """
+        job = Job(file_path)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload-job")
+            self._forget_finished()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def record(self, file_path, result):
+        """
+        Keep a job that finished without running (an upload with nothing
+        to import), so it can be looked up like any other.
+
+        :return: The finished job.
+        :rtype: Job
+        """
+        job = Job(file_path)
+        job.finish(result)
+        with self._lock:
+            self._forget_finished()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """
+        Return the job with ``job_id``, None if there is none.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args):
+        try:
+            job.finish(func(job, *args))
+        except Exception as e:
+            logger.exception("Upload job %s failed", job.id)
+            job.fail(str(e))
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        # jobs are kept in submission order, so the oldest go first
+        for job_id in finished[:len(finished) - MAX_FINISHED_JOBS]:
+            del self._jobs[job_id]
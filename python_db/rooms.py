@@ -0,0 +1,145 @@
+# This file holds the room inventory: every room and its physical seats.
+# Until now a room's capacity was only known through the max enrollment of
+# whichever class sat in it, so rooms without a class were invisible to the
+# swap algorithm. The inventory is imported from the seats-per-room workbook
+# (or a CSV with the same columns) into the ``rooms`` table and kept in memory
+# as a {room: seats} dict.
+
+import csv
+import os
+import sys
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from db import get_connection, bump_generation
+
+# The workbook shipped with the frontend
+ROOMS_WORKBOOK = Path(__file__).resolve().parent.parent / "frontend" / "UNO seats per room.xlsx"
+
+# The workbook only lists room numbers, all of them in this building (it's
+# how the registrar's export names the building, so room ids match classes.room)
+DEFAULT_BUILDING = "Peter Kiewit Institute"
+
+# An empty room a class can move into; ``slot`` is the timeslot it's free in
+# when the move also changes the class's time (None for a same-slot move)
+EmptyRoom = namedtuple("EmptyRoom", ["room", "seats", "slot"])
+
+# {database path: (latest room import id, {room id: seats})}
+_capacities = {}
+_capacities_lock = threading.Lock()
+
+
+def read_room_inventory(path, building=DEFAULT_BUILDING):
+    """
+    Read rooms from an ``.xlsx`` workbook or a ``.csv`` file.
+
+    The first row holds the headers: ``Room`` and ``Seats`` are required,
+    ``Building`` is optional (``building`` is used when it's missing or
+    empty). Rows without a room or a seat count are skipped.
+
+    :param path: The workbook or CSV file.
+    :type path: str
+    :param building: Building of rooms that don't name one.
+    :type building: str
+    :return: ``(id, building, number, seats)`` tuples, ``id`` being the
+        room's name as used in ``classes.room`` (e.g. "Peter Kiewit Institute 160").
+    :rtype: list
+    :raises ValueError: If a required column is missing.
+    """
+    if os.path.splitext(str(path))[1].lower() == ".xlsx":
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = list(workbook.worksheets[0].iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as csv_file:
+            rows = list(csv.reader(csv_file))
+
+    if not rows:
+        return []
+    headers = [str(header).strip() if header is not None else "" for header in rows[0]]
+    for required in ("Room", "Seats"):
+        if required not in headers:
+            raise ValueError(f"Column '{required}' is missing from the room inventory")
+    room_at, seats_at = headers.index("Room"), headers.index("Seats")
+    building_at = headers.index("Building") if "Building" in headers else None
+
+    rooms = []
+    for row in rows[1:]:
+        cells = list(row) + [None] * (len(headers) - len(row))
+        number, seats = cells[room_at], cells[seats_at]
+        if number in (None, "") or seats in (None, ""):
+            continue
+        # the workbook stores room numbers as numbers
+        number = str(int(number)) if isinstance(number, float) and number.is_integer() else str(number).strip()
+        room_building = building
+        if building_at is not None and cells[building_at] not in (None, ""):
+            room_building = str(cells[building_at]).strip()
+        rooms.append((f"{room_building} {number}", room_building, number, int(seats)))
+    return rooms
+
+
+def import_rooms(conn, path, building=DEFAULT_BUILDING):
+    """
+    Replace the room inventory with the rooms in ``path``.
+
+    The new inventory changes what the swap algorithm can recommend, so
+    every term's write generation is bumped in the same transaction.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :param path: The workbook or CSV file (see ``read_room_inventory``).
+    :type path: str
+    :param building: Building of rooms that don't name one.
+    :type building: str
+    :return: How many rooms were imported.
+    :rtype: int
+    """
+    rooms = read_room_inventory(path, building)
+    with conn:
+        conn.execute("DELETE FROM rooms")
+        # a room listed twice keeps its last row
+        conn.executemany("INSERT OR REPLACE INTO rooms (id, building, number, seats) VALUES (?, ?, ?, ?)", rooms)
+        conn.execute("INSERT INTO room_imports (file_path) VALUES (?)", (str(path),))
+        terms = [row[0] for row in conn.execute("SELECT DISTINCT term FROM classes")]
+        bump_generation(conn, terms)
+    return len(rooms)
+
+
+def get_room_capacities(db_path):
+    """
+    Return the inventory as a ``{room id: seats}`` dict.
+
+    The dict is kept in memory and only read again after a new import, so
+    a room's capacity is a dict lookup. Treat it as read-only. Without an
+    inventory it's an empty dict.
+
+    :param db_path: Path of the SQLite database file.
+    :type db_path: str
+    :rtype: dict
+    """
+    db_path = str(db_path)
+    conn = get_connection(db_path)
+    version = conn.execute("SELECT MAX(id) FROM room_imports").fetchone()[0]
+
+    with _capacities_lock:
+        cached = _capacities.get(db_path)
+        if cached is None or cached[0] != version:
+            capacities = {room: seats for room, seats in conn.execute("SELECT id, seats FROM rooms")}
+            cached = _capacities[db_path] = (version, capacities)
+    return cached[1]
+
+
+if __name__ == "__main__":
+    # python rooms.py [workbook or csv] [database]
+    from schema import migrate
+
+    source = sys.argv[1] if len(sys.argv) > 1 else ROOMS_WORKBOOK
+    database = sys.argv[2] if len(sys.argv) > 2 else "database.db"
+    connection = get_connection(database)
+    migrate(connection)
+    print(f"Imported {import_rooms(connection, source)} rooms from {source}")
@@ -0,0 +1,224 @@
+# This file holds the database schema for the scheduler.
+# Instead of dropping and re-creating the tables on every upload, the schema is
+# built up by a list of versioned migrations. The version a database is on is
+# kept in SQLite's ``user_version`` pragma, so only the missing steps are run.
+
+# Base tables (same layout the old drop-and-recreate produced)
+BASE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS classes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        term TEXT,
+        course_number TEXT,
+        section TEXT,
+        course_title TEXT,
+        room TEXT,
+        meeting_pattern TEXT,
+        enrollment INTEGER,
+        max_enrollment INTEGER,
+        professor_id INTEGER,
+        UNIQUE (term, course_number, section)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS professors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT,
+        last_name TEXT,
+        p_id TEXT
+    )
+    """,
+    # many-to-many relationship between classes and professors,
+    # the UNIQUE constraint also indexes lookups by class_id
+    """
+    CREATE TABLE IF NOT EXISTS class_professors (
+        class_id INTEGER,
+        professor_id INTEGER,
+        FOREIGN KEY (class_id) REFERENCES classes(id),
+        FOREIGN KEY (professor_id) REFERENCES professors(id),
+        UNIQUE (class_id, professor_id)
+    )
+    """,
+]
+
+# Indexes for the hot queries
+QUERY_INDEXES = [
+    # timeslot lookups, and the possible-reassignments self-join which
+    # filters on the same timeslot and ranges over both capacity columns
+    "CREATE INDEX IF NOT EXISTS idx_classes_slot_capacity ON classes (meeting_pattern, max_enrollment, enrollment)",
+    "CREATE INDEX IF NOT EXISTS idx_classes_room ON classes (room)",
+    # one row per professor, used when loading the professor cache
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_professors_identity ON professors (first_name, last_name, p_id)",
+    # joins coming from the professor side (cross-slot recommendations)
+    "CREATE INDEX IF NOT EXISTS idx_class_professors_professor ON class_professors (professor_id)",
+]
+
+# Single-row counter bumped by every write to the schedule, so caches can
+# tell whether what they hold is still current
+GENERATION_TABLE = """
+    CREATE TABLE IF NOT EXISTS db_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+"""
+
+# Uploaded files, so exports can be rebuilt from the original layout
+# without depending on whichever process handled the upload
+UPLOADS_TABLE = """
+    CREATE TABLE IF NOT EXISTS uploads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_path TEXT NOT NULL,
+        uploaded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Course prefix filter and sort for the paginated class list
+COURSE_INDEX = "CREATE INDEX IF NOT EXISTS idx_classes_course ON classes (course_number)"
+
+# Possible reassignments of every class, kept up to date by the writes
+# (see db.refresh_reassignment_candidates). The primary key is the order
+# candidates are listed in, so a class's list is one index range.
+REASSIGNMENT_CANDIDATES_TABLE = """
+    CREATE TABLE IF NOT EXISTS reassignment_candidates (
+        class_id INTEGER NOT NULL,
+        candidate_id INTEGER NOT NULL,
+        seats_available INTEGER NOT NULL,
+        PRIMARY KEY (class_id, seats_available, candidate_id)
+    ) WITHOUT ROWID
+"""
+
+# Every (class, candidate) pair where the two classes could trade rooms:
+# same term and timeslot, each fits in the other's room, and the candidate isn't
+# an empty placeholder (remote classes have 0 enrollment and 0 seats)
+REASSIGNMENT_CANDIDATE_PAIRS = """
+    SELECT t.id, b.id, b.max_enrollment - b.enrollment
+    FROM classes t
+    JOIN classes b ON b.term = t.term AND b.meeting_pattern = t.meeting_pattern -- same term and meeting times
+    WHERE b.id != t.id
+    AND t.max_enrollment >= b.enrollment -- target class can accommodate the other class
+    AND b.max_enrollment >= t.enrollment -- other class can accommodate the target class
+    AND NOT (b.enrollment = 0 AND b.max_enrollment = 0)
+"""
+
+REASSIGNMENT_CANDIDATES_SCHEMA = [
+    REASSIGNMENT_CANDIDATES_TABLE,
+    # maintenance deletes the rows a changed class shows up in as a candidate
+    "CREATE INDEX IF NOT EXISTS idx_reassignment_candidates_candidate ON reassignment_candidates (candidate_id)",
+    # classes already in the database (it's only kept up to date from here on)
+    f"INSERT OR IGNORE INTO reassignment_candidates (class_id, candidate_id, seats_available) {REASSIGNMENT_CANDIDATE_PAIRS}",
+]
+
+# Audit trail of schedule changes, one row per swap. The indexes back the
+# filters of GET /audit (either class, either room, time range)
+AUDIT_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS audit (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        action TEXT NOT NULL,
+        class_id INTEGER,
+        target_id INTEGER,
+        from_room TEXT,
+        to_room TEXT,
+        details TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_audit_created_at ON audit (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_class ON audit (class_id)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_target ON audit (target_id)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_from_room ON audit (from_room)",
+    "CREATE INDEX IF NOT EXISTS idx_audit_to_room ON audit (to_room)",
+]
+
+# Write generation of every term, so a write to one term doesn't
+# invalidate what was cached for another
+TERM_GENERATION_TABLE = """
+    CREATE TABLE IF NOT EXISTS term_generations (
+        term TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL
+    ) WITHOUT ROWID
+"""
+
+# Several terms side by side
+TERMS_SCHEMA = [
+    TERM_GENERATION_TABLE,
+    # which term an upload was for (the latest one is the default term)
+    "ALTER TABLE uploads ADD COLUMN term TEXT",
+    "CREATE INDEX IF NOT EXISTS idx_uploads_term ON uploads (term)",
+    # every timeslot query is for one term now, so the term leads the index
+    "CREATE INDEX IF NOT EXISTS idx_classes_term_slot ON classes (term, meeting_pattern, max_enrollment, enrollment)",
+    "DROP INDEX IF EXISTS idx_classes_slot_capacity",
+]
+
+# What the registrar's export last said about each class (a JSON array),
+# so a re-upload can tell its own changes from the coordinators'
+SOURCE_COLUMN = "ALTER TABLE classes ADD COLUMN source TEXT"
+
+# Room inventory (physical seats per room), imported from the seats-per-room
+# workbook. Every import is recorded, the latest one is the inventory's version
+ROOMS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS rooms (
+        id TEXT PRIMARY KEY,
+        building TEXT NOT NULL,
+        number TEXT NOT NULL,
+        seats INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS room_imports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_path TEXT NOT NULL,
+        imported_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+# Each migration is a list of statements, applied in order; its position in
+# the list (counting from 1) is its version.
+# Never edit a migration that has shipped, append a new one instead.
+MIGRATIONS = [
+    BASE_TABLES,                     # 1: base tables
+    QUERY_INDEXES,                   # 2: indexes for the hot queries
+    [GENERATION_TABLE],              # 3: write generation counter
+    [UPLOADS_TABLE],                 # 4: uploaded files
+    [COURSE_INDEX],                  # 5: course prefix filter and sort
+    REASSIGNMENT_CANDIDATES_SCHEMA,  # 6: materialized reassignment candidates
+    AUDIT_SCHEMA,                    # 7: structured audit log
+    TERMS_SCHEMA,                    # 8: several terms side by side
+    [SOURCE_COLUMN],                 # 9: registrar's values of each class
+    ROOMS_SCHEMA,                    # 10: room inventory
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    """
+    Return the migration version the database is currently on.
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Bring the database up to the latest schema.
+
+    Every pending migration runs in its own transaction together with the
+    ``user_version`` bump, so a failed step leaves the database on the last
+    version that applied cleanly.
+
+    :param conn: Open connection to the database.
+    :type conn: sqlite3.Connection
+    :return: The schema version after migrating.
+    :rtype: int
+    """
+    version = get_schema_version(conn)
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            # pragmas can't take parameters, number is always an int here
+            conn.execute(f"PRAGMA user_version = {number}")
+    return SCHEMA_VERSION
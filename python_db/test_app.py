@@ -1,30 +1,25 @@
 import io
 import os
+import json
 import tempfile
 import pytest
 import csv
 import sqlite3
 from app import app
+from schema import migrate
 
 @pytest.fixture(autouse=True)
-def setup_database():
-    # Create the classes table if it doesn't exist
+def setup_database(tmp_path, monkeypatch):
+    import app as app_module
+
+    # keep the database and stored uploads out of the source tree
+    monkeypatch.setitem(app.config, "DB_FILE", str(tmp_path / "database.db"))
+    monkeypatch.setattr(app_module, "UPLOAD_DIR", tmp_path / "uploads")
+    app_module.UPLOAD_DIR.mkdir()
+
+    # every database is brought up to the latest schema before it's used
     conn = sqlite3.connect(app.config["DB_FILE"])
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            term TEXT,
-            course_number TEXT,
-            section TEXT,
-            course_title TEXT,
-            room TEXT,
-            meeting_pattern TEXT,
-            enrollment INTEGER,
-            max_enrollment INTEGER
-        )
-    """)
-    conn.commit()
+    migrate(conn)
     conn.close()
     
 @pytest.fixture
@@ -32,6 +27,26 @@ def client():
     with app.test_client() as client:
         yield client
 
+def _finish_job(client, response):
+    """Wait for the upload job queued by ``response`` and return its state."""
+    import app as app_module
+
+    assert response.status_code == 202
+    job_id = response.get_json()["job"]["id"]
+    assert app_module.upload_jobs.get(job_id).wait(timeout=10)
+    return client.get(f'/jobs/{job_id}').get_json()
+
+def _insert_classes(sections, instructor=""):
+    """Import ``(course, room, meeting pattern, enrollment, capacity)`` sections of Fall 2025."""
+    from app import insert_csv_into_table
+
+    insert_csv_into_table([
+        {"Term": "Fall 2025", "Course": course, "Section #": "1", "Course Title": "Title", "Room": room,
+         "Meeting Pattern": pattern, "Enrollment": enrollment, "Maximum Enrollment": capacity,
+         "Cross-listings": "", "Instructor": instructor, "Cross-list Maximum": 0}
+        for course, room, pattern, enrollment, capacity in sections
+    ])
+
 # Classes page confirmation
 def test_get_classes(client):
     response = client.get('/classes')
@@ -51,7 +66,6 @@ Fall 2025,CSCI1020,002,Data Structures,PKI 170,MW 10:30-11:45,32,30,CSCI1030,Dr.
     }
 
     # Mock downstream dependencies
-    mocker.patch('app.fix_csv', return_value='uploads/test.csv')
     mocker.patch('app.create_tables')
     mocker.patch('app.parse_csv', return_value=[
         {
@@ -81,15 +95,20 @@ Fall 2025,CSCI1020,002,Data Structures,PKI 170,MW 10:30-11:45,32,30,CSCI1030,Dr.
             "Cross-list Maximum": "50"
         }
     ])
-    mocker.patch('app.insert_csv_into_table')
+    mocker.patch('app.insert_csv_into_table', return_value={"inserted": 2, "updated": 0, "deleted": 0, "unchanged": 0})
 
     response = client.post('/upload', data=data, content_type='multipart/form-data')
 
-    assert response.status_code == 200
+    assert response.status_code == 202
     json_data = response.get_json()
     print(json_data)
     assert "message" in json_data and json_data["message"] == "File uploaded successfully!"
     assert "file_path" in json_data
+    assert response.headers["Location"] == f"/jobs/{json_data['job']['id']}"
+
+    job = _finish_job(client, response)
+    assert job["phase"] == "done"
+    assert job["result"] == {"inserted": 2, "updated": 0, "deleted": 0, "unchanged": 0}
 
 # Testing import for errors
 def test_upload_processing_error(client, mocker):
@@ -100,7 +119,6 @@ Fall 2025,CSCI9999,999,Fake Course,Nowhere,None,0,0,,None,
         'file': (io.BytesIO(csv_content), 'bad.csv')
     }
 
-    mocker.patch('app.fix_csv', return_value='uploads/bad.csv')
     mocker.patch('app.create_tables')
     mocker.patch('app.parse_csv', side_effect=ValueError("Simulated parse failure"))
 
@@ -108,8 +126,10 @@ Fall 2025,CSCI9999,999,Fake Course,Nowhere,None,0,0,,None,
 
     print(response)
 
-    assert response.status_code == 400
-    assert "Simulated parse failure" in response.get_json()["error"]
+    job = _finish_job(client, response)
+    assert job["phase"] == "failed"
+    assert "Simulated parse failure" in job["errors"][0]
+    assert client.get('/jobs/missing').status_code == 404
 
 # def test_export_success(client, tmp_path):
 #     csv_content = b"""Fall 2025
@@ -175,33 +195,21 @@ def test_swap_classes_success(client, tmp_path):
     
     # Create test database
     conn = sqlite3.connect(db_path)
+    migrate(conn)
     cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE classes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        term TEXT,
-        courseName TEXT,
-        section TEXT,
-        course_title TEXT,
-        room TEXT,
-        meeting_pattern TEXT,
-        enrollment INTEGER,
-        max_enrollment INTEGER
-    )
-""")
     # Insert two classes
     cursor.execute("""
-    INSERT INTO classes (term, courseName, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+    INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
 """, ("Fall 2025", "CSCI1010", "001", "Intro to CS", "PKI 160", "TTh 9:00-10:15", 28, 30))
 
     cursor.execute("""
-    INSERT INTO classes (term, courseName, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+    INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
 """, ("Fall 2025", "CSCI1020", "002", "Data Structures", "PKI 170", "MW 10:30-11:45", 32, 40))
     conn.commit()
-    class1_id = cursor.execute("SELECT id FROM classes WHERE courseName = 'CSCI1010'").fetchone()[0]
-    class2_id = cursor.execute("SELECT id FROM classes WHERE courseName = 'CSCI1020'").fetchone()[0]
+    class1_id = cursor.execute("SELECT id FROM classes WHERE course_number = 'CSCI1010'").fetchone()[0]
+    class2_id = cursor.execute("SELECT id FROM classes WHERE course_number = 'CSCI1020'").fetchone()[0]
     conn.close()
 
     payload = {
@@ -234,47 +242,20 @@ def test_swap_recommendations_sameslot(client, tmp_path):
     cursor = conn.cursor()
 
     # Create necessary tables
-    cursor.execute('''
-        CREATE TABLE classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            term TEXT,
-            course TEXT,
-            section TEXT,
-            course_title TEXT,
-            room TEXT,
-            meeting_pattern TEXT,
-            enrollment INTEGER,
-            max_enrollment INTEGER,
-            instructor TEXT,
-            course_number TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE class_professors (
-            class_id INTEGER,
-            professor_id INTEGER
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE professors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT
-        )
-    ''')
+    migrate(conn)
 
     # Insert test data
-    cursor.executemany('INSERT INTO professors (name) VALUES (?)', [("Dr. A",), ("Dr. B",), ("Dr. C",)])
+    cursor.executemany('INSERT INTO professors (first_name, last_name) VALUES (?, ?)',
+                       [("A", "Dr."), ("B", "Dr."), ("C", "Dr.")])
 
     test_classes = [
-        ("Fall 2025", "CSCI1010", "001", "Intro to CS", "PKI 160", "TTh 9:00-10:15", 35, 30, "Dr. A", "CSCI1010"),
-        ("Fall 2025", "CSCI1020", "001", "Data Structures", "PKI 170", "TTh 9:00-10:15", 15, 40, "Dr. B", "CSCI1020"),
-        ("Fall 2025", "CSCI1030", "001", "Algorithms", "PKI 180", "MW 11:30-12:45", 25, 30, "Dr. C", "CSCI1030"),
+        ("Fall 2025", "CSCI1010", "001", "Intro to CS", "PKI 160", "TTh 9:00-10:15", 35, 30),
+        ("Fall 2025", "CSCI1020", "001", "Data Structures", "PKI 170", "TTh 9:00-10:15", 15, 40),
+        ("Fall 2025", "CSCI1030", "001", "Algorithms", "PKI 180", "MW 11:30-12:45", 25, 30),
     ]
     cursor.executemany('''
-        INSERT INTO classes (term, course, section, course_title, room, meeting_pattern, enrollment, max_enrollment, instructor, course_number)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     ''', test_classes)
 
     # Link professors to classes 
@@ -300,47 +281,20 @@ def test_swap_recommendations_differentslot(client, tmp_path):
     cursor = conn.cursor()
 
     # Create necessary tables
-    cursor.execute('''
-        CREATE TABLE classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            term TEXT,
-            course TEXT,
-            section TEXT,
-            course_title TEXT,
-            room TEXT,
-            meeting_pattern TEXT,
-            enrollment INTEGER,
-            max_enrollment INTEGER,
-            instructor TEXT,
-            course_number TEXT
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE class_professors (
-            class_id INTEGER,
-            professor_id INTEGER
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE professors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT
-        )
-    ''')
+    migrate(conn)
 
     # Insert test data
-    cursor.executemany('INSERT INTO professors (name) VALUES (?)', [("Dr. A",), ("Dr. B",), ("Dr. C",)])
+    cursor.executemany('INSERT INTO professors (first_name, last_name) VALUES (?, ?)',
+                       [("A", "Dr."), ("B", "Dr."), ("C", "Dr.")])
 
     test_classes = [
-        ("Fall 2025", "CSCI1010", "001", "Intro to CS", "PKI 160", "TTh 9:00-10:15", 35, 30, "Dr. A", "CSCI1010"),
-        ("Fall 2025", "CSCI1020", "001", "Data Structures", "PKI 170", "MW 9:00-10:15", 15, 40, "Dr. B", "CSCI1020"),
-        ("Fall 2025", "CSCI1030", "001", "Algorithms", "PKI 180", "MW 11:30-12:45", 25, 30, "Dr. C", "CSCI1030"),
+        ("Fall 2025", "CSCI1010", "001", "Intro to CS", "PKI 160", "TTh 9:00-10:15", 35, 30),
+        ("Fall 2025", "CSCI1020", "001", "Data Structures", "PKI 170", "MW 9:00-10:15", 15, 40),
+        ("Fall 2025", "CSCI1030", "001", "Algorithms", "PKI 180", "MW 11:30-12:45", 25, 30),
     ]
     cursor.executemany('''
-        INSERT INTO classes (term, course, section, course_title, room, meeting_pattern, enrollment, max_enrollment, instructor, course_number)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     ''', test_classes)
 
     # Link professors to classes 
@@ -366,34 +320,7 @@ def test_swap_recommendations_no_classes(client, tmp_path):
     cursor = conn.cursor()
 
     # Create necessary tables, but don't insert any data
-    cursor.execute('''
-        CREATE TABLE classes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            term TEXT,
-            course TEXT,
-            section TEXT,
-            course_title TEXT,
-            room TEXT,
-            meeting_pattern TEXT,
-            enrollment INTEGER,
-            max_enrollment INTEGER,
-            instructor TEXT,
-            course_number TEXT
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE class_professors (
-            class_id INTEGER,
-            professor_id INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE professors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT
-        )
-    ''')
-
+    migrate(conn)
     conn.commit()
     conn.close()
 
@@ -404,4 +331,908 @@ def test_swap_recommendations_no_classes(client, tmp_path):
     data = response.get_json()
     print(data)
     assert data["same_slot_swaps"] == {}
-    assert data["cross_slot_recommendations"] == {}
\ No newline at end of file
+    assert data["cross_slot_recommendations"] == {}
+
+def test_group_crosslists_single_row_per_group():
+    from utils import group_crosslists
+
+    entries = [
+        {"Term": "Fall 2025", "Course": "CSCI 1010", "Section #": "1", "Course Title": "Intro to CS",
+         "Room": "PKI 160", "Meeting Pattern": "MW 9am-10:15am", "Enrollment": 20, "Maximum Enrollment": 30,
+         "Cross-listings": "CSCI 1010-001 / CSCI 8010-001", "Instructor": "", "Cross-list Maximum": 50},
+        {"Term": "Fall 2025", "Course": "CSCI 2020", "Section #": "1", "Course Title": "Data Structures",
+         "Room": "PKI 170", "Meeting Pattern": "TR 9am-10:15am", "Enrollment": 25, "Maximum Enrollment": 30,
+         "Cross-listings": "", "Instructor": "", "Cross-list Maximum": 0},
+        {"Term": "Fall 2025", "Course": "CSCI 8010", "Section #": "1", "Course Title": "Intro to CS",
+         "Room": "PKI 160", "Meeting Pattern": "MW 9am-10:15am", "Enrollment": 5, "Maximum Enrollment": 20,
+         "Cross-listings": "CSCI 1010-001 / CSCI 8010-001", "Instructor": "", "Cross-list Maximum": 50},
+    ]
+
+    rows = group_crosslists(entries)
+
+    assert [row["Course"] for row in rows] == ["CSCI 1010-001 / CSCI 8010-001", "CSCI 2020"]
+    assert rows[0]["Enrollment"] == 25
+    assert rows[0]["Maximum Enrollment"] == 50
+
+
+def test_insert_csv_into_table_reuses_professors():
+    _insert_classes([(course, "PKI 160", "MW 9am-10:15am", 10, 30) for course in ("CSCI 1010", "CSCI 2020", "CSCI 2020")],
+                    instructor="Smith, Jane (12345678) [Primary Instructor, Post, Print]")
+
+    conn = sqlite3.connect(app.config["DB_FILE"])
+    assert conn.execute("SELECT COUNT(*) FROM classes").fetchone()[0] == 2
+    assert conn.execute("SELECT first_name, last_name, p_id FROM professors").fetchall() == [("Jane", "Smith", "12345678")]
+    assert conn.execute("SELECT class_id, professor_id FROM class_professors ORDER BY class_id").fetchall() == [(1, 1), (2, 1)]
+    conn.close()
+
+
+def test_parse_csv_streams_trimmed_rows(tmp_path):
+    from app import parse_csv
+
+    csv_path = tmp_path / "schedule.csv"
+    csv_path.write_text(
+        "Fall 2025,,,,,,,,,,,,,\n"
+        "\"Generated 5/5/2025, 2:12:22 PM\",,,,,,,,,,,,,\n"
+        ",Term,Course,Section #,Course Title,Room,Meeting Pattern,Enrollment,Maximum Enrollment,Cross-listings,Instructor,Cross-list Maximum,Notes,\n"
+        "CSCI 1010 - INTRO TO CS,,,,,,,,,,,,,\n"
+        ",Fall 2025,CSCI 1010,1,Intro to CS,PKI 160,MW 9am-10:15am,28,30,,\"Smith, Jane (1) [Primary]\",,Note,\n",
+        encoding="utf-8",
+    )
+
+    course_data = parse_csv(str(csv_path))
+
+    assert not isinstance(course_data, list)
+    records = list(course_data)
+    assert len(records) == 1
+    assert records[0]["Course"] == "CSCI 1010"
+    assert records[0]["Enrollment"] == 28
+    assert records[0]["Cross-list Maximum"] == 0
+
+
+def test_migrate_adds_indexes_used_by_queries(tmp_path):
+    from schema import migrate, SCHEMA_VERSION
+
+    conn = sqlite3.connect(tmp_path / "test.db")
+    assert migrate(conn) == SCHEMA_VERSION
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    # running it again is a no-op
+    assert migrate(conn) == SCHEMA_VERSION
+
+    plan = conn.execute("""
+        EXPLAIN QUERY PLAN
+        SELECT * FROM classes WHERE term = ? AND meeting_pattern = ? AND max_enrollment >= ? AND enrollment <= ?
+    """, ("Fall 2025", "MW 9am-10:15am", 30, 40)).fetchall()
+    assert "idx_classes_term_slot" in plan[0][-1]
+
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM professors WHERE first_name = ? AND last_name = ? AND p_id = ?",
+                        ("Jane", "Smith", "1")).fetchall()
+    assert "idx_professors_identity" in plan[0][-1]
+    conn.close()
+
+
+def test_endpoint_queries_use_indexes(client):
+    import re
+    from db import get_connection, refresh_reassignment_candidates
+
+    conn = sqlite3.connect(app.config["DB_FILE"])
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, 'MW 9am-10:15am', ?, ?)
+    """, [("CSCI 1010", "PKI 150", 35, 30), ("CSCI 1020", "PKI 151", 10, 40), ("CSCI 1030", "PKI 152", 5, 40)])
+    conn.execute("INSERT INTO uploads (file_path, term) VALUES ('schedule.csv', 'Fall 2025')")
+    refresh_reassignment_candidates(conn)
+    conn.commit()
+
+    statements = []
+    requests = [
+        lambda: client.get('/classes'),
+        lambda: client.get('/classes?course=CSCI&sort=-enrollment&limit=2'),
+        lambda: client.get('/class/1/possible-reassignments'),
+        lambda: client.post('/swap-classrooms', json={"crowded_id": 1, "target_id": 2}),
+        lambda: client.post('/class/1/update-enrollment', json={"action": "add"}),
+        lambda: client.post('/classes/update-enrollment', json={"updates": [{"id": 2, "delta": -1}]}),
+    ]
+    for request in requests:
+        # the pooled connection is handed back after every request
+        get_connection(app.config["DB_FILE"]).set_trace_callback(statements.append)
+        assert request().status_code == 200
+    get_connection(app.config["DB_FILE"]).set_trace_callback(None)
+
+    plans = {}
+    for statement in statements:
+        if re.match(r"\s*(SELECT|UPDATE|DELETE|INSERT)", statement):
+            plans[statement] = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+    conn.close()
+
+    def plan_of(prefix):
+        return next(plan for statement, plan in plans.items() if " ".join(statement.split()).startswith(prefix))
+
+    # only json_each, subqueries and the (LIMIT 1, newest first) uploads lookup are scanned
+    scans = [line for plan in plans.values() for line in plan
+             if line.startswith("SCAN ") and not re.match(r"SCAN (json_each|\(subquery-\d+\)|ranked|uploads)( |$)", line)]
+    assert scans == []
+    assert "idx_classes_term_slot" in plan_of("SELECT id, section, course_number, course_title, enrollment, "
+                                              "max_enrollment, room, meeting_pattern FROM classes WHERE term")[0]
+    assert any("PRIMARY KEY (class_id=?)" in line for line in plan_of("SELECT ranked.reassignment_for"))
+    # the reassignment self-join never leaves the covering index
+    assert any("COVERING INDEX idx_classes_term_slot" in line for line in plan_of("INSERT INTO reassignment_candidates"))
+    assert plan_of("UPDATE classes SET enrollment") == ["SEARCH classes USING INTEGER PRIMARY KEY (rowid=?)"]
+    assert plan_of("UPDATE classes SET max_enrollment") == ["SEARCH classes USING INTEGER PRIMARY KEY (rowid=?)"]
+
+
+def test_migrate_fills_reassignment_candidates_of_existing_classes(client, tmp_path):
+    from schema import migrate
+
+    # the layout create_tables used to build before there were migrations
+    db_path = str(tmp_path / "test.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE classes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, term TEXT, course_number TEXT, section TEXT, course_title TEXT,
+            room TEXT, meeting_pattern TEXT, enrollment INTEGER, max_enrollment INTEGER, professor_id INTEGER,
+            UNIQUE (term, course_number, section)
+        );
+        CREATE TABLE professors (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT, last_name TEXT, p_id TEXT);
+        CREATE TABLE class_professors (class_id INTEGER, professor_id INTEGER, UNIQUE (class_id, professor_id));
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', 'CSCI 1010', '1', 'Intro', 'PKI 160', 'MW 9am-10:15am', 35, 30),
+               ('Fall 2025', 'CSCI 2020', '1', 'Data', 'PKI 200', 'MW 9am-10:15am', 10, 60),
+               ('Fall 2025', 'CSCI 3030', '1', 'Algo', 'PKI 300', 'TR 9am-10:15am', 10, 60);
+    """)
+    migrate(conn)
+    conn.close()
+
+    app.config["DB_FILE"] = db_path
+    assert [c["id"] for c in client.get('/class/1/possible-reassignments').get_json()] == [2]
+    batch = client.post('/classes/batch', json={"ids": [2], "include": ["reassignments"]}).get_json()
+    assert [c["id"] for c in batch["classes"][0]["reassignments"]] == [1]
+
+    # running the migrations again (POST /rooms does) leaves them alone
+    migrate(sqlite3.connect(db_path))
+    assert len(client.get('/class/1/possible-reassignments').get_json()) == 1
+
+
+def test_pooled_connection_is_reused_across_threads(tmp_path):
+    import threading
+    from db import get_connection, release_connections
+
+    db_path = tmp_path / "test.db"
+    conn = get_connection(db_path)
+    assert get_connection(db_path) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def checkout(release):
+        other.append(get_connection(db_path))
+        other[-1].execute("SELECT 1")
+        if release:
+            release_connections()
+
+    # a checked-out connection isn't shared
+    other = []
+    thread = threading.Thread(target=checkout, args=(True,))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+    # once released, the next thread (a new request) reuses it
+    release_connections()
+    thread = threading.Thread(target=checkout, args=(False,))
+    thread.start()
+    thread.join()
+    assert other[1] in (conn, other[0])
+
+
+def test_upload_job_returns_its_connection(tmp_path):
+    import threading
+    import db
+    from app import run_upload_job
+    from jobs import Job
+
+    csv_path = tmp_path / "schedule.csv"
+    csv_path.write_bytes(_schedule_csv("Fall 2025", [("CSCI 1010", "PKI 160", 28, 30)]).read())
+    job = Job(str(csv_path))
+    left_over = []
+
+    def work():
+        run_upload_job(job, app.config["DB_FILE"], "replace")
+        left_over.append(dict(getattr(db._local, "connections", {})))
+
+    # upload jobs run outside any request, so nothing else releases it
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+    assert left_over == [{}]
+    assert db._idle[app.config["DB_FILE"]]
+
+
+def test_swap_recommendations_matching_engine(client, tmp_path):
+    db_path = tmp_path / "test.db"
+    app.config["DB_FILE"] = str(db_path)
+
+    from schema import migrate
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    # Greedy gives the 40-seat room to the 35-student class first, which
+    # leaves nothing for the 28-student class. Matching swaps both.
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, 'MW 9am-10:15am', ?, ?)
+    """, [
+        ("CSCI 1010", "PKI 150", 35, 30),
+        ("CSCI 1020", "PKI 151", 28, 12),
+        ("CSCI 1030", "PKI 152", 10, 40),
+        ("CSCI 1040", "PKI 153", 15, 36),
+    ])
+    conn.executemany("INSERT INTO professors (first_name, last_name, p_id) VALUES (?, 'Smith', ?)",
+                     [("A", "1"), ("B", "2"), ("C", "3"), ("D", "4")])
+    conn.executemany("INSERT INTO class_professors (class_id, professor_id) VALUES (?, ?)",
+                     [(1, 1), (2, 2), (3, 3), (4, 4)])
+    conn.commit()
+    conn.close()
+
+    greedy = client.get("/swap-recommendations").get_json()
+    matching = client.get("/swap-recommendations?engine=matching").get_json()
+
+    assert len(greedy["same_slot_swaps"]["MW 9am-10:15am"]) == 1
+    pairs = {(r["crowded_class_name"], r["target_class_name"]) for r in matching["same_slot_swaps"]["MW 9am-10:15am"]}
+    assert pairs == {("CSCI 1010", "CSCI 1040"), ("CSCI 1020", "CSCI 1030")}
+
+    assert client.get("/swap-recommendations?engine=bogus").status_code == 400
+
+
+def test_recommend_swaps_parallel_matches_serial(tmp_path, monkeypatch):
+    import algorithm
+    from schema import migrate
+
+    db_path = tmp_path / "test.db"
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    rows = []
+    for slot in range(6):
+        pattern = f"MW {slot + 8}am-{slot + 8}:50am"
+        rows += [
+            (f"CRWD {slot}", f"PKI {slot}00", pattern, 35, 30),
+            (f"ROOM {slot}", f"PKI {slot}01", pattern, 10, 40),
+            (f"FULL {slot}", f"PKI {slot}02", pattern, 50, 20),
+        ]
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+
+    serial = algorithm.recommend_swaps_per_timeslot(db_path)
+    monkeypatch.setattr(algorithm, "PARALLEL_MIN_SLOTS", 2)
+    parallel = algorithm.recommend_swaps_per_timeslot(db_path, workers=2)
+
+    assert parallel == serial
+    assert len(serial[0]) == 6 and len(serial[1]) == 6
+
+    # one pool is kept, resized when another worker count is asked for
+    monkeypatch.setattr(algorithm.os, "cpu_count", lambda: 4)
+    with algorithm._pool_lock:
+        pool = algorithm._get_pool(2)
+        assert algorithm._get_pool(2) is pool
+        assert algorithm._get_pool(3) is not pool
+    assert algorithm.recommend_swaps_per_timeslot(db_path, workers=3) == serial
+    algorithm._shutdown_pool()
+    assert algorithm._pool is None
+
+
+def test_cross_slot_picks_tightest_room_with_free_professor(tmp_path):
+    from algorithm import recommended_swaps_if_no_swaps_in_same_timeslot
+    from schema import migrate
+
+    db_path = tmp_path / "test.db"
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, ?, ?, ?)
+    """, [
+        ("CRWD 1000", "PKI 100", "MW 9am-10:15am", 35, 30),
+        ("HUGE 1000", "PKI 200", "TR 9am-10:15am", 20, 90),
+        ("FITS 1000", "PKI 201", "TR 9am-10:15am", 20, 40),
+        ("BUSY 1000", "PKI 300", "F 9am-10am", 20, 40),
+    ])
+    conn.executemany("INSERT INTO professors (first_name, last_name, p_id) VALUES (?, 'Smith', ?)",
+                     [("A", "1"), ("B", "2"), ("C", "3")])
+    # professor 1 teaches the crowded class and is busy on Fridays
+    conn.executemany("INSERT INTO class_professors (class_id, professor_id) VALUES (?, ?)",
+                     [(1, 1), (2, 2), (3, 3), (4, 1)])
+    conn.commit()
+    conn.close()
+
+    not_swappable = [
+        {"id": 1, "course_num": "CRWD 1000", "room": "PKI 100", "enrollment": 35, "capacity": 30, "slot": "MW 9am-10:15am"},
+        # a class without any professor on record is skipped
+        {"id": 99, "course_num": "NONE 1000", "room": "PKI 999", "enrollment": 35, "capacity": 30, "slot": "MW 9am-10:15am"},
+    ]
+    recs = recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable)
+
+    assert [(r["crowded_id"], r["target_id"]) for r in recs["MW 9am-10:15am"]] == [(1, 3)]
+
+
+def test_cross_slot_respects_overlapping_meeting_times(tmp_path):
+    from algorithm import recommended_swaps_if_no_swaps_in_same_timeslot
+    from schema import migrate
+
+    db_path = tmp_path / "test.db"
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, ?, ?, ?)
+    """, [
+        ("CRWD 1000", "PKI 100", "TR 9am-10:15am", 35, 30),
+        ("OVER 1000", "PKI 200", "M 10:30am-12pm", 20, 40),
+        ("FREE 1000", "PKI 201", "F 9am-10am", 20, 50),
+        ("BUSY 1000", "PKI 300", "MW 10:30am-11:45am", 20, 40),
+    ])
+    conn.executemany("INSERT INTO professors (first_name, last_name, p_id) VALUES (?, 'Smith', ?)",
+                     [("A", "1"), ("B", "2"), ("C", "3")])
+    # professor 1 already teaches MW 10:30am-11:45am, which overlaps the Monday slot
+    conn.executemany("INSERT INTO class_professors (class_id, professor_id) VALUES (?, ?)",
+                     [(1, 1), (2, 2), (3, 3), (4, 1)])
+    conn.commit()
+    conn.close()
+
+    not_swappable = [
+        {"id": 1, "course_num": "CRWD 1000", "room": "PKI 100", "enrollment": 35, "capacity": 30, "slot": "TR 9am-10:15am"},
+    ]
+    recs = recommended_swaps_if_no_swaps_in_same_timeslot(db_path, not_swappable)
+
+    assert [(r["crowded_id"], r["target_id"]) for r in recs["TR 9am-10:15am"]] == [(1, 3)]
+
+
+def test_slot_conflicts_compares_meeting_times():
+    from utils import parse_meeting_pattern, slot_conflicts
+
+    assert parse_meeting_pattern("TR 9am-10:15am; F 2pm-5pm") == ((10, 540, 615), (16, 840, 1020))
+    assert parse_meeting_pattern("") is None
+    # only the end carries the suffix, and the start is still in the morning
+    assert parse_meeting_pattern("MW 11:00-12:15pm") == ((5, 660, 735),)
+    assert parse_meeting_pattern("MW 1:00-2:15pm") == ((5, 780, 855),)
+
+    conflicts = slot_conflicts(["MW 10:30am-11:45am", "M 10:30am-12pm", "TR 10:30am-11:45am", "Does Not Meet",
+                                "MW 11:00-12:15pm"])
+    assert conflicts == [0b10011, 0b10011, 0b00100, 0b01000, 0b10011]
+
+
+def test_swap_recommendations_cached_until_write(client, tmp_path):
+    db_path = tmp_path / "test.db"
+    app.config["DB_FILE"] = str(db_path)
+
+    from schema import migrate
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    conn.execute("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', 'CSCI 1010', '1', 'Title', 'PKI 160', 'MW 9am-10:15am', 20, 30)
+    """)
+    conn.commit()
+    conn.close()
+
+    first = client.get("/swap-recommendations")
+    second = client.get("/swap-recommendations")
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert first.get_json() == second.get_json()
+
+    client.post("/class/1/update-enrollment", json={"action": "add"})
+    assert client.get("/swap-recommendations").headers["X-Cache"] == "MISS"
+
+    # concurrent requests don't lose counts
+    import threading
+    from app import recommendation_cache_stats
+
+    before = sum(recommendation_cache_stats.values())
+    threads = [threading.Thread(target=lambda: [app.test_client().get("/swap-recommendations") for _ in range(20)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(recommendation_cache_stats.values()) == before + 80
+
+
+def test_recommendation_state_updates_incrementally(tmp_path, mocker):
+    import algorithm
+    from schema import migrate
+
+    db_path = tmp_path / "test.db"
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, ?, ?, ?)
+    """, [
+        ("CSCI 1010", "PKI 150", "MW 9am-10:15am", 28, 30),
+        ("CSCI 1020", "PKI 151", "MW 9am-10:15am", 10, 40),
+        ("CSCI 1030", "PKI 152", "TR 9am-10:15am", 10, 40),
+    ])
+    conn.commit()
+
+    state = algorithm.RecommendationState(db_path)
+    assert state.results() == ({}, [], {})
+
+    solve_slots = mocker.spy(algorithm, "_solve_slots")
+    conn.execute("UPDATE classes SET enrollment = 35 WHERE id = 1")
+    conn.commit()
+    conn.close()
+    state.update_enrollment(1, 35)
+
+    # only the changed class's timeslot was solved again
+    assert [list(call.args[0]) for call in solve_slots.call_args_list] == [["MW 9am-10:15am"]]
+    same, not_swappable = algorithm.recommend_swaps_per_timeslot(db_path)
+    assert state.results()[:2] == (same, not_swappable)
+    assert same["MW 9am-10:15am"][0]["target_id"] == 2
+
+
+def test_export_matches_rows_by_course_and_section(client, tmp_path, monkeypatch):
+    import app as app_module
+
+    csv_path = tmp_path / "schedule.csv"
+    csv_path.write_text(
+        "Fall 2025,,,,,,,,,,,,\n"
+        "\"Generated 5/5/2025, 2:12:22 PM\",,,,,,,,,,,,\n"
+        ",Term,Course,Section #,Course Title,Room,Meeting Pattern,Enrollment,Maximum Enrollment,Cross-listings,Instructor,Cross-list Maximum,\n"
+        "CSCI 1010 - INTRO TO CS,,,,,,,,,,,,\n"
+        ",Fall 2025,CSCI 1010,1,Intro to CS,PKI 160,MW 9am-10:15am,28,30,,\"Smith, Jane (1) [Primary]\",,\n"
+        ",Fall 2025,CSCI 1010,2,Intro to CS,PKI 161,MW 9am-10:15am,20,30,,\"Smith, Jane (1) [Primary]\",,\n",
+        encoding="utf-8",
+    )
+    monkeypatch.setenv("USERPROFILE", str(tmp_path))
+    (tmp_path / "Desktop").mkdir()
+
+    app.config["DB_FILE"] = str(tmp_path / "test.db")
+    app_module.create_tables()
+    # nothing uploaded yet
+    assert client.put("/export").status_code == 404
+    conn = sqlite3.connect(app.config["DB_FILE"])
+    # stored in the opposite order of the csv
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', 'CSCI 1010', ?, 'Intro to CS', ?, 'MW 9am-10:15am', ?, 30)
+    """, [("2", "PKI 161", 25), ("1", "PKI 160", 35)])
+    conn.execute("INSERT INTO uploads (file_path, term) VALUES (?, 'Fall 2025')", (str(csv_path),))
+    conn.commit()
+    conn.close()
+
+    response = client.put("/export")
+    assert response.status_code == 200
+
+    with open(tmp_path / "Desktop" / "output.csv", newline='', encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["Fall 2025"]
+    assert rows[1][0].startswith("Generated")
+    assert rows[3] == ["CSCI 1010 - INTRO TO CS"]
+    assert [(row[3], row[7]) for row in rows[4:]] == [("1", "35"), ("2", "25")]
+    # same quoting as csv.QUOTE_NOTNULL: the empty first cell is left unquoted
+    lines = (tmp_path / "Desktop" / "output.csv").read_text(encoding="utf-8").splitlines()
+    assert lines[4].startswith(',"Fall 2025","CSCI 1010","1",')
+
+
+def _upload_schedule(client, tmp_path):
+    app.config["DB_FILE"] = str(tmp_path / "test.db")
+    csv_content = (
+        "Fall 2025,,,,,,,,,,,,\n"
+        "\"Generated 5/5/2025, 2:12:22 PM\",,,,,,,,,,,,\n"
+        ",Term,Course,Section #,Course Title,Room,Meeting Pattern,Enrollment,Maximum Enrollment,Cross-listings,Instructor,Cross-list Maximum,Notes\n"
+        "CSCI 1010 - INTRO TO CS,,,,,,,,,,,,\n"
+        ",Fall 2025,CSCI 1010,1,Intro to CS,PKI 160,MW 9am-10:15am,28,30,,\"Smith, Jane (1) [Primary]\",,Note\n"
+    ).encode("utf-8")
+    response = client.post('/upload', data={'file': (io.BytesIO(csv_content), 'export.csv')},
+                           content_type='multipart/form-data')
+    job = _finish_job(client, response)
+    assert (job["phase"], job["rows_processed"], job["rows_total"]) == ("done", 1, 1)
+
+    conn = sqlite3.connect(app.config["DB_FILE"])
+    # what an enrollment update and a room swap leave behind
+    conn.execute("UPDATE classes SET enrollment = 35, room = 'PKI 200'")
+    conn.commit()
+    conn.close()
+
+
+def test_download_export_csv_streams_and_gzips(client, tmp_path):
+    import gzip
+    from app import csv_chunks
+
+    assert b"".join(csv_chunks([["CSCI 1010", None, 'Smith, "Jane"', 3]])) == b'"CSCI 1010",,"Smith, ""Jane""","3"\r\n'
+
+    _upload_schedule(client, tmp_path)
+
+    response = client.get('/export.csv')
+    assert response.status_code == 200
+    assert response.is_streamed
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ["Fall 2025"]
+    assert rows[4][7] == "35"
+    # quoted the same way as PUT /export
+    assert response.get_data(as_text=True).splitlines()[4].startswith(',"Fall 2025","CSCI 1010","1",')
+
+    response = client.get('/export.csv', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert list(csv.reader(io.StringIO(gzip.decompress(response.get_data()).decode("utf-8")))) == rows
+
+
+def test_download_export_xlsx(client, tmp_path):
+    from openpyxl import load_workbook
+
+    _upload_schedule(client, tmp_path)
+
+    response = client.get('/export.xlsx')
+    assert response.status_code == 200
+    assert "attachment" in response.headers["Content-Disposition"]
+    rows = list(load_workbook(io.BytesIO(response.get_data())).active.values)
+    assert rows[0][0] == "Fall 2025"
+    assert rows[3][0] == "CSCI 1010 - INTRO TO CS"
+    assert rows[4][5] == "PKI 200"
+    assert rows[4][7] == 35
+
+    assert client.get('/export.pdf').status_code == 404
+
+
+def test_column_map_is_shared_per_layout():
+    from utils import get_column_map
+
+    headers = ["", "Term", "Course", "Enrollment", "Notes"]
+    columns = get_column_map(headers)
+    assert get_column_map(list(headers)) is columns
+
+    row = ["", "Fall 2025", "CSCI 1010", "28"]
+    assert columns.get(row, "Enrollment") == "28"
+    assert columns.get(row, "Notes") == ""
+    columns.set(row, "Notes", "moved")
+    assert row == ["", "Fall 2025", "CSCI 1010", "28", "moved"]
+    with pytest.raises(ValueError):
+        columns.position("Room")
+
+
+def test_get_classes_keyset_pages_filters_and_etag(client):
+    conn = sqlite3.connect(app.config["DB_FILE"])
+    conn.executemany("""
+        INSERT INTO classes (term, course_number, section, course_title, room, meeting_pattern, enrollment, max_enrollment)
+        VALUES ('Fall 2025', ?, '1', 'Title', ?, 'MW 9am-10:15am', ?, 30)
+    """, [
+        ("CSCI 1010", "PKI 150", 35),
+        ("MATH 1950", "PKI 150", 20),
+        ("CSCI 2030", "PKI 151", 30),
+        ("CSCI 1020", "PKI 152", 31),
+    ])
+    conn.commit()
+    conn.close()
+
+    # unfiltered list keeps its old shape
+    assert [c["id"] for c in client.get('/classes').get_json()] == [1, 2, 3, 4]
+
+    pages = []
+    response = client.get('/classes?course=CSCI&sort=-enrollment&limit=2')
+    pages.append([c["courseName"] for c in response.get_json()])
+    response = client.get(f'/classes?course=CSCI&sort=-enrollment&limit=2&after={response.headers["X-Next-Cursor"]}')
+    pages.append([c["courseName"] for c in response.get_json()])
+    assert "X-Next-Cursor" not in response.headers
+    assert pages == [["CSCI 1010", "CSCI 1020"], ["CSCI 2030"]]
+
+    assert [c["id"] for c in client.get('/classes?over_capacity=true&room=PKI 150').get_json()] == [1]
+    assert client.get('/classes?sort=professor').status_code == 400
+    assert client.get('/classes?after=nonsense').status_code == 400
+
+    # unchanged list is revalidated with the ETag
+    response = client.get('/classes')
+    etag = response.headers["ETag"]
+    assert client.get('/classes', headers={"If-None-Match": etag}).status_code == 304
+    client.post('/class/1/update-enrollment', json={"action": "remove"})
+    assert client.get('/classes', headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_classes_batch_loads_details_professors_and_reassignments(client):
+    _insert_classes([
+        ("CSCI 1010", "PKI 150", "MW 9am-10:15am", 35, 30),
+        ("CSCI 1020", "PKI 151", "MW 9am-10:15am", 10, 40),
+        ("CSCI 1030", "PKI 152", "MW 9am-10:15am", 10, 60),
+    ], instructor="Smith, Jane (12345678) [Primary Instructor, Post, Print]")
+
+    single = client.get('/class/1?include=professors,reassignments').get_json()
+    assert [p["last_name"] for p in single["professors"]] == ["Smith"]
+    assert [r["id"] for r in single["reassignments"]] == [2, 3]
+    # the registrar's source row isn't part of the response
+    assert set(single["reassignments"][0]) == {"id", "term", "course_number", "section", "course_title", "room",
+                                               "meeting_pattern", "enrollment", "max_enrollment"}
+    assert client.get('/class/1/possible-reassignments').get_json() == single["reassignments"]
+    assert client.get('/class/1?include=grades').status_code == 400
+
+    from db import get_connection
+    statements = []
+    get_connection(app.config["DB_FILE"]).set_trace_callback(statements.append)
+    response = client.post('/classes/batch', json={"ids": [3, 1, 99], "include": ["professors", "reassignments"]})
+    get_connection(app.config["DB_FILE"]).set_trace_callback(None)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [c["id"] for c in body["classes"]] == [3, 1]
+    assert body["missing"] == [99]
+    assert body["classes"][1] == single
+    # details, professors and reassignments: one statement each
+    assert len(statements) == 3
+
+    assert client.post('/classes/batch', json={"ids": "1,2"}).status_code == 400
+
+
+def test_reassignment_candidates_maintained_on_writes(client):
+    _insert_classes([
+        ("CSCI 1010", "PKI 150", "MW 9am-10:15am", 35, 40),
+        ("CSCI 1020", "PKI 151", "MW 9am-10:15am", 10, 60),
+        ("CSCI 1030", "PKI 152", "MW 9am-10:15am", 10, 40),
+    ])
+
+    def candidates(url):
+        return [(c["id"], c["max_enrollment"] - c["enrollment"]) for c in client.get(url).get_json()]
+
+    # fewest available seats first
+    assert candidates('/class/1/possible-reassignments') == [(3, 30), (2, 50)]
+    assert candidates('/class/1/possible-reassignments?limit=1') == [(3, 30)]
+    assert client.get('/class/1/possible-reassignments?limit=0').status_code == 400
+
+    # class 3 can no longer take class 1's students
+    client.post('/class/1/update-enrollment', json={"action": "45"})
+    assert candidates('/class/1/possible-reassignments') == [(2, 50)]
+    assert candidates('/class/2/possible-reassignments') == [(1, -5), (3, 30)]
+
+
+def test_swap_classrooms_batch_is_all_or_nothing(client):
+    _insert_classes([
+        ("CSCI 1010", "PKI 150", "MW 9am-10:15am", 35, 30),
+        ("CSCI 1020", "PKI 151", "MW 9am-10:15am", 10, 40),
+        ("CSCI 1030", "PKI 152", "TR 9am-10:15am", 45, 40),
+        ("CSCI 1040", "PKI 153", "MW 1pm-2:15pm", 10, 50),
+    ])
+
+    def rooms():
+        conn = sqlite3.connect(app.config["DB_FILE"])
+        rows = conn.execute("SELECT room, meeting_pattern, max_enrollment FROM classes ORDER BY id").fetchall()
+        conn.close()
+        return rows
+
+    before = rooms()
+    # unknown class: nothing is applied
+    response = client.post('/swap-classrooms/batch', json={"swaps": [
+        {"crowded_id": 1, "target_id": 2}, {"crowded_id": 3, "target_id": 99}]})
+    assert response.status_code == 404
+    assert rooms() == before
+    assert client.post('/swap-classrooms/batch', json={"swaps": [{"crowded_id": 1, "target_id": 1}]}).status_code == 400
+
+    # a /swap-recommendations response can be posted as is
+    recommendations = {
+        "same_slot_swaps": {"MW 9am-10:15am": [{"crowded_id": 1, "target_id": 2}]},
+        "cross_slot_recommendations": {"TR 9am-10:15am": [
+            {"old_slot": "TR 9am-10:15am", "new_slot": "MW 1pm-2:15pm", "crowded_id": 3, "target_id": 4}]},
+    }
+    response = client.post('/swap-classrooms/batch', json=recommendations)
+    assert response.status_code == 200
+    assert response.get_json()["swapped"] == 2
+    assert rooms() == [
+        ("PKI 151", "MW 9am-10:15am", 40),
+        ("PKI 150", "MW 9am-10:15am", 30),
+        ("PKI 153", "MW 1pm-2:15pm", 50),
+        ("PKI 152", "TR 9am-10:15am", 40),
+    ]
+    actions = [entry["action"] for entry in client.get('/audit').get_json()]
+    assert actions == ["different-slot swap", "same-slot swap"]
+
+
+def test_enrollment_updates_are_atomic(client):
+    import threading
+
+    _insert_classes([
+        ("CSCI 1010", "PKI 150", "MW 9am-10:15am", 0, 30),
+        ("CSCI 1020", "PKI 150", "MW 9am-10:15am", 1, 30),
+    ])
+
+    # concurrent clicks from several workers all count
+    def click():
+        with app.test_client() as worker:
+            for _ in range(10):
+                assert worker.post('/class/1/update-enrollment', json={"action": "add"}).status_code == 200
+    threads = [threading.Thread(target=click) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.get('/class/1').get_json()["currentEnrollment"] == 30
+    assert client.post('/class/1/update-enrollment', json={"action": "0"}).get_json() == {"enrollment": 0}
+    assert client.post('/class/1/update-enrollment', json={"action": "remove"}).status_code == 400
+    # a number can't make it negative either
+    assert client.post('/class/1/update-enrollment', json={"action": "-3"}).status_code == 400
+    assert client.get('/class/1').get_json()["currentEnrollment"] == 0
+    assert client.post('/class/9/update-enrollment', json={"action": "add"}).status_code == 404
+
+    response = client.post('/classes/update-enrollment', json={"updates": [{"id": 1, "delta": 5}, {"id": 2, "delta": -1}]})
+    assert response.get_json() == {"enrollments": [{"id": 1, "enrollment": 5}, {"id": 2, "enrollment": 0}]}
+
+    # class 2 is empty, so nothing is applied
+    response = client.post('/classes/update-enrollment', json={"updates": [{"id": 1, "delta": 5}, {"id": 2, "delta": -1}]})
+    assert response.status_code == 400
+    assert response.get_json()["rejected"] == [{"id": 2, "delta": -1}]
+    assert client.get('/class/1').get_json()["currentEnrollment"] == 5
+
+
+def test_audit_log_is_written_in_background_and_queryable(client, tmp_path):
+    from audit import AuditLog, query_audit
+    from db import get_connection
+    from schema import migrate
+
+    db_path = str(tmp_path / "test.db")
+    migrate(get_connection(db_path))
+    audit_log = AuditLog(str(tmp_path / "archive"), max_entries=4)
+    audit_log.record(db_path, [
+        {"action": "same-slot swap", "class_id": i, "target_id": i + 100,
+         "from_room": f"PKI {i}", "to_room": "PKI 999", "course": f"CSCI {i}",
+         "created_at": f"2025-05-0{i} 10:00:00"}
+        for i in range(1, 6)
+    ])
+    audit_log.flush()
+
+    # five entries went over the limit of four, the oldest three were archived
+    conn = get_connection(db_path)
+    assert [entry["class_id"] for entry in query_audit(conn)] == [5, 4]
+    archived = [json.loads(line) for path in (tmp_path / "archive").iterdir() for line in path.read_text().splitlines()]
+    assert [entry["course"] for entry in archived] == ["CSCI 1", "CSCI 2", "CSCI 3"]
+
+    assert [entry["class_id"] for entry in query_audit(conn, class_id=104)] == [4]
+    assert [entry["class_id"] for entry in query_audit(conn, room="PKI 999", since="2025-05-05")] == [5]
+    assert query_audit(conn, room="PKI 5")[0]["course"] == "CSCI 5"
+
+    app.config["DB_FILE"] = db_path
+    assert client.get('/audit?since=yesterday').status_code == 400
+
+
+def _schedule_csv(term, rows):
+    lines = [
+        f"{term},,,,,,,,,,,,",
+        "\"Generated 5/5/2025, 2:12:22 PM\",,,,,,,,,,,,",
+        ",Term,Course,Section #,Course Title,Room,Meeting Pattern,Enrollment,Maximum Enrollment,Cross-listings,Instructor,Cross-list Maximum,Notes",
+        "CSCI 1010 - INTRO TO CS,,,,,,,,,,,,",
+    ]
+    lines += [f",{term},{course},1,Title,{room},MW 9am-10:15am,{enrollment},{maximum},,\"Smith, Jane (1) [Primary]\",,Note"
+              for course, room, enrollment, maximum in rows]
+    return io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def test_uploads_keep_other_terms(client, tmp_path):
+    app.config["DB_FILE"] = str(tmp_path / "test.db")
+
+    def upload(term, rows):
+        response = client.post('/upload', data={'file': (_schedule_csv(term, rows), 'export.csv')},
+                               content_type='multipart/form-data')
+        assert _finish_job(client, response)["phase"] == "done"
+
+    upload("Fall 2025", [("CSCI 1010", "PKI 160", 40, 30), ("CSCI 2020", "PKI 200", 10, 60)])
+    upload("Spring 2026", [("CSCI 3030", "PKI 300", 5, 20)])
+
+    # the latest term is the default, the other one is still there
+    assert [c["courseName"] for c in client.get('/classes').get_json()] == ["CSCI 3030"]
+    fall = client.get('/classes?term=Fall 2025').get_json()
+    assert [c["courseName"] for c in fall] == ["CSCI 1010", "CSCI 2020"]
+
+    response = client.get('/swap-recommendations?term=Fall 2025')
+    assert response.headers["X-Cache"] == "MISS"
+    assert len(response.get_json()["same_slot_swaps"]) == 1
+    etag = client.get('/classes?term=Fall 2025').headers["ETag"]
+
+    # a write to the spring term leaves fall's caches alone
+    assert client.post('/class/3/update-enrollment', json={"action": "add"}).status_code == 200
+    assert client.get('/swap-recommendations?term=Fall 2025').headers["X-Cache"] == "HIT"
+    assert client.get('/classes?term=Fall 2025', headers={"If-None-Match": etag}).status_code == 304
+
+    # re-uploading fall only changes fall
+    upload("Fall 2025", [("CSCI 1010", "PKI 160", 20, 30)])
+    fall = client.get('/classes?term=Fall 2025').get_json()
+    assert [(c["id"], c["courseName"]) for c in fall] == [(1, "CSCI 1010")]
+    assert [c["currentEnrollment"] for c in client.get('/classes?term=Spring 2026').get_json()] == [6]
+    assert client.get('/swap-recommendations?term=Fall 2025').headers["X-Cache"] == "MISS"
+
+
+def test_reupload_only_writes_changed_sections(client, tmp_path, mocker):
+    import app as app_module
+
+    app.config["DB_FILE"] = str(tmp_path / "test.db")
+
+    def upload(rows, mode="merge"):
+        response = client.post('/upload', data={'file': (_schedule_csv("Fall 2025", rows), 'export.csv'), 'mode': mode},
+                               content_type='multipart/form-data')
+        return _finish_job(client, response)["result"]
+
+    rows = [("CSCI 1010", "PKI 160", 40, 30), ("CSCI 2020", "PKI 200", 10, 60), ("CSCI 3030", "PKI 300", 5, 20)]
+    assert upload(rows) == {"inserted": 3, "updated": 0, "deleted": 0, "unchanged": 0}
+    assert client.post('/swap-classrooms', json={"crowded_id": 1, "target_id": 2}).status_code == 200
+
+    # the same file again isn't even parsed, so the cached recommendations stay valid
+    client.get('/swap-recommendations')
+    parse = mocker.spy(app_module, "load_records")
+    response = client.post('/upload', data={'file': (_schedule_csv("Fall 2025", rows), 'export.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    job = client.get(response.headers["Location"]).get_json()
+    assert (job["phase"], job["result"]) == ("done", {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 3})
+    assert parse.call_count == 0
+    assert client.get('/swap-recommendations').headers["X-Cache"] == "HIT"
+
+    # one section changed, one dropped, one added
+    rows = [("CSCI 1010", "PKI 160", 42, 30), ("CSCI 2020", "PKI 200", 10, 60), ("CSCI 4040", "PKI 400", 1, 10)]
+    assert upload(rows) == {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+    classes = {c["courseName"]: c for c in client.get('/classes').get_json()}
+    assert sorted(classes) == ["CSCI 1010", "CSCI 2020", "CSCI 4040"]
+    assert [classes[course]["id"] for course in sorted(classes)] == [1, 2, 4]
+    # the registrar's enrollment change is applied, the swap is kept
+    assert client.get('/class/1').get_json()["room"] == "PKI 200"
+    assert classes["CSCI 1010"]["currentEnrollment"] == 42
+    assert classes["CSCI 1010"]["maxEnrollment"] == 60
+
+    # replace mode puts the registrar's rooms back
+    assert upload(rows, mode="replace") == {"inserted": 0, "updated": 2, "deleted": 0, "unchanged": 1}
+    assert client.get('/class/1').get_json()["room"] == "PKI 160"
+    response = client.post('/upload', data={'file': (_schedule_csv("Fall 2025", rows), 'export.csv'), 'mode': "wipe"},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_uploads_are_stored_by_content_and_parsed_once(tmp_path, mocker):
+    import app as app_module
+    import zlib
+    from upload_store import RECORD_FORMAT, store_upload, load_records
+
+    data = _schedule_csv("Fall 2025", [("CSCI 1010", "PKI 160", 40, 30)]).getvalue()
+    digest, path = store_upload(str(tmp_path), data)
+    assert path == str(tmp_path / f"{digest}.csv")
+    assert store_upload(str(tmp_path), data) == (digest, path)
+    # same name, different content: both are kept
+    assert store_upload(str(tmp_path), data + b"\n")[1] != path
+
+    parse = mocker.spy(app_module, "parse_csv")
+    records = load_records(path, app_module.parse_csv)
+    assert load_records(path, app_module.parse_csv) == records
+    assert parse.call_count == 1
+    # the cache is plain data, not a pickle
+    with open(path[:-len(".csv")] + ".records", "rb") as cache_file:
+        assert json.loads(zlib.decompress(cache_file.read()))[0] == RECORD_FORMAT
+    assert records == [{"Term": "Fall 2025", "Course": "CSCI 1010", "Section #": "1", "Course Title": "Title",
+                        "Room": "PKI 160", "Meeting Pattern": "MW 9am-10:15am", "Enrollment": 40,
+                        "Maximum Enrollment": 30, "Instructor": "Smith, Jane (1) [Primary]"}]
+
+
+def test_room_inventory_offers_empty_rooms(client, tmp_path):
+    from rooms import get_room_capacities
+
+    app.config["DB_FILE"] = str(tmp_path / "test.db")
+    response = client.post('/upload', data={'file': (_schedule_csv("Fall 2025", [("CSCI 1010", "PKI 160", 40, 30)]), 'export.csv')},
+                           content_type='multipart/form-data')
+    assert _finish_job(client, response)["phase"] == "done"
+    # no inventory yet, so there's nothing to swap with
+    assert client.get('/swap-recommendations').get_json()["same_slot_swaps"] == {}
+
+    inventory = io.BytesIO(b"Building,Room,Seats\nPKI,160,30\nPKI,500,50\nPKI,510,45\n")
+    response = client.post('/rooms', data={'file': (inventory, 'rooms.csv')}, content_type='multipart/form-data')
+    assert response.get_json()["rooms"] == 3
+    assert [room["id"] for room in client.get('/rooms').get_json()] == ["PKI 160", "PKI 500", "PKI 510"]
+    # capacities are only read again after another import
+    assert get_room_capacities(app.config["DB_FILE"]) is get_room_capacities(app.config["DB_FILE"])
+
+    # the greedy pass takes the empty room with the most spare seats
+    response = client.get('/swap-recommendations')
+    assert response.headers["X-Cache"] == "MISS"
+    recommendations = response.get_json()
+    moves = recommendations["same_slot_swaps"]["MW 9am-10:15am"]
+    assert [(move["target_id"], move["target_room"]) for move in moves] == [(None, "PKI 500")]
+
+    assert client.post('/swap-classrooms/batch', json=recommendations).status_code == 200
+    moved = client.get('/class/1').get_json()
+    assert (moved["room"], moved["maxEnrollment"]) == ("PKI 500", 50)
+    assert client.get('/audit').get_json()[0]["action"] == "same-slot move"
+    response = client.post('/swap-classrooms', json={"crowded_id": 1, "target_id": None, "target_room": "PKI 999"})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Room is not in the room inventory."}
+
+    response = client.post('/rooms', data={'file': (io.BytesIO(b"Room\n160\n"), 'rooms.csv')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,88 @@
+# This file stores uploaded schedules by content.
+# Every upload is saved under the SHA-256 of its bytes, so an identical file is
+# only stored once and uploads that share a filename don't overwrite each other.
+# The parsed and crosslist-grouped records of each file are cached next to it,
+# so uploading the same file again skips parsing altogether.
+
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+
+from utils import group_crosslists
+
+# Fields of a grouped class row the import reads, in the order they're cached
+RECORD_FIELDS = ("Term", "Course", "Section #", "Course Title", "Room", "Meeting Pattern",
+                 "Enrollment", "Maximum Enrollment", "Instructor")
+
+# Bumped whenever the cached layout changes, so older caches are parsed again
+RECORD_FORMAT = 2
+
+
+def store_upload(upload_dir, data):
+    """
+    Save uploaded bytes as ``<sha256>.csv`` in ``upload_dir``.
+
+    Nothing is written when the same content is already stored.
+
+    :param upload_dir: Folder uploads are kept in.
+    :type upload_dir: str
+    :param data: The uploaded file's content.
+    :type data: bytes
+    :return: The SHA-256 hex digest and the path of the stored file.
+    :rtype: tuple
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(upload_dir, f"{digest}.csv")
+    if not os.path.exists(path):
+        _write_atomically(upload_dir, path, data)
+    return digest, path
+
+
+def load_records(csv_path, parse):
+    """
+    Return the grouped class rows of a stored upload.
+
+    They are read from the ``.records`` cache next to ``csv_path`` when
+    there is one, otherwise the file is parsed with ``parse`` and grouped
+    with ``utils.group_crosslists``, and the cache is written. Cached rows
+    only hold ``RECORD_FIELDS``; grouping them again is a no-op. The cache
+    is compressed JSON, so reading one never runs code. The rows are
+    returned as a list: grouping needs the whole file anyway, and the job
+    reports their count before importing them.
+
+    :param csv_path: Path returned by ``store_upload``.
+    :type csv_path: str
+    :param parse: Function turning a CSV path into course entries
+        (``app.parse_csv``).
+    :type parse: callable
+    :return: List of class rows (dicts).
+    :rtype: list
+    """
+    cache_path = os.path.splitext(csv_path)[0] + ".records"
+    try:
+        with open(cache_path, "rb") as cache_file:
+            version, fields, rows = json.loads(zlib.decompress(cache_file.read()))
+        if version == RECORD_FORMAT and tuple(fields) == RECORD_FIELDS:
+            return [dict(zip(RECORD_FIELDS, row)) for row in rows]
+    except (OSError, zlib.error, ValueError, TypeError):
+        # missing or unreadable cache, parse the file again
+        pass
+
+    records = [{field: entry[field] for field in RECORD_FIELDS} for entry in group_crosslists(parse(csv_path))]
+    # one array per row instead of an object, so the field names aren't repeated
+    rows = [[record[field] for field in RECORD_FIELDS] for record in records]
+    data = zlib.compress(json.dumps([RECORD_FORMAT, RECORD_FIELDS, rows], separators=(",", ":")).encode("utf-8"))
+    _write_atomically(os.path.dirname(cache_path), cache_path, data)
+    return records
+
+
+def _write_atomically(directory, path, data):
+    """
+    Write ``data`` to ``path`` through a temporary file, so concurrent
+    readers never see a partly written file.
+    """
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as temp_file:
+        temp_file.write(data)
+    os.replace(temp_file.name, path)
@@ -1,7 +1,9 @@
 # This file is used for utility functions that are used in the app.py file.
 # It contains mostly functions to parse / regularize data from the csv file and insert it into the database.
 
-import re, csv
+import re, csv, heapq
+from collections import namedtuple
+from functools import lru_cache
 
 def parse_instructor(instructor_from_csv):
     """
@@ -37,45 +39,274 @@ def parse_instructor(instructor_from_csv):
 
     return results
 
-def get_or_create_professor(cursor, first_name, last_name, p_id, class_id):
+def cross_list_key(cross_listings):
     """
-    Get or create a professor in the database.
-    This function will check if the professor already exists in the database
-    and if not, it will create a new entry.
+    Build the normalized key for a "Cross-listings" cell.
+
+    Spacing around the "/" separators is not consistent in the registrar
+    export, so each course is stripped and the courses are sorted before
+    being joined back together. Returns an empty string for classes that
+    are not crosslisted.
     """
-    cursor.execute("SELECT * FROM professors WHERE first_name = ? AND last_name = ? and p_id = ?", (first_name, last_name, p_id))
-    professor = cursor.fetchone()
+    cross_listings = cross_listings.strip()
+    if not cross_listings:
+        return ""
+    courses = [course_num.strip() for course_num in cross_listings.split('/')]
+    return " / ".join(sorted(courses))
 
-    if professor:
-        # Professor already exists, return the existing entry
-        # use this id to insert into the class_professors table
-        professor_id = professor[0]
-    else:
-        # Professor does not exist, insert a new entry
-        # and get this id to insert into the class_professors table
-        cursor.execute("INSERT OR IGNORE INTO professors(first_name, last_name, p_id) VALUES(?, ?, ?)",
-                    (first_name, last_name, p_id))
-        professor_id = cursor.lastrowid    
+def group_crosslists(course_data):
+    """
+    Collapse crosslisted sections into one class row per crosslist group.
 
-    # Insert the class-professor relationship into the class_professors table
-    # if the professor already exists
-    cursor.execute("""INSERT OR IGNORE INTO class_professors (class_id, professor_id)
-                            VALUES (?, ?)""", (class_id, professor_id)) 
+    Every entry whose "Course" is listed under a crosslist key is part of that
+    group. A group is emitted once, at the position of the first entry whose
+    "Cross-listings" cell is already written in normalized form, using the
+    first member's details, the crosslist key as the course name, the summed
+    enrollment and the "Cross-list Maximum". Every other entry is passed
+    through unchanged, which matches what ``insert_csv_into_table`` has always
+    stored.
 
-    
-'''Function to fix the trailing commas in the csv'''
-def fix_csv(csv_document):
-    '''Cannot open the same file for input and output to write, take the extension and and -fix to it to have two separate files'''
-    fixed_csv = csv_document.replace(".csv", "-fix.csv")
-    '''Open the csv doc and the output file temporarily created'''
-    with open(csv_document, 'r', newline='') as csv_to_clean, open(fixed_csv, 'w', newline='') as output_csv:
-        reader = csv.reader(csv_to_clean)
-        writer = csv.writer(output_csv)
-        '''Loop to check if the last part of the row is empty and delete appropriately'''
-        for row in reader:
-            while row and row[-1] == '':
-                row.pop()
-            writer.writerow(row)
-        '''Return fixed sheet'''
-    return fixed_csv
-    
+    Entries are only walked a constant number of times, so grouping is linear
+    in the number of sections. The entries are held in memory while grouping:
+    a group's members can be anywhere in the file (the entry that lists the
+    group may come after its first member), so rows can't be emitted as they
+    are read.
+
+    :param course_data: Parsed course entries (see ``parse_csv``).
+    :type course_data: iterable
+    :return: List of class rows, in insertion order.
+    :rtype: list
+    """
+    # both passes below need every entry, see above
+    course_data = list(course_data)
+
+    # crosslist key -> courses listed under it, plus each course's entries
+    cross_lists = {}
+    entries_by_course = {}
+    for position, entry in enumerate(course_data):
+        key = cross_list_key(entry.get("Cross-listings", ""))
+        if key:
+            cross_lists.setdefault(key, set()).add(entry["Course"])
+        entries_by_course.setdefault(entry["Course"], []).append((position, entry))
+
+    class_rows = []
+    emitted = set()
+    for entry in course_data:
+        cross_list = entry.get("Cross-listings", "").strip()
+        key = cross_list_key(cross_list)
+        if not key or key not in cross_list:
+            class_rows.append(entry)
+            continue
+        if key in emitted:
+            # the group row already exists, a second insert would be ignored
+            continue
+        emitted.add(key)
+
+        # Build the group (first member + summed enrollment) exactly once
+        members = [member for course in cross_lists[key] for member in entries_by_course[course]]
+        grouped_class = min(members, key=lambda member: member[0])[1]
+        class_rows.append({
+            "Term": grouped_class["Term"],
+            "Course": key,
+            "Section #": grouped_class["Section #"],
+            "Course Title": grouped_class["Course Title"],
+            "Room": grouped_class["Room"],
+            "Meeting Pattern": grouped_class["Meeting Pattern"],
+            "Enrollment": sum(int(member["Enrollment"]) for _, member in members),
+            "Maximum Enrollment": grouped_class["Cross-list Maximum"],
+            "Instructor": grouped_class["Instructor"],
+        })
+
+    return class_rows
+
+def strip_trailing_empty(reader):
+    """
+    Trim the trailing empty cells off every row of a csv reader.
+
+    The registrar export pads every row with trailing commas. This used to be
+    done by writing a second ``-fix.csv`` copy of the upload; now rows are
+    trimmed on the fly while they are being read.
+    """
+    for row in reader:
+        while row and row[-1] == '':
+            row.pop()
+        yield row
+
+class ColumnMap:
+    """
+    Column positions of one csv layout, looked up by header name.
+
+    Rows from ``strip_trailing_empty`` can be shorter than the header row, so
+    reads past the end of a row return the default and writes pad it first.
+    Build maps through ``get_column_map`` so each layout is only compiled once.
+    """
+
+    def __init__(self, headers):
+        self.headers = tuple(headers)
+        self.positions = {}
+        for position, name in enumerate(self.headers):
+            # same as headers.index(), the first column with a name wins
+            self.positions.setdefault(name, position)
+
+    def position(self, name):
+        """
+        Return the index of column ``name``.
+        """
+        try:
+            return self.positions[name]
+        except KeyError:
+            raise ValueError(f"Column '{name}' is missing from the csv headers") from None
+
+    def width(self, names):
+        """
+        Return how many cells a row needs to hold every column in ``names``.
+        """
+        return max(self.position(name) for name in names) + 1
+
+    def get(self, row, name, default=''):
+        """
+        Read column ``name`` from ``row``.
+        """
+        position = self.position(name)
+        return row[position] if position < len(row) else default
+
+    def set(self, row, name, value):
+        """
+        Write ``value`` into column ``name`` of ``row``.
+        """
+        position = self.position(name)
+        if position >= len(row):
+            row.extend([''] * (position + 1 - len(row)))
+        row[position] = value
+
+@lru_cache(maxsize=32)
+def _compile_column_map(headers):
+    return ColumnMap(headers)
+
+def get_column_map(headers):
+    """
+    Return the ``ColumnMap`` for a header row, cached by the header signature
+    so re-uploads and exports of the same layout share one map.
+    """
+    return _compile_column_map(tuple(headers))
+
+# One meeting of a class: a bitmask of weekdays (see DAY_BITS) plus the start
+# and end time in minutes after midnight
+Meeting = namedtuple("Meeting", ["days", "start", "end"])
+
+# Weekday letters used in the "Meeting Pattern" column
+DAY_BITS = {"M": 1, "T": 2, "W": 4, "R": 8, "Th": 8, "F": 16, "S": 32, "Sa": 32, "U": 64, "Su": 64}
+
+MINUTES_PER_DAY = 24 * 60
+
+# e.g. "MW 10:30am-11:45am" or "TTh 9:00-10:15"
+MEETING_PATTERN = re.compile(
+    r"^([A-Za-z]+)\s+(\d{1,2})(?::(\d{2}))?\s*([ap]m)?\s*-\s*(\d{1,2})(?::(\d{2}))?\s*([ap]m)?$",
+    re.IGNORECASE,
+)
+
+def _minutes(hour, minute, meridiem):
+    """
+    Convert a clock time from the csv to minutes after midnight.
+    """
+    hour = int(hour) % 12 if meridiem else int(hour)
+    if meridiem and meridiem.lower() == "pm":
+        hour += 12
+    return hour * 60 + int(minute or 0)
+
+def _day_bits(days):
+    """
+    Turn a weekday string like "MWF" or "TTh" into a bitmask, None if a
+    letter isn't recognized.
+    """
+    bits = 0
+    i = 0
+    while i < len(days):
+        # two letter abbreviations first ("Th", "Sa", "Su")
+        if days[i:i + 2] in DAY_BITS:
+            bits |= DAY_BITS[days[i:i + 2]]
+            i += 2
+        elif days[i] in DAY_BITS:
+            bits |= DAY_BITS[days[i]]
+            i += 1
+        else:
+            return None
+    return bits
+
+def parse_meeting_pattern(meeting_pattern):
+    """
+    Compile a "Meeting Pattern" cell into a tuple of ``Meeting`` entries.
+
+    Patterns with several meetings are separated by semicolons, e.g.
+    "TR 9am-10:15am; F 2pm-5pm". Returns None when the pattern can't be
+    parsed (empty, "Does Not Meet", ...), in which case callers should fall
+    back to comparing the raw strings.
+    """
+    meetings = []
+    for chunk in meeting_pattern.split(';'):
+        match = MEETING_PATTERN.match(chunk.strip())
+        if not match:
+            return None
+        days, start_h, start_m, start_mer, end_h, end_m, end_mer = match.groups()
+        bits = _day_bits(days)
+        if not bits:
+            return None
+        # "10-11:15am" only carries the suffix on the end time
+        start = _minutes(start_h, start_m, start_mer or end_mer)
+        end = _minutes(end_h, end_m, end_mer)
+        if not start_mer and end_mer and end_mer.lower() == "pm" and start >= end:
+            # "11:00-12:15pm" starts in the morning
+            start = _minutes(start_h, start_m, "am")
+        if end <= start:
+            return None
+        meetings.append(Meeting(bits, start, end))
+    return tuple(meetings)
+
+def week_intervals(meetings):
+    """
+    Spread compiled meetings over the week as ``(start, end)`` minute
+    intervals, one per day the class meets.
+    """
+    intervals = []
+    for meeting in meetings:
+        for day in range(7):
+            if meeting.days & (1 << day):
+                offset = day * MINUTES_PER_DAY
+                intervals.append((offset + meeting.start, offset + meeting.end))
+    return intervals
+
+def slot_conflicts(meeting_patterns):
+    """
+    Work out which timeslots overlap in time.
+
+    All meetings are laid out on one week-long timeline and swept in order of
+    start time while keeping a heap of the intervals still running, so this
+    is O(n log n + k) for n intervals and k overlapping pairs. Patterns that
+    can't be parsed only conflict with themselves.
+
+    :param meeting_patterns: Distinct "Meeting Pattern" strings; position i is
+        bit ``1 << i`` in the result.
+    :type meeting_patterns: list
+    :return: For each pattern, a bitmask of the patterns it overlaps
+        (including itself).
+    :rtype: list
+    """
+    conflicts = [1 << i for i in range(len(meeting_patterns))]
+
+    timeline = []
+    for i, meeting_pattern in enumerate(meeting_patterns):
+        meetings = parse_meeting_pattern(meeting_pattern)
+        if meetings:
+            timeline.extend((start, end, i) for start, end in week_intervals(meetings))
+    timeline.sort()
+
+    running = []  # heap of (end, pattern index)
+    for start, end, i in timeline:
+        while running and running[0][0] <= start:
+            heapq.heappop(running)
+        for _, j in running:
+            conflicts[i] |= 1 << j
+            conflicts[j] |= 1 << i
+        heapq.heappush(running, (end, i))
+
+    return conflicts